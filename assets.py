@@ -0,0 +1,119 @@
+import hashlib
+import mimetypes
+import os
+import threading
+
+from compression import compress, is_compressible
+
+# Cache lifetime sent with fingerprinted assets: a changed file gets a new URL,
+# so a URL's content never changes and browsers can keep it for a year
+ASSET_MAX_AGE = 365 * 24 * 3600
+# zlib level for the .gz files written next to text assets
+PRECOMPRESS_LEVEL = 9
+
+
+class _Asset:
+    def __init__(self, name, path):
+        self.name = name
+        self.path = path
+        self.mtime = None
+        self.data = b''
+        self.etag = ''
+        self.filename = ''
+        self.mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        self.gzip_data = None
+
+    def load(self, mtime):
+        with open(self.path, 'rb') as f:
+            self.data = f.read()
+        self.mtime = mtime
+        self.gzip_data = self._precompress() if is_compressible(self.mimetype) else None
+        self.etag = hashlib.sha256(self.data).hexdigest()[:16]
+        stem, ext = os.path.splitext(os.path.basename(self.name))
+        self.filename = f'{stem}.{self.etag}{ext}'
+
+    # Function to write the gzip sibling of the file unless an up-to-date
+    # one exists, and return its bytes; None if it wouldn't be smaller
+    def _precompress(self):
+        gz_path = self.path + '.gz'
+        if os.path.exists(gz_path) and os.path.getmtime(gz_path) >= self.mtime:
+            with open(gz_path, 'rb') as f:
+                data = f.read()
+        else:
+            data = compress(self.data, 'gzip', PRECOMPRESS_LEVEL)
+            tmp_path = gz_path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, gz_path)
+        return data if len(data) < len(self.data) else None
+
+
+# Static files served from memory under a URL that includes a hash of their
+# content. A file is read once and reread only when its mtime changes, at
+# which point its URL changes too. Responses carry a strong ETag,
+# Last-Modified and an immutable Cache-Control, and conditional requests
+# get a 304. Text assets get a .gz sibling written when they are loaded,
+# which is sent as is to clients that accept gzip.
+class AssetRegistry:
+    def __init__(self, url_prefix='/assets'):
+        self.url_prefix = url_prefix
+        self._assets = {}
+        self._by_filename = {}
+        self._lock = threading.Lock()
+
+    # Function to add a file under a logical name, e.g. register('logo.png', 'images 1.png')
+    def register(self, name, path):
+        with self._lock:
+            self._assets[name] = _Asset(name, path)
+        return self._current(name)
+
+    # Function to get an asset, reloading it if the file changed on disk
+    def _current(self, name):
+        with self._lock:
+            asset = self._assets[name]
+            mtime = os.path.getmtime(asset.path)
+            if asset.mtime != mtime:
+                self._by_filename.pop(asset.filename, None)
+                asset.load(mtime)
+                self._by_filename[asset.filename] = asset
+            return asset
+
+    # Function to get the fingerprinted URL of an asset; used from templates
+    def url(self, name):
+        return f'{self.url_prefix}/{self._current(name).filename}'
+
+    # Function to get the current filenames of every asset; changes whenever
+    # one of them does, so pages linking to assets can be cached against it
+    def version(self):
+        with self._lock:
+            names = list(self._assets)
+        return tuple(self._current(name).filename for name in names)
+
+    # Function to find the asset behind a fingerprinted filename, or None
+    # for an unknown or outdated fingerprint
+    def lookup(self, filename):
+        with self._lock:
+            asset = self._by_filename.get(filename)
+        if asset is None:
+            return None
+        asset = self._current(asset.name)
+        return asset if asset.filename == filename else None
+
+    # Function to build the response for a fingerprinted filename
+    def response(self, app, request, filename):
+        asset = self.lookup(filename)
+        if asset is None:
+            return None
+        if asset.gzip_data is not None and request.accept_encodings['gzip']:
+            response = app.response_class(asset.gzip_data, mimetype=asset.mimetype)
+            response.content_encoding = 'gzip'
+        else:
+            response = app.response_class(asset.data, mimetype=asset.mimetype)
+        if asset.gzip_data is not None:
+            response.vary.add('Accept-Encoding')
+        response.set_etag(asset.etag)
+        response.last_modified = asset.mtime
+        response.cache_control.public = True
+        response.cache_control.max_age = ASSET_MAX_AGE
+        response.cache_control.immutable = True
+        return response.make_conditional(request)
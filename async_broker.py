@@ -0,0 +1,126 @@
+import logging
+import threading
+from collections import deque
+from concurrent.futures import Future
+
+from pika.exceptions import ChannelClosedByBroker
+
+from confirms import ConfirmPublisher
+
+logger = logging.getLogger(__name__)
+
+
+class _AdminCall:
+    __slots__ = ('method', 'kwargs', 'future')
+
+    def __init__(self, method, kwargs):
+        self.method = method
+        self.kwargs = kwargs
+        self.future = Future()
+
+
+# Event-loop driven RabbitMQ client: the confirm publisher's SelectConnection
+# I/O thread also carries a second channel for exchange management. Every
+# call is thread-safe and returns a Future immediately, so Flask and
+# Socket.IO handlers never block on broker I/O; several calls can be in
+# flight at once on the single connection.
+class AsyncBroker(ConfirmPublisher):
+    def __init__(self, host, **kwargs):
+        super().__init__(host, **kwargs)
+        self._admin_channel = None
+        self._admin_pending = deque()
+        self._admin_inflight = deque()
+        self._admin_lock = threading.Lock()
+
+    def declare_exchange(self, exchange, exchange_type='fanout'):
+        return self._call('exchange_declare', exchange=exchange, exchange_type=exchange_type)
+
+    def delete_exchange(self, exchange):
+        return self._call('exchange_delete', exchange=exchange)
+
+    def bind_exchange(self, destination, source, routing_key=''):
+        return self._call('exchange_bind', destination=destination, source=source, routing_key=routing_key)
+
+    def _call(self, method, **kwargs):
+        call = _AdminCall(method, kwargs)
+        call.future.add_done_callback(self._log_failure)
+        with self._admin_lock:
+            self._admin_pending.append(call)
+        connection = self._connection
+        if connection is not None:
+            try:
+                connection.ioloop.add_callback_threadsafe(self._drain_admin)
+            except Exception:
+                # The loop is shutting down; pending calls run after reconnect
+                pass
+        return call.future
+
+    def _log_failure(self, future):
+        if future.exception() is not None:
+            logger.error('RabbitMQ exchange operation failed: %s', future.exception())
+
+    def _on_connection_open(self, connection):
+        super()._on_connection_open(connection)
+        connection.channel(on_open_callback=self._on_admin_channel_open)
+
+    def _on_connection_closed(self, connection, reason):
+        self._admin_channel = None
+        self._requeue_admin()
+        super()._on_connection_closed(connection, reason)
+
+    def _on_admin_channel_open(self, channel):
+        channel.add_on_close_callback(self._on_admin_channel_closed)
+        self._admin_channel = channel
+        self._drain_admin()
+
+    def _on_admin_channel_closed(self, channel, reason):
+        self._admin_channel = None
+        # RPCs complete in order, so the oldest in-flight call is the one the
+        # broker rejected; the rest are retried on a fresh channel
+        failed = None
+        if isinstance(reason, ChannelClosedByBroker):
+            with self._admin_lock:
+                failed = self._admin_inflight.popleft() if self._admin_inflight else None
+        if failed is not None:
+            failed.future.set_exception(ConnectionError(f'{failed.method} failed: {reason}'))
+        self._requeue_admin()
+        if self._connection is not None and self._connection.is_open:
+            self._connection.channel(on_open_callback=self._on_admin_channel_open)
+
+    def _requeue_admin(self):
+        with self._admin_lock:
+            while self._admin_inflight:
+                self._admin_pending.appendleft(self._admin_inflight.pop())
+
+    def _drain_admin(self):
+        channel = self._admin_channel
+        while channel is not None and channel.is_open:
+            with self._admin_lock:
+                if not self._admin_pending:
+                    return
+                call = self._admin_pending.popleft()
+                self._admin_inflight.append(call)
+            getattr(channel, call.method)(callback=lambda frame: self._on_admin_reply(), **call.kwargs)
+
+    def _on_admin_reply(self):
+        with self._admin_lock:
+            call = self._admin_inflight.popleft()
+        call.future.set_result(True)
+
+    def _fail_outstanding(self, error):
+        super()._fail_outstanding(error)
+        with self._admin_lock:
+            calls = list(self._admin_inflight) + list(self._admin_pending)
+            self._admin_inflight.clear()
+            self._admin_pending.clear()
+        for call in calls:
+            call.future.set_exception(error)
+
+    def close(self):
+        self.stop()
+
+    def stats(self):
+        stats = super().stats()
+        with self._admin_lock:
+            stats['admin_pending'] = len(self._admin_pending) + len(self._admin_inflight)
+        return stats
@@ -0,0 +1,81 @@
+import argparse
+import tempfile
+import threading
+import time
+
+import wire
+from broker import create_broker
+from pipeline import PublishPipeline
+from spool import Spool, SpoolingPublisher
+from topology import Topology
+
+# Throughput benchmark for the chat publish path: wire encoding, the batched
+# pipeline, the spooling publisher and broker confirms, with a second "node"
+# consuming every message. Runs against the in-memory broker by default so
+# app overhead can be measured without a RabbitMQ server.
+#
+#   python bench_publish.py --messages 100000
+#   python bench_publish.py --latency 0.002
+#   python bench_publish.py --backend rabbitmq --host localhost
+
+
+def run(backend, host, latency, messages, rooms, batch_size, exchange_mode):
+    broker = create_broker(backend, host, latency=latency)
+    topology = Topology(exchange_mode)
+    topology.declare_shared(broker.admin())
+    for i in range(rooms):
+        topology.declare_group(broker.admin(), f'room-{i}')
+
+    received = 0
+    done = threading.Event()
+
+    def on_message(exchange, routing_key, body):
+        nonlocal received
+        wire.decode(body)
+        received += 1
+        if received == messages:
+            done.set()
+
+    consumer = broker.consumer(on_message, node_id='bench-consumer')
+    consumer.start()
+    for i in range(rooms):
+        consumer.bind(*topology.route(f'room-{i}'), topology.exchange_type)
+
+    publisher = broker.publisher(app_id='bench-publisher')
+    publisher.start()
+    with tempfile.TemporaryDirectory() as spool_dir:
+        spooling = SpoolingPublisher(publisher, Spool(spool_dir))
+        pipeline = PublishPipeline(spooling.publish_batch, max_queue=messages, batch_size=batch_size)
+        pipeline.start()
+
+        started = time.perf_counter()
+        for i in range(messages):
+            room = f'room-{i % rooms}'
+            exchange, routing_key = topology.route(room)
+            pipeline.submit(exchange, routing_key, wire.encode(wire.new_message(room, 'bench', f'message {i}')))
+        submitted = time.perf_counter()
+        done.wait(300)
+        finished = time.perf_counter()
+
+        pipeline.stop()
+        spooling.stop()
+    publisher.stop()
+    consumer.stop()
+    broker.close()
+
+    print(f'backend={backend} latency={latency}s messages={messages} rooms={rooms} mode={exchange_mode}')
+    print(f'  submit:   {messages / (submitted - started):12,.0f} msg/s')
+    print(f'  delivered {received} in {finished - started:.3f}s: {received / (finished - started):12,.0f} msg/s')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the chat publish path')
+    parser.add_argument('--backend', default='memory', choices=['memory', 'rabbitmq', 'rabbitmq-async'])
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--messages', type=int, default=50000)
+    parser.add_argument('--rooms', type=int, default=100)
+    parser.add_argument('--batch-size', type=int, default=100)
+    parser.add_argument('--exchange-mode', default='fanout', choices=['fanout', 'topic'])
+    args = parser.parse_args()
+    run(args.backend, args.host, args.latency, args.messages, args.rooms, args.batch_size, args.exchange_mode)
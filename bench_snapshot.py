@@ -0,0 +1,69 @@
+import argparse
+import gc
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+
+from snapshot import read_snapshot, write_snapshot
+
+# Startup load benchmark: parsing the JSON credentials and groups files
+# against reading the binary snapshot, timing each load and its peak
+# Python memory use.
+#
+#   python bench_snapshot.py
+#   python bench_snapshot.py --users 100000 --groups 10000
+
+
+def load_json(credentials_file, groups_file):
+    with open(credentials_file, 'r') as f:
+        users = json.load(f)
+    with open(groups_file, 'r') as f:
+        groups = json.load(f)
+    return users, groups
+
+
+def measure(label, load, *args):
+    gc.collect()
+    started = time.perf_counter()
+    users, groups = load(*args)
+    elapsed = time.perf_counter() - started
+    del users, groups
+    gc.collect()
+    tracemalloc.start()
+    users, groups = load(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f'  {label:8} {elapsed:8.3f}s  peak {peak / 1024 / 1024:8.1f} MiB  '
+          f'({len(users):,} users, {len(groups):,} groups)')
+
+
+def run(users_count, groups_count):
+    # SHA-256 hex digests, as stored by the app
+    users = {f'user{i}': f'{i:064x}' for i in range(users_count)}
+    groups = [{'name': f'group-{i}'} for i in range(groups_count)]
+    with tempfile.TemporaryDirectory() as directory:
+        credentials_file = os.path.join(directory, 'user_credentials.json')
+        groups_file = os.path.join(directory, 'groups.json')
+        snapshot_file = os.path.join(directory, 'state.snapshot')
+        with open(credentials_file, 'w') as f:
+            json.dump(users, f)
+        with open(groups_file, 'w') as f:
+            json.dump(groups, f)
+        write_snapshot(snapshot_file, users, groups)
+        del users, groups
+
+        json_bytes = os.path.getsize(credentials_file) + os.path.getsize(groups_file)
+        print(f'users={users_count} groups={groups_count}')
+        print(f'  json {json_bytes / 1024 / 1024:.1f} MiB, snapshot {os.path.getsize(snapshot_file) / 1024 / 1024:.1f} MiB')
+        measure('json', load_json, credentials_file, groups_file)
+        measure('snapshot', read_snapshot, snapshot_file)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark loading users and groups at startup')
+    parser.add_argument('--users', type=int, default=1_000_000)
+    parser.add_argument('--groups', type=int, default=100_000)
+    args = parser.parse_args()
+    run(args.users, args.groups)
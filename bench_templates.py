@@ -0,0 +1,56 @@
+import argparse
+import time
+
+from flask import Flask, render_template, render_template_string
+
+from page_templates import TEMPLATES
+from template_registry import register_templates
+
+# Per-request render time of each page, compiling its source every time with
+# render_template_string (the old routes) against rendering the template
+# compiled once by the registry. Uses a bare Flask app, so no broker, storage
+# or background threads are started.
+#
+#   python bench_templates.py --iterations 2000
+
+CONTEXTS = {
+    'welcome.html': {},
+    'signin.html': {},
+    'signup.html': {},
+    'groups.html': {'groups': [{'name': f'group-{i}'} for i in range(20)], 'profile_image': None},
+    'profile.html': {'username': 'bench', 'profile_image': None},
+    'chat.html': {'group_name': 'bench', 'username': 'bench', 'messages': [], 'oldest': None},
+}
+
+
+def create_app():
+    app = Flask(__name__)
+    app.secret_key = 'bench'
+    app.jinja_env.globals['asset_url'] = lambda name: f'/assets/{name}'
+    register_templates(app, TEMPLATES)
+    return app
+
+
+def time_per_call(fn, iterations):
+    started = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - started) / iterations * 1_000_000
+
+
+def run(iterations):
+    print(f'{"page":14} {"string":>12} {"compiled":>12}  speedup')
+    app = create_app()
+    with app.test_request_context('/'):
+        for name, context in CONTEXTS.items():
+            source = TEMPLATES[name]
+            before = time_per_call(lambda: render_template_string(source, **context), iterations)
+            after = time_per_call(lambda: render_template(name, **context), iterations)
+            print(f'{name:14} {before:10.1f}us {after:10.1f}us  {before / after:6.1f}x')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark page template rendering')
+    parser.add_argument('--iterations', type=int, default=1000)
+    args = parser.parse_args()
+    run(args.iterations)
@@ -0,0 +1,205 @@
+import os
+import queue
+import threading
+from contextlib import contextmanager
+
+import pika
+from pika.exceptions import AMQPError
+
+from async_broker import AsyncBroker
+from confirms import ConfirmPublisher
+from consumer import ConsumerBridge
+from history import StreamHistory
+from memory_broker import MemoryBroker
+from reconcile import list_exchanges
+
+# Number of persistent connections kept open per process
+POOL_SIZE = 4
+# How long a handler waits for a free channel before giving up
+ACQUIRE_TIMEOUT = 5
+# How many times an operation is retried on a fresh connection
+PUBLISH_RETRIES = 1
+
+
+# One persistent BlockingConnection with a single channel. pika connections
+# are not thread-safe, so a slot is only ever used by one thread at a time.
+class _PooledChannel:
+    def __init__(self, parameters):
+        self.parameters = parameters
+        self.connection = None
+        self.channel = None
+
+    def is_open(self):
+        return (self.connection is not None and self.connection.is_open
+                and self.channel is not None and self.channel.is_open)
+
+    def ensure_open(self):
+        if self.is_open():
+            # Service heartbeats that arrived while the slot was idle
+            self.connection.process_data_events(time_limit=0)
+            if self.is_open():
+                return self.channel
+        self.close()
+        self.connection = pika.BlockingConnection(self.parameters)
+        self.channel = self.connection.channel()
+        return self.channel
+
+    def close(self):
+        try:
+            if self.connection is not None and self.connection.is_open:
+                self.connection.close()
+        except AMQPError:
+            pass
+        self.connection = None
+        self.channel = None
+
+
+# Process-wide pool of persistent RabbitMQ channels shared by the Flask and
+# Socket.IO handlers. Connections are opened lazily and reopened transparently
+# when the broker drops them.
+class ChannelPool:
+    def __init__(self, host, size=POOL_SIZE, acquire_timeout=ACQUIRE_TIMEOUT, retries=PUBLISH_RETRIES):
+        self.parameters = pika.ConnectionParameters(host)
+        self.acquire_timeout = acquire_timeout
+        self.retries = retries
+        self._slots = queue.LifoQueue()
+        for _ in range(size):
+            self._slots.put(_PooledChannel(self.parameters))
+
+    @contextmanager
+    def channel(self):
+        try:
+            slot = self._slots.get(timeout=self.acquire_timeout)
+        except queue.Empty:
+            raise TimeoutError('No RabbitMQ channel became available')
+        try:
+            yield slot.ensure_open()
+        except (AMQPError, OSError):
+            # Drop the broken connection; the next user of the slot reconnects
+            slot.close()
+            raise
+        finally:
+            self._slots.put(slot)
+
+    # Run fn(channel), retrying on a fresh connection if the old one died
+    def run(self, fn):
+        attempt = 0
+        while True:
+            try:
+                with self.channel() as channel:
+                    return fn(channel)
+            except (AMQPError, OSError):
+                if attempt >= self.retries:
+                    raise
+                attempt += 1
+
+    def publish(self, exchange, routing_key, body, properties=None):
+        self.run(lambda channel: channel.basic_publish(
+            exchange=exchange, routing_key=routing_key, body=body, properties=properties))
+
+    # Publish a list of (exchange, routing_key, body) tuples on one channel
+    def publish_batch(self, messages, properties=None):
+        def publish_all(channel):
+            for exchange, routing_key, body in messages:
+                channel.basic_publish(exchange=exchange, routing_key=routing_key, body=body, properties=properties)
+        self.run(publish_all)
+
+    def declare_exchange(self, exchange, exchange_type='fanout'):
+        self.run(lambda channel: channel.exchange_declare(exchange=exchange, exchange_type=exchange_type))
+
+    def delete_exchange(self, exchange):
+        self.run(lambda channel: channel.exchange_delete(exchange=exchange))
+
+    def bind_exchange(self, destination, source, routing_key=''):
+        self.run(lambda channel: channel.exchange_bind(destination=destination, source=source, routing_key=routing_key))
+
+    def close(self):
+        while True:
+            try:
+                slot = self._slots.get_nowait()
+            except queue.Empty:
+                break
+            slot.close()
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+# Function to get the process-wide channel pool, rebuilding it after a fork
+# so child workers never share sockets with their parent
+def get_pool(host):
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ChannelPool(host)
+            _pool_pid = os.getpid()
+        return _pool
+
+
+# Function to close the process-wide channel pool
+def close_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None and _pool_pid == os.getpid():
+            _pool.close()
+        _pool = None
+
+
+# RabbitMQ backend: pooled channels for admin calls, a confirm-mode publisher
+# and a consumer bridge, all talking to the broker at `host`. With async_io
+# the publisher and the admin calls share one event-loop driven connection
+# (async_broker.AsyncBroker) whose calls return Futures instead of blocking.
+class PikaBroker:
+    def __init__(self, host, async_io=False):
+        self.host = host
+        self.async_io = async_io
+        self._io = None
+        self._io_lock = threading.Lock()
+
+    def _async_broker(self, **kwargs):
+        with self._io_lock:
+            if self._io is None:
+                self._io = AsyncBroker(self.host, **kwargs)
+            return self._io
+
+    def admin(self):
+        if self.async_io:
+            return self._async_broker()
+        return get_pool(self.host)
+
+    # In async_io mode create the publisher before the first admin() call so
+    # the shared connection gets the publisher's settings, and start() it
+    def publisher(self, **kwargs):
+        if self.async_io:
+            return self._async_broker(**kwargs)
+        return ConfirmPublisher(self.host, **kwargs)
+
+    def consumer(self, on_message, **kwargs):
+        return ConsumerBridge(self.host, on_message, **kwargs)
+
+    def history(self, topology, **kwargs):
+        return StreamHistory(get_pool(self.host), topology, **kwargs)
+
+    # Exchanges on the broker as {name: type}, or None without the management API
+    def list_exchanges(self):
+        return list_exchanges(self.host)
+
+    def close(self):
+        if self._io is not None:
+            self._io.stop()
+        close_pool()
+
+
+# Function to build the broker backend named in the app config: 'rabbitmq'
+# for a real broker, 'rabbitmq-async' for the same over a non-blocking
+# connection, or 'memory' for the in-process stand-in
+def create_broker(backend, host, latency=0.0):
+    if backend == 'rabbitmq':
+        return PikaBroker(host)
+    if backend == 'rabbitmq-async':
+        return PikaBroker(host, async_io=True)
+    if backend == 'memory':
+        return MemoryBroker(latency=latency)
+    raise ValueError(f'Unknown broker backend: {backend}')
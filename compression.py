@@ -0,0 +1,123 @@
+import gzip
+import zlib
+
+from werkzeug.datastructures import Headers
+from werkzeug.http import parse_accept_header, parse_etags, quote_etag, unquote_etag
+
+# Responses smaller than this are sent as they are; compressing them saves
+# less than the header costs
+COMPRESS_MIN_SIZE = 500
+# zlib level, 1 (fastest) to 9 (smallest)
+COMPRESS_LEVEL = 6
+
+_COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/javascript', 'image/svg+xml')
+_ENCODINGS = ('gzip', 'deflate')
+
+
+# Function to pick the encoding to answer with, preferring gzip; None if the
+# client accepts neither
+def negotiate_encoding(accept_encoding):
+    accepted = parse_accept_header(accept_encoding)
+    for encoding in _ENCODINGS:
+        if accepted.quality(encoding) > 0:
+            return encoding
+    return None
+
+
+def is_compressible(content_type):
+    return content_type.startswith(_COMPRESSIBLE_TYPES)
+
+
+def compress(data, encoding, level=COMPRESS_LEVEL):
+    if encoding == 'gzip':
+        return gzip.compress(data, compresslevel=level, mtime=0)
+    return zlib.compress(data, level)
+
+
+# Function to give an entity tag the suffix of an encoding, so a compressed
+# representation keeps a strong ETag distinct from the uncompressed one
+def encoded_etag(etag, encoding):
+    tag, weak = unquote_etag(etag)
+    if weak or tag.endswith('-' + encoding):
+        return etag
+    return quote_etag(f'{tag}-{encoding}')
+
+
+# WSGI middleware compressing responses with gzip or deflate, as negotiated
+# from Accept-Encoding, when they are compressible and at least min_size
+# bytes. ETags of compressed responses get an encoding suffix; the suffix is
+# removed from If-None-Match before the app sees it, so the app keeps
+# comparing against its own tags and a 304 gets the suffix back. Responses
+# the app already encoded, such as precompressed assets, are passed through
+# with their ETag suffixed the same way.
+class CompressionMiddleware:
+    def __init__(self, app, min_size=COMPRESS_MIN_SIZE, level=COMPRESS_LEVEL):
+        self.app = app
+        self.min_size = min_size
+        self.level = level
+
+    def __call__(self, environ, start_response):
+        encoding = negotiate_encoding(environ.get('HTTP_ACCEPT_ENCODING', ''))
+        if encoding is None:
+            return self.app(environ, start_response)
+        if_none_match = environ.get('HTTP_IF_NONE_MATCH')
+        revalidating = False
+        if if_none_match:
+            environ['HTTP_IF_NONE_MATCH'], revalidating = self._strip_suffixes(if_none_match, encoding)
+
+        captured = {}
+        chunks = []
+
+        def capture(status, headers, exc_info=None):
+            captured['status'] = status
+            captured['headers'] = headers
+            captured['exc_info'] = exc_info
+            return chunks.append
+
+        app_iter = self.app(environ, capture)
+        try:
+            chunks.extend(app_iter)
+        finally:
+            if hasattr(app_iter, 'close'):
+                app_iter.close()
+        body = b''.join(chunks)
+        headers = Headers(captured['headers'])
+        status = captured['status']
+
+        content_encoding = headers.get('Content-Encoding')
+        if content_encoding is None and self._should_compress(status, headers, body):
+            body = compress(body, encoding, self.level)
+            headers['Content-Encoding'] = content_encoding = encoding
+            headers['Content-Length'] = str(len(body))
+            vary = headers.get('Vary')
+            headers['Vary'] = f'{vary}, Accept-Encoding' if vary else 'Accept-Encoding'
+        elif status.startswith('304') and revalidating:
+            # The client revalidated the compressed representation it holds
+            content_encoding = encoding
+        etag = headers.get('ETag')
+        if etag and content_encoding in _ENCODINGS:
+            headers['ETag'] = encoded_etag(etag, content_encoding)
+
+        start_response(status, headers.to_wsgi_list(), captured['exc_info'])
+        return [body]
+
+    # Function to remove encoding suffixes from If-None-Match; also tells
+    # whether a tag carried the suffix of the encoding being negotiated
+    def _strip_suffixes(self, value, encoding):
+        etags = parse_etags(value)
+        if etags.star_tag:
+            return value, False
+        tags = []
+        revalidating = False
+        for tag in etags.as_set(include_weak=True):
+            for suffix in _ENCODINGS:
+                if tag.endswith('-' + suffix):
+                    tag = tag[:-len(suffix) - 1]
+                    revalidating = revalidating or suffix == encoding
+            tags.append(quote_etag(tag))
+        return ', '.join(tags), revalidating
+
+    def _should_compress(self, status, headers, body):
+        return (status.startswith('200') and len(body) >= self.min_size
+                and is_compressible(headers.get('Content-Type', ''))
+                and 'no-transform' not in headers.get('Cache-Control', ''))
@@ -0,0 +1,304 @@
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+
+import pika
+from pika.spec import Basic
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of published-but-unconfirmed messages
+CONFIRM_WINDOW = 1000
+# How many times a nacked or lost message is republished before failing
+CONFIRM_MAX_RETRIES = 3
+# Seconds to wait before reconnecting after the connection drops
+RECONNECT_DELAY = 1.0
+# Longest publish() waits for a free slot in a full window while connected
+CONFIRM_SLOT_TIMEOUT = 5.0
+
+
+class PublishNacked(Exception):
+    pass
+
+
+class PublishWindowFull(Exception):
+    pass
+
+
+# Published to an exchange that does not exist; retrying can't help
+class ExchangeNotFound(Exception):
+    pass
+
+
+class PublishRetriesExhausted(Exception):
+    pass
+
+
+# Function to get the exchange named in a broker's 404 channel close, e.g.
+# "NOT_FOUND - no exchange 'chat.room1' in vhost '/'", or None
+def missing_exchange(reason):
+    if not isinstance(reason, pika.exceptions.ChannelClosedByBroker) or reason.reply_code != 404:
+        return None
+    match = re.search(r"no exchange '(.*)' in vhost", reason.reply_text or '')
+    return match.group(1) if match else None
+
+
+class _Pending:
+    __slots__ = ('exchange', 'routing_key', 'body', 'properties', 'future', 'attempts')
+
+    def __init__(self, exchange, routing_key, body, properties):
+        self.exchange = exchange
+        self.routing_key = routing_key
+        self.body = body
+        self.properties = properties
+        self.future = Future()
+        self.attempts = 0
+
+
+# Unconfirmed messages keyed by delivery tag, in publish order, so a
+# multiple=True ack or nack settles a prefix of the window in one pass.
+class ConfirmWindow:
+    def __init__(self):
+        self._unconfirmed = OrderedDict()
+
+    def __len__(self):
+        return len(self._unconfirmed)
+
+    def add(self, delivery_tag, entry):
+        self._unconfirmed[delivery_tag] = entry
+
+    def settle(self, delivery_tag, multiple):
+        if not multiple:
+            entry = self._unconfirmed.pop(delivery_tag, None)
+            return [entry] if entry is not None else []
+        settled = []
+        while self._unconfirmed:
+            tag = next(iter(self._unconfirmed))
+            if tag > delivery_tag:
+                break
+            settled.append(self._unconfirmed.pop(tag))
+        return settled
+
+    def clear(self):
+        entries = list(self._unconfirmed.values())
+        self._unconfirmed.clear()
+        return entries
+
+
+# Publisher that runs a SelectConnection in its own I/O thread with publisher
+# confirms enabled. publish() returns a Future that resolves when the broker
+# acks the message, so callers never wait a round-trip per message; at most
+# `window` messages are unconfirmed at any time.
+class ConfirmPublisher:
+    def __init__(self, host, window=CONFIRM_WINDOW, max_retries=CONFIRM_MAX_RETRIES,
+                 reconnect_delay=RECONNECT_DELAY, app_id=None, content_type=None):
+        self.parameters = pika.ConnectionParameters(host)
+        # Stamped on every message so consumers can recognise the publishing node
+        self.default_properties = pika.BasicProperties(app_id=app_id, content_type=content_type)
+        self.max_retries = max_retries
+        self.reconnect_delay = reconnect_delay
+        self._slots = threading.BoundedSemaphore(window)
+        self._outbox = deque()
+        self._window = ConfirmWindow()
+        self._lock = threading.Lock()
+        self._connection = None
+        self._channel = None
+        self._next_tag = 1
+        self._running = False
+        self._thread = None
+        self._metrics = {'published': 0, 'acked': 0, 'nacked': 0, 'retried': 0, 'failed': 0}
+        self._connect_callbacks = []
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='confirm-publisher', daemon=True)
+        self._thread.start()
+
+    # Queue a message and return a Future for its broker confirmation.
+    # Waits up to `timeout` seconds while the in-flight window is full, and not
+    # at all while disconnected, since no confirms can free a slot until the
+    # connection is back; raises PublishWindowFull if no slot frees up.
+    def publish(self, exchange, routing_key, body, properties=None, timeout=CONFIRM_SLOT_TIMEOUT):
+        if not self._slots.acquire(timeout=timeout if self.is_connected() else 0):
+            raise PublishWindowFull(f'Publish window is full ({len(self._window)} unconfirmed)')
+        entry = _Pending(exchange, routing_key, body, properties or self.default_properties)
+        with self._lock:
+            self._outbox.append(entry)
+            connection = self._connection
+        if connection is not None:
+            try:
+                connection.ioloop.add_callback_threadsafe(self._drain_outbox)
+            except Exception:
+                # The loop is shutting down; the outbox is drained after reconnect
+                pass
+        return entry.future
+
+    def is_connected(self):
+        return self._channel is not None and self._channel.is_open
+
+    # Register fn() to run after every (re)connect. It is called on the I/O
+    # thread, so it must hand any blocking work to another thread.
+    def add_connect_callback(self, fn):
+        self._connect_callbacks.append(fn)
+
+    def _run(self):
+        while self._running:
+            self._connection = pika.SelectConnection(
+                self.parameters,
+                on_open_callback=self._on_connection_open,
+                on_open_error_callback=self._on_connection_error,
+                on_close_callback=self._on_connection_closed,
+            )
+            self._connection.ioloop.start()
+            with self._lock:
+                self._connection = None
+            self._requeue_unconfirmed()
+            if self._running:
+                time.sleep(self.reconnect_delay)
+        self._fail_outstanding(ConnectionError('Publisher stopped'))
+
+    def _on_connection_open(self, connection):
+        self._open_channel()
+        for fn in self._connect_callbacks:
+            try:
+                fn()
+            except Exception:
+                logger.exception('Connect callback failed')
+
+    def _on_connection_error(self, connection, error):
+        logger.warning('Could not connect to RabbitMQ: %s', error)
+        connection.ioloop.stop()
+
+    def _on_connection_closed(self, connection, reason):
+        self._channel = None
+        connection.ioloop.stop()
+
+    def _open_channel(self):
+        self._connection.channel(on_open_callback=self._on_channel_open)
+
+    def _on_channel_open(self, channel):
+        channel.add_on_close_callback(self._on_channel_closed)
+        channel.confirm_delivery(ack_nack_callback=self._on_confirm,
+                                 callback=lambda frame: self._on_confirm_mode(channel))
+
+    def _on_confirm_mode(self, channel):
+        self._channel = channel
+        self._next_tag = 1
+        self._drain_outbox()
+
+    def _on_channel_closed(self, channel, reason):
+        logger.warning('Publisher channel closed: %s', reason)
+        self._channel = None
+        exchange = missing_exchange(reason)
+        if exchange is not None:
+            # One publish to a deleted exchange closes the channel for the whole
+            # window: fail only the messages for that exchange
+            self._fail_exchange(exchange)
+        else:
+            self._requeue_unconfirmed()
+        if self._connection is not None and self._connection.is_open:
+            self._open_channel()
+
+    def _drain_outbox(self):
+        channel = self._channel
+        while channel is not None and channel.is_open:
+            with self._lock:
+                if not self._outbox:
+                    return
+                entry = self._outbox.popleft()
+            channel.basic_publish(entry.exchange, entry.routing_key, entry.body, entry.properties)
+            entry.attempts += 1
+            self._window.add(self._next_tag, entry)
+            self._next_tag += 1
+            self._metrics['published'] += 1
+
+    def _on_confirm(self, frame):
+        method = frame.method
+        entries = self._window.settle(method.delivery_tag, method.multiple)
+        if isinstance(method, Basic.Ack):
+            self._metrics['acked'] += len(entries)
+            for entry in entries:
+                self._resolve(entry, None)
+        else:
+            self._metrics['nacked'] += len(entries)
+            for entry in reversed(entries):
+                self._retry(entry, PublishNacked(f'Broker nacked message for {entry.exchange}'))
+            self._drain_outbox()
+
+    def _retry(self, entry, error):
+        if entry.attempts > self.max_retries:
+            self._metrics['failed'] += 1
+            exhausted = PublishRetriesExhausted(f'Gave up on a message for {entry.exchange} after {entry.attempts} attempts: {error}')
+            exhausted.__cause__ = error
+            self._resolve(entry, exhausted)
+            return
+        self._metrics['retried'] += 1
+        with self._lock:
+            self._outbox.appendleft(entry)
+
+    # Messages unconfirmed when a channel dies may or may not have reached the
+    # broker; republish them in their original order
+    def _requeue_unconfirmed(self):
+        for entry in reversed(self._window.clear()):
+            self._retry(entry, ConnectionError('Connection lost before the broker confirmed'))
+
+    # Fail unconfirmed and queued messages for a missing exchange, and republish
+    # the rest without charging the lost channel against their retries
+    def _fail_exchange(self, exchange):
+        error = ExchangeNotFound(exchange)
+        with self._lock:
+            queued = [entry for entry in self._outbox if entry.exchange == exchange]
+            self._outbox = deque(entry for entry in self._outbox if entry.exchange != exchange)
+        for entry in reversed(self._window.clear()):
+            if entry.exchange == exchange:
+                queued.append(entry)
+                continue
+            entry.attempts -= 1
+            self._metrics['retried'] += 1
+            with self._lock:
+                self._outbox.appendleft(entry)
+        self._metrics['failed'] += len(queued)
+        for entry in queued:
+            self._resolve(entry, error)
+
+    def _resolve(self, entry, error):
+        self._slots.release()
+        if error is None:
+            entry.future.set_result(True)
+        else:
+            entry.future.set_exception(error)
+
+    def _fail_outstanding(self, error):
+        with self._lock:
+            entries = list(self._outbox)
+            self._outbox.clear()
+        for entry in entries + self._window.clear():
+            self._resolve(entry, error)
+
+    def _close_connection(self):
+        if self._connection is not None and self._connection.is_open:
+            self._connection.close()
+
+    def stop(self, timeout=5.0):
+        self._running = False
+        connection = self._connection
+        if connection is not None:
+            try:
+                connection.ioloop.add_callback_threadsafe(self._close_connection)
+            except Exception:
+                pass
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._metrics)
+            stats['outbox'] = len(self._outbox)
+        stats['in_flight'] = len(self._window)
+        return stats
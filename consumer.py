@@ -0,0 +1,235 @@
+import logging
+import threading
+import time
+import uuid
+from collections import Counter
+
+import pika
+
+logger = logging.getLogger(__name__)
+
+# Seconds to wait before reconnecting after the connection drops
+RECONNECT_DELAY = 1.0
+
+# Identifies this process on the broker so it can skip its own messages
+NODE_ID = uuid.uuid4().hex
+
+
+# Tracks which rooms have members connected to this process, so the node only
+# binds to exchanges it actually needs to fan messages out for.
+class LocalRooms:
+    def __init__(self):
+        self._rooms_by_sid = {}
+        self._members = Counter()
+        self._lock = threading.Lock()
+
+    # Returns True if this is the first local member of the room
+    def join(self, sid, room):
+        with self._lock:
+            rooms = self._rooms_by_sid.setdefault(sid, set())
+            if room in rooms:
+                return False
+            rooms.add(room)
+            self._members[room] += 1
+            return self._members[room] == 1
+
+    # Returns True if the last local member left the room
+    def leave(self, sid, room):
+        with self._lock:
+            rooms = self._rooms_by_sid.get(sid)
+            if not rooms or room not in rooms:
+                return False
+            rooms.discard(room)
+            if not rooms:
+                del self._rooms_by_sid[sid]
+            return self._release(room)
+
+    # Returns the rooms that lost their last local member
+    def disconnect(self, sid):
+        with self._lock:
+            rooms = self._rooms_by_sid.pop(sid, set())
+            return [room for room in rooms if self._release(room)]
+
+    def _release(self, room):
+        self._members[room] -= 1
+        if self._members[room] <= 0:
+            del self._members[room]
+            return True
+        return False
+
+    def active(self):
+        with self._lock:
+            return set(self._members)
+
+
+# Consumes chat messages for the rooms this node has members in and hands
+# them to on_message(exchange, routing_key, body). Each node gets an exclusive
+# server-named queue; bindings are added and removed as local rooms fill and
+# empty, and are restored after a reconnect.
+class ConsumerBridge:
+    def __init__(self, host, on_message, node_id=NODE_ID, reconnect_delay=RECONNECT_DELAY, exchange_cache=None):
+        self.parameters = pika.ConnectionParameters(host)
+        self.on_message = on_message
+        self.node_id = node_id
+        # Exchanges known to exist are bound without being redeclared first
+        self.exchange_cache = exchange_cache
+        self.reconnect_delay = reconnect_delay
+        self._bindings = set()
+        self._bound = set()
+        self._lock = threading.Lock()
+        self._connection = None
+        self._channel = None
+        self._queue = None
+        self._running = False
+        self._thread = None
+        self._metrics = {'received': 0, 'echoes_skipped': 0}
+        self._connect_callbacks = []
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='consumer-bridge', daemon=True)
+        self._thread.start()
+
+    def bind(self, exchange, routing_key='', exchange_type='fanout'):
+        with self._lock:
+            self._bindings.add((exchange, routing_key, exchange_type))
+        self._schedule(self._sync_bindings)
+
+    def unbind(self, exchange, routing_key='', exchange_type='fanout'):
+        with self._lock:
+            self._bindings.discard((exchange, routing_key, exchange_type))
+        self._schedule(self._sync_bindings)
+
+    # Register fn() to run every time the queue starts consuming after a
+    # (re)connect; anything published while it was down was never delivered
+    # to it. Called on the I/O thread, so it must hand blocking work off.
+    def add_connect_callback(self, fn):
+        self._connect_callbacks.append(fn)
+
+    def _schedule(self, callback):
+        connection = self._connection
+        if connection is None:
+            return
+        try:
+            connection.ioloop.add_callback_threadsafe(callback)
+        except Exception:
+            # The loop is shutting down; bindings are restored after reconnect
+            pass
+
+    def _run(self):
+        while self._running:
+            self._connection = pika.SelectConnection(
+                self.parameters,
+                on_open_callback=self._on_connection_open,
+                on_open_error_callback=self._on_connection_error,
+                on_close_callback=self._on_connection_closed,
+            )
+            self._connection.ioloop.start()
+            self._connection = None
+            self._channel = None
+            self._queue = None
+            self._bound.clear()
+            if self._running:
+                time.sleep(self.reconnect_delay)
+
+    def _on_connection_open(self, connection):
+        connection.channel(on_open_callback=self._on_channel_open)
+
+    def _on_connection_error(self, connection, error):
+        logger.warning('Could not connect to RabbitMQ: %s', error)
+        connection.ioloop.stop()
+
+    def _on_connection_closed(self, connection, reason):
+        connection.ioloop.stop()
+
+    def _on_channel_open(self, channel):
+        self._channel = channel
+        channel.add_on_close_callback(self._on_channel_closed)
+        channel.queue_declare('', exclusive=True, auto_delete=True, callback=self._on_queue_declared)
+
+    def _on_channel_closed(self, channel, reason):
+        logger.warning('Consumer channel closed: %s', reason)
+        if self._connection is not None and self._connection.is_open:
+            self._connection.close()
+
+    def _on_queue_declared(self, frame):
+        self._queue = frame.method.queue
+        self._channel.basic_consume(self._queue, self._on_delivery, auto_ack=True)
+        self._sync_bindings()
+        for fn in self._connect_callbacks:
+            try:
+                fn()
+            except Exception:
+                logger.exception('Connect callback failed')
+
+    def _sync_bindings(self):
+        if self._connection is None or not self._connection.is_open or self._queue is None:
+            return
+        with self._lock:
+            wanted = set(self._bindings)
+        for binding in wanted - self._bound:
+            self._bound.add(binding)
+            self._connection.channel(on_open_callback=lambda channel, binding=binding: self._bind(channel, binding))
+        for binding in self._bound - wanted:
+            self._bound.discard(binding)
+            self._connection.channel(on_open_callback=lambda channel, binding=binding: self._unbind(channel, binding))
+
+    # Each binding change runs on its own short-lived channel, so a broker
+    # error on one (a deleted exchange, a type clash) closes only that channel
+    # and leaves the consumer and the other bindings running
+    def _bind(self, channel, binding):
+        exchange, routing_key, exchange_type = binding
+        queue = self._queue
+        channel.add_on_close_callback(lambda channel, reason: self._on_binding_closed(binding, reason))
+
+        def on_declared(frame=None):
+            if self.exchange_cache is not None:
+                self.exchange_cache.add(exchange)
+            channel.queue_bind(queue, exchange, routing_key=routing_key, callback=lambda frame: channel.close())
+
+        # Declaring first makes binding to a group whose exchange is missing harmless
+        if self.exchange_cache is None or exchange not in self.exchange_cache:
+            channel.exchange_declare(exchange, exchange_type=exchange_type, callback=on_declared)
+        else:
+            channel.queue_bind(queue, exchange, routing_key=routing_key, callback=lambda frame: channel.close())
+
+    def _unbind(self, channel, binding):
+        exchange, routing_key, _ = binding
+        channel.queue_unbind(self._queue, exchange, routing_key=routing_key, callback=lambda frame: channel.close())
+
+    def _on_binding_closed(self, binding, reason):
+        if isinstance(reason, pika.exceptions.ChannelClosedByBroker):
+            logger.warning('Could not bind to %s: %s', binding[0], reason)
+            # Forget it so the next sync (a later join or a reconnect) retries
+            self._bound.discard(binding)
+            if self.exchange_cache is not None:
+                self.exchange_cache.discard(binding[0])
+
+    def _on_delivery(self, channel, method, properties, body):
+        if properties.app_id == self.node_id:
+            self._metrics['echoes_skipped'] += 1
+            return
+        self._metrics['received'] += 1
+        try:
+            self.on_message(method.exchange, method.routing_key, body)
+        except Exception:
+            logger.exception('Failed to fan out a message for %s', method.exchange)
+
+    def _close_connection(self):
+        if self._connection is not None and self._connection.is_open:
+            self._connection.close()
+
+    def stop(self, timeout=5.0):
+        self._running = False
+        self._schedule(self._close_connection)
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def stats(self):
+        stats = dict(self._metrics)
+        with self._lock:
+            stats['bindings'] = len(self._bindings)
+        return stats
@@ -0,0 +1,158 @@
+import threading
+from collections import deque
+from datetime import datetime, timedelta
+
+# Messages kept in memory per group so repeated joins don't reread the stream
+HISTORY_CACHE_SIZE = 200
+# How far back the first read of a group's stream starts
+HISTORY_LOOKBACK = timedelta(days=1)
+# Retention applied to each group's stream on the broker
+STREAM_MAX_AGE = '7D'
+STREAM_MAX_BYTES = 1024 * 1024 * 1024
+# Prefetch and idle cut-off used when reading a stream to its current end
+READ_PREFETCH = 500
+READ_IDLE_TIMEOUT = 0.1
+
+
+# Function to get the name of the stream holding a group's history
+def stream_name(group_name):
+    return f'history.{group_name}'
+
+
+class _GroupCache:
+    def __init__(self, size):
+        self.messages = deque(maxlen=size)
+        self.next_offset = None
+        self.lock = threading.Lock()
+
+    def extend(self, messages):
+        self.messages.extend(messages)
+        if messages:
+            self.next_offset = messages[-1][0] + 1
+
+    def since(self, offset):
+        return [entry for entry in self.messages if entry[0] >= offset]
+
+
+# Function to pick the requested slice out of a list of (offset, body) entries
+def _select(entries, limit):
+    if limit is not None:
+        return entries[-limit:] if limit else []
+    return entries
+
+
+# Group history kept in one RabbitMQ stream per group. The stream is bound to
+# the group's route, so every published message is recorded with no extra
+# work on the publish path. Reads go through the channel pool; each group's
+# tail is cached along with the next offset to read, so a join only fetches
+# messages that arrived since the previous one.
+class StreamHistory:
+    def __init__(self, pool, topology, cache_size=HISTORY_CACHE_SIZE, lookback=HISTORY_LOOKBACK):
+        self.pool = pool
+        self.topology = topology
+        self.cache_size = cache_size
+        self.lookback = lookback
+        self._caches = {}
+        self._lock = threading.Lock()
+
+    def _cache(self, group_name):
+        with self._lock:
+            cache = self._caches.get(group_name)
+            if cache is None:
+                cache = self._caches[group_name] = _GroupCache(self.cache_size)
+            return cache
+
+    def declare(self, group_name):
+        exchange, routing_key = self.topology.route(group_name)
+        queue = stream_name(group_name)
+
+        def declare_stream(channel):
+            channel.queue_declare(queue, durable=True, arguments={
+                'x-queue-type': 'stream',
+                'x-max-age': STREAM_MAX_AGE,
+                'x-max-length-bytes': STREAM_MAX_BYTES,
+            })
+            channel.queue_bind(queue, exchange, routing_key=routing_key)
+        self.pool.run(declare_stream)
+
+    def delete(self, group_name):
+        self.pool.run(lambda channel: channel.queue_delete(stream_name(group_name)))
+        with self._lock:
+            self._caches.pop(group_name, None)
+
+    # Read (offset, body) pairs from `start` until the stream goes idle
+    def _read(self, group_name, start):
+        def read_stream(channel):
+            entries = []
+            channel.basic_qos(prefetch_count=READ_PREFETCH)
+            for method, properties, body in channel.consume(
+                    stream_name(group_name), arguments={'x-stream-offset': start},
+                    inactivity_timeout=READ_IDLE_TIMEOUT):
+                if method is None:
+                    break
+                entries.append((properties.headers['x-stream-offset'], body))
+                channel.basic_ack(method.delivery_tag)
+            channel.cancel()
+            return entries
+        return self.pool.run(read_stream)
+
+    # Return up to `limit` recent messages, or every message from offset `since`
+    def replay(self, group_name, limit=None, since=None):
+        cache = self._cache(group_name)
+        with cache.lock:
+            if cache.next_offset is None:
+                start = datetime.now() - self.lookback
+            else:
+                start = cache.next_offset
+            cache.extend(self._read(group_name, start))
+            cached_from = cache.messages[0][0] if cache.messages else cache.next_offset
+            if since is None:
+                return _select(list(cache.messages), limit)
+            if cached_from is not None and since >= cached_from:
+                return _select(cache.since(since), limit)
+        # Older than the cache: read that range straight from the stream
+        return _select([entry for entry in self._read(group_name, since) if entry[0] >= since], limit)
+
+
+# In-memory history for the memory broker backend, with the same offsets and
+# replay semantics as StreamHistory. It is bound to group routes like a
+# stream queue and keeps at most max_messages per group.
+class MemoryHistory:
+    def __init__(self, broker, topology, max_messages=10000):
+        self.broker = broker
+        self.topology = topology
+        self.max_messages = max_messages
+        self._groups = {}
+        self._lock = threading.Lock()
+
+    def declare(self, group_name):
+        exchange, routing_key = self.topology.route(group_name)
+        self.broker.declare_exchange(exchange, self.topology.exchange_type)
+        self.broker.bind(self, exchange, routing_key)
+        with self._lock:
+            self._groups.setdefault(group_name, (deque(maxlen=self.max_messages), [0]))
+
+    def delete(self, group_name):
+        exchange, routing_key = self.topology.route(group_name)
+        self.broker.unbind(self, exchange, routing_key)
+        with self._lock:
+            self._groups.pop(group_name, None)
+
+    # Called by the memory broker for every message routed to a declared group
+    def deliver(self, exchange, routing_key, body, app_id):
+        group_name = self.topology.group_for(exchange, routing_key)
+        with self._lock:
+            group = self._groups.get(group_name)
+            if group is None:
+                return
+            messages, next_offset = group
+            messages.append((next_offset[0], body))
+            next_offset[0] += 1
+
+    def replay(self, group_name, limit=None, since=None):
+        with self._lock:
+            group = self._groups.get(group_name)
+            entries = list(group[0]) if group is not None else []
+        if since is not None:
+            entries = [entry for entry in entries if entry[0] >= since]
+        return _select(entries, limit)
@@ -0,0 +1,297 @@
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # Not on Windows, where the files are only ever used by one process
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Journal size that triggers a compaction into a new snapshot
+JOURNAL_COMPACT_BYTES = 4 * 1024 * 1024
+# Longest a write waits for other writes to share its fsync
+JOURNAL_FSYNC_INTERVAL = 0.005
+
+_SNAPSHOT = 'snapshot.json'
+_LOCK = 'journal.lock'
+_JOURNAL_PREFIX = 'journal-'
+_JOURNAL_SUFFIX = '.log'
+
+
+# Function to apply one change record to a users dict and a groups list. The
+# same records are written to the journal and sent between processes.
+def apply_record(users, groups, record):
+    op = record['op']
+    if op == 'add_user':
+        users[record['username']] = record['password_hash']
+    elif op == 'delete_user':
+        users.pop(record['username'], None)
+    elif op == 'add_group':
+        if not any(group['name'] == record['name'] for group in groups):
+            groups.append({'name': record['name']})
+    elif op == 'delete_group':
+        groups[:] = [group for group in groups if group['name'] != record['name']]
+
+
+# Function to write a file through a temp file renamed into place. The temp
+# name is unique, so writers in other threads or processes never share one.
+@contextmanager
+def atomic_file(path, mode='w'):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', prefix=os.path.basename(path) + '.',
+                                    suffix='.tmp')
+    try:
+        with open(fd, mode) as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+# Function to write a JSON document atomically
+def write_atomic(path, data):
+    with atomic_file(path) as f:
+        json.dump(data, f)
+
+
+# Function to hold an exclusive lock on path + '.lock' across processes. The
+# lock file is separate from the document, which is replaced on every write.
+@contextmanager
+def file_lock(path):
+    with open(path + '.lock', 'a') as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        yield
+
+
+# Function to take the lowest-numbered lock file prefix-<n>.lock in directory
+# that no running process holds. Returns n and the open lock file, which
+# keeps the lock until it is closed or the process exits.
+def claim_instance(directory, prefix='instance'):
+    number = 0
+    while True:
+        f = open(os.path.join(directory, f'{prefix}-{number}.lock'), 'a')
+        if fcntl is None:
+            return number, f
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return number, f
+        except BlockingIOError:
+            f.close()
+            number += 1
+
+
+# Users and groups kept in memory, made durable by appending one JSON line per
+# mutation to a journal. Concurrent writers share fsyncs (group commit): each
+# waits only until a flusher thread has synced past its record. Startup loads
+# the last snapshot and replays the journals written after it; when the
+# journal passes compact_bytes a new one is started and a background thread
+# writes the state at that point as the next snapshot. A journal directory
+# belongs to one process: compaction deletes journals, so it is locked while
+# open and a second process fails to open it instead of losing changes.
+class JournalStorage:
+    def __init__(self, directory, compact_bytes=JOURNAL_COMPACT_BYTES, fsync_interval=JOURNAL_FSYNC_INTERVAL):
+        self.directory = directory
+        self.compact_bytes = compact_bytes
+        self.fsync_interval = fsync_interval
+        self.users = {}
+        self.groups = []
+        self._lock = threading.Lock()
+        self._synced = threading.Condition(self._lock)
+        self._written_seq = 0
+        self._synced_seq = 0
+        self._compacting = False
+        self._running = True
+        os.makedirs(directory, exist_ok=True)
+        self.created = not [name for name in os.listdir(directory) if name != _LOCK]
+        self._dir_lock = open(os.path.join(directory, _LOCK), 'a')
+        if fcntl is not None:
+            try:
+                fcntl.flock(self._dir_lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                self._dir_lock.close()
+                raise RuntimeError(f'Journal directory {directory} is in use by another process') from None
+        self._generation = self._recover()
+        self._journal = open(self._journal_path(self._generation), 'a')
+        self._flusher = threading.Thread(target=self._flush_loop, name='journal-fsync', daemon=True)
+        self._flusher.start()
+
+    def _journal_path(self, generation):
+        return os.path.join(self.directory, f'{_JOURNAL_PREFIX}{generation:012d}{_JOURNAL_SUFFIX}')
+
+    def _journal_generations(self):
+        generations = []
+        for name in os.listdir(self.directory):
+            if name.startswith(_JOURNAL_PREFIX) and name.endswith(_JOURNAL_SUFFIX):
+                generations.append(int(name[len(_JOURNAL_PREFIX):-len(_JOURNAL_SUFFIX)]))
+        return sorted(generations)
+
+    # Load the snapshot, replay newer journals and return the generation to append to
+    def _recover(self):
+        snapshot_path = os.path.join(self.directory, _SNAPSHOT)
+        generation = 1
+        if os.path.exists(snapshot_path):
+            with open(snapshot_path, 'r') as f:
+                snapshot = json.load(f)
+            self.users = snapshot['users']
+            self.groups = snapshot['groups']
+            generation = snapshot['generation']
+        for journal_generation in self._journal_generations():
+            if journal_generation < generation:
+                # Already folded into the snapshot; left over from a crash mid-compaction
+                os.remove(self._journal_path(journal_generation))
+                continue
+            self._replay(self._journal_path(journal_generation))
+            generation = journal_generation
+        return generation
+
+    def _replay(self, path):
+        with open(path, 'r+b') as f:
+            end = 0
+            for line in f:
+                try:
+                    if not line.endswith(b'\n'):
+                        raise ValueError('missing newline')
+                    record = json.loads(line)
+                except ValueError:
+                    # A torn final record from a crash; it was never acknowledged.
+                    # Cut it off so records appended after restart stay readable.
+                    logger.warning('Truncating a torn journal record in %s', path)
+                    f.truncate(end)
+                    break
+                self._apply(record)
+                end += len(line)
+
+    def _apply(self, record):
+        apply_record(self.users, self.groups, record)
+
+    # Function to apply a change made by another process to the in-memory
+    # state only; that process has already journaled it
+    def apply(self, record):
+        with self._lock:
+            self._apply(record)
+
+    # The journal belongs to one process, so no other process changes it
+    def refresh(self):
+        pass
+
+    # Apply mutations, append them to the journal and wait until they are synced
+    def _commit(self, *records):
+        with self._lock:
+            for record in records:
+                self._apply(record)
+                self._journal.write(json.dumps(record) + '\n')
+            self._written_seq += 1
+            seq = self._written_seq
+            self._synced.notify_all()
+            while self._synced_seq < seq and self._running:
+                self._synced.wait()
+
+    def _flush_loop(self):
+        while True:
+            with self._lock:
+                while self._running and self._synced_seq == self._written_seq:
+                    self._synced.wait()
+                if not self._running and self._synced_seq == self._written_seq:
+                    return
+            # Let concurrent writers join this fsync
+            time.sleep(self.fsync_interval)
+            with self._lock:
+                seq = self._written_seq
+                self._journal.flush()
+                journal = self._journal
+            os.fsync(journal.fileno())
+            with self._lock:
+                self._synced_seq = max(self._synced_seq, seq)
+                self._synced.notify_all()
+                # Only this thread swaps journals, so no fsync can race the close
+                if not self._compacting and self._journal.tell() >= self.compact_bytes:
+                    self._start_compaction()
+
+    # Called by the flusher with the lock held: switch to a new journal and snapshot the
+    # state as of the switch in the background
+    def _start_compaction(self):
+        self._compacting = True
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+        self._journal.close()
+        old_generation = self._generation
+        self._generation += 1
+        self._journal = open(self._journal_path(self._generation), 'a')
+        state = {'users': dict(self.users), 'groups': list(self.groups), 'generation': self._generation}
+        threading.Thread(target=self._compact, args=(state, old_generation), name='journal-compactor',
+                         daemon=True).start()
+
+    def _compact(self, state, old_generation):
+        try:
+            write_atomic(os.path.join(self.directory, _SNAPSHOT), state)
+            for generation in self._journal_generations():
+                if generation <= old_generation:
+                    os.remove(self._journal_path(generation))
+        except OSError:
+            logger.exception('Journal compaction failed')
+        finally:
+            with self._lock:
+                self._compacting = False
+
+    def get_user(self, username):
+        return self.users.get(username)
+
+    def add_user(self, username, password_hash):
+        self._commit({'op': 'add_user', 'username': username, 'password_hash': password_hash})
+
+    def delete_user(self, username):
+        if username not in self.users:
+            return False
+        self._commit({'op': 'delete_user', 'username': username})
+        return True
+
+    def list_groups(self):
+        with self._lock:
+            return list(self.groups)
+
+    def group_exists(self, name):
+        with self._lock:
+            return any(group['name'] == name for group in self.groups)
+
+    def add_group(self, name):
+        self._commit({'op': 'add_group', 'name': name})
+
+    def delete_group(self, name):
+        if not self.group_exists(name):
+            return False
+        self._commit({'op': 'delete_group', 'name': name})
+        return True
+
+    # Bulk load used by storage.import_json: one fsync for everything
+    def import_data(self, users, groups):
+        records = [{'op': 'add_user', 'username': username, 'password_hash': password_hash}
+                   for username, password_hash in users.items()]
+        records += [{'op': 'add_group', 'name': group['name']} for group in groups]
+        if records:
+            self._commit(*records)
+
+    def close(self):
+        with self._lock:
+            if not self._running:
+                return
+            self._running = False
+            self._synced.notify_all()
+        self._flusher.join()
+        with self._lock:
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+            self._journal.close()
+        self._dir_lock.close()
@@ -0,0 +1,312 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import Future
+
+from confirms import ExchangeNotFound
+from history import MemoryHistory
+
+logger = logging.getLogger(__name__)
+
+# Deliveries due within this many seconds are treated as due now
+_TIMER_SLACK = 0.001
+
+
+# Function to match a topic routing key against a binding pattern, where '*'
+# matches exactly one word and '#' matches zero or more words
+def topic_matches(pattern, routing_key):
+    words = routing_key.split('.') if routing_key else []
+    parts = pattern.split('.') if pattern else []
+    # states[i] is True when the first i pattern parts can match the words so far
+    states = [True] + [False] * len(parts)
+    for i, part in enumerate(parts):
+        if part == '#':
+            states[i + 1] = states[i]
+    for word in words:
+        next_states = [False] * (len(parts) + 1)
+        for i, part in enumerate(parts):
+            if part == '#':
+                next_states[i + 1] = next_states[i] or states[i + 1] or states[i]
+            elif part == '*' or part == word:
+                next_states[i + 1] = states[i]
+        states = next_states
+    return states[-1]
+
+
+class _Exchange:
+    def __init__(self, name, exchange_type):
+        self.name = name
+        self.type = exchange_type
+        # Destinations are exchange names or consumer objects. Binding keys
+        # without wildcards are indexed so most topic lookups are a dict hit.
+        self._exact = {}
+        self._patterns = set()
+
+    def add(self, binding_key, destination):
+        if self.type == 'topic' and ('*' in binding_key or '#' in binding_key):
+            self._patterns.add((binding_key, destination))
+        else:
+            self._exact.setdefault(binding_key, set()).add(destination)
+
+    def discard(self, binding_key, destination):
+        self._patterns.discard((binding_key, destination))
+        destinations = self._exact.get(binding_key)
+        if destinations is not None:
+            destinations.discard(destination)
+            if not destinations:
+                del self._exact[binding_key]
+
+    def discard_destination(self, destination):
+        for binding_key in list(self._exact):
+            self.discard(binding_key, destination)
+        self._patterns = {(key, dest) for key, dest in self._patterns if dest != destination}
+
+    def destinations(self, routing_key):
+        if self.type == 'fanout':
+            return set().union(*self._exact.values()) if self._exact else set()
+        matched = set(self._exact.get(routing_key, ()))
+        for pattern, destination in self._patterns:
+            if topic_matches(pattern, routing_key):
+                matched.add(destination)
+        return matched
+
+
+# In-memory stand-in for RabbitMQ with fanout, direct and topic exchanges,
+# queue and exchange-to-exchange bindings, and an optional artificial latency
+# applied between publish and delivery. Messages are delivered by a single
+# worker thread, in publish order.
+class MemoryBroker:
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self._exchanges = {}
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self._deliveries = []
+        self._sequence = itertools.count()
+        self._thread = None
+        self._running = False
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._running:
+                return
+            self._running = True
+        self._thread = threading.Thread(target=self._deliver_loop, name='memory-broker', daemon=True)
+        self._thread.start()
+
+    def declare_exchange(self, exchange, exchange_type='fanout'):
+        with self._lock:
+            if exchange not in self._exchanges:
+                self._exchanges[exchange] = _Exchange(exchange, exchange_type)
+
+    def delete_exchange(self, exchange):
+        with self._lock:
+            self._exchanges.pop(exchange, None)
+            for other in self._exchanges.values():
+                other.discard_destination(exchange)
+
+    def bind(self, destination, source, routing_key=''):
+        with self._lock:
+            if source not in self._exchanges:
+                raise ExchangeNotFound(source)
+            self._exchanges[source].add(routing_key, destination)
+
+    def unbind(self, destination, source, routing_key=''):
+        with self._lock:
+            if source in self._exchanges:
+                self._exchanges[source].discard(routing_key, destination)
+
+    def list_exchanges(self):
+        with self._lock:
+            return {name: exchange.type for name, exchange in self._exchanges.items()}
+
+    # Queue a message for delivery and return a Future resolved once it is routed
+    def publish(self, exchange, routing_key, body, app_id=None):
+        self._ensure_worker()
+        future = Future()
+        with self._cond:
+            deliver_at = time.monotonic() + self.latency
+            heapq.heappush(self._deliveries, (deliver_at, next(self._sequence), exchange, routing_key, body, app_id, future))
+            self._cond.notify()
+        return future
+
+    def _route(self, exchange, routing_key):
+        queues = set()
+        visited = set()
+        pending = [exchange]
+        while pending:
+            name = pending.pop()
+            if name in visited or name not in self._exchanges:
+                continue
+            visited.add(name)
+            for destination in self._exchanges[name].destinations(routing_key):
+                if isinstance(destination, str):
+                    pending.append(destination)
+                else:
+                    queues.add(destination)
+        return queues
+
+    def _deliver_loop(self):
+        while True:
+            with self._cond:
+                while self._running and not self._due():
+                    timeout = self._deliveries[0][0] - time.monotonic() if self._deliveries else None
+                    self._cond.wait(timeout)
+                if not self._running:
+                    return
+                # Take everything that is due at once; waking up per message
+                # would cap throughput at the timer resolution
+                batch = []
+                while self._due():
+                    _, _, exchange, routing_key, body, app_id, future = heapq.heappop(self._deliveries)
+                    queues = self._route(exchange, routing_key) if exchange in self._exchanges else None
+                    batch.append((exchange, routing_key, body, app_id, future, queues))
+            for exchange, routing_key, body, app_id, future, queues in batch:
+                if queues is None:
+                    future.set_exception(ExchangeNotFound(exchange))
+                    continue
+                for queue in queues:
+                    queue.deliver(exchange, routing_key, body, app_id)
+                future.set_result(True)
+
+    def _due(self):
+        return bool(self._deliveries) and self._deliveries[0][0] <= time.monotonic() + _TIMER_SLACK
+
+    def close(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    # Same interface as broker.ChannelPool
+    def admin(self):
+        return MemoryAdmin(self)
+
+    # Same interface as confirms.ConfirmPublisher
+    def publisher(self, app_id=None, **kwargs):
+        return MemoryPublisher(self, app_id=app_id)
+
+    # Same interface as consumer.ConsumerBridge
+    def consumer(self, on_message, node_id=None, **kwargs):
+        return MemoryConsumer(self, on_message, node_id=node_id)
+
+    # Same interface as history.StreamHistory
+    def history(self, topology, **kwargs):
+        return MemoryHistory(self, topology)
+
+
+class MemoryAdmin:
+    def __init__(self, broker):
+        self.broker = broker
+
+    def publish(self, exchange, routing_key, body, properties=None):
+        self.broker.publish(exchange, routing_key, body).result()
+
+    def publish_batch(self, messages, properties=None):
+        futures = [self.broker.publish(*message) for message in messages]
+        for future in futures:
+            future.result()
+
+    def declare_exchange(self, exchange, exchange_type='fanout'):
+        self.broker.declare_exchange(exchange, exchange_type)
+
+    def delete_exchange(self, exchange):
+        self.broker.delete_exchange(exchange)
+
+    def bind_exchange(self, destination, source, routing_key=''):
+        self.broker.bind(destination, source, routing_key)
+
+    def close(self):
+        pass
+
+
+class MemoryPublisher:
+    def __init__(self, broker, app_id=None):
+        self.broker = broker
+        self.app_id = app_id
+        self._metrics = {'published': 0, 'acked': 0, 'nacked': 0, 'retried': 0, 'failed': 0}
+        self._lock = threading.Lock()
+
+    def start(self):
+        pass
+
+    def stop(self, timeout=5.0):
+        pass
+
+    def is_connected(self):
+        return True
+
+    # The memory broker is always connected, so fn() runs once right away
+    def add_connect_callback(self, fn):
+        fn()
+
+    def publish(self, exchange, routing_key, body, properties=None):
+        with self._lock:
+            self._metrics['published'] += 1
+        future = self.broker.publish(exchange, routing_key, body, self.app_id)
+        future.add_done_callback(self._on_confirm)
+        return future
+
+    def _on_confirm(self, future):
+        with self._lock:
+            if future.exception() is None:
+                self._metrics['acked'] += 1
+            else:
+                self._metrics['failed'] += 1
+
+    def stats(self):
+        with self._lock:
+            return dict(self._metrics, in_flight=self._metrics['published'] - self._metrics['acked'] - self._metrics['failed'])
+
+
+class MemoryConsumer:
+    def __init__(self, broker, on_message, node_id=None):
+        self.broker = broker
+        self.on_message = on_message
+        self.node_id = node_id
+        self._bindings = set()
+        self._lock = threading.Lock()
+        self._metrics = {'received': 0, 'echoes_skipped': 0}
+
+    def start(self):
+        pass
+
+    def stop(self, timeout=5.0):
+        with self._lock:
+            bindings = list(self._bindings)
+            self._bindings.clear()
+        for exchange, routing_key in bindings:
+            self.broker.unbind(self, exchange, routing_key)
+
+    def bind(self, exchange, routing_key='', exchange_type='fanout'):
+        self.broker.declare_exchange(exchange, exchange_type)
+        self.broker.bind(self, exchange, routing_key)
+        with self._lock:
+            self._bindings.add((exchange, routing_key))
+
+    def unbind(self, exchange, routing_key='', exchange_type='fanout'):
+        self.broker.unbind(self, exchange, routing_key)
+        with self._lock:
+            self._bindings.discard((exchange, routing_key))
+
+    # The memory broker is always connected, so fn() runs once right away
+    def add_connect_callback(self, fn):
+        fn()
+
+    def deliver(self, exchange, routing_key, body, app_id):
+        if app_id is not None and app_id == self.node_id:
+            self._metrics['echoes_skipped'] += 1
+            return
+        self._metrics['received'] += 1
+        try:
+            self.on_message(exchange, routing_key, body)
+        except Exception:
+            logger.exception('Failed to fan out a message for %s', exchange)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._metrics, bindings=len(self._bindings))
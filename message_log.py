@@ -0,0 +1,706 @@
+import logging
+import mmap
+import os
+import shutil
+import struct
+import threading
+import time
+import uuid
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from urllib.parse import quote, unquote
+
+logger = logging.getLogger(__name__)
+
+# Size at which a group's active segment is closed and a new one started
+SEGMENT_BYTES = 16 * 1024 * 1024
+# Bytes of log between two entries of a segment's sparse index
+INDEX_INTERVAL = 4096
+# Segment files kept memory-mapped at once; each mapping holds a file descriptor
+MAX_OPEN_MAPPINGS = 64
+# Groups whose active segment is kept open for appends; each holds two file descriptors
+MAX_OPEN_WRITERS = 128
+# Seconds between two retention passes of the compactor
+COMPACT_INTERVAL = 300
+
+# Record header: offset, timestamp in ms, body length
+_RECORD = struct.Struct('>QqI')
+# Index entry: offset, timestamp in ms, byte position of the record in the segment
+_INDEX_ENTRY = struct.Struct('>QqQ')
+_LOG_SUFFIX = '.log'
+_INDEX_SUFFIX = '.index'
+# Prefix a deleted group's directory is renamed to before it is removed; group
+# directory names never start with a dot
+_DELETED_PREFIX = '.deleted-'
+
+
+# Function to turn a group name into a safe directory name
+def group_dirname(group_name):
+    return quote(group_name, safe='').replace('.', '%2E')
+
+
+# Function to list the base offsets of the segments in a group directory
+def _segment_bases(directory):
+    return sorted(int(name[:-len(_LOG_SUFFIX)]) for name in os.listdir(directory) if name.endswith(_LOG_SUFFIX))
+
+
+# One segment file plus its sparse index, kept in memory as three parallel
+# lists so lookups are a bisect followed by a short forward scan
+class _Segment:
+    def __init__(self, directory, base_offset):
+        self.base_offset = base_offset
+        self.log_path = os.path.join(directory, f'{base_offset:020d}{_LOG_SUFFIX}')
+        self.index_path = os.path.join(directory, f'{base_offset:020d}{_INDEX_SUFFIX}')
+        self.offsets = []
+        self.timestamps = []
+        self.positions = []
+        self.size = 0
+        self.next_offset = base_offset
+        self.last_timestamp = 0
+
+    def add_index_entry(self, offset, timestamp, position):
+        self.offsets.append(offset)
+        self.timestamps.append(timestamp)
+        self.positions.append(position)
+
+    def _drop_index_from(self, position):
+        while self.positions and self.positions[-1] >= position:
+            for values in (self.offsets, self.timestamps, self.positions):
+                values.pop()
+
+    def load_index(self):
+        if not os.path.exists(self.index_path):
+            return
+        with open(self.index_path, 'rb') as f:
+            data = f.read()
+        usable = len(data) - len(data) % _INDEX_ENTRY.size
+        for entry in _INDEX_ENTRY.iter_unpack(data[:usable]):
+            self.add_index_entry(*entry)
+
+    # Function to find the last whole record by scanning from the last index
+    # entry, setting size, next_offset and last_timestamp from it. Nothing is
+    # changed on disk; returns the file size so a torn tail can be spotted.
+    def scan_tail(self):
+        self.load_index()
+        file_size = os.path.getsize(self.log_path)
+        # Index entries past the end of the log were written for records that never made it
+        self._drop_index_from(file_size)
+        position = self.positions[-1] if self.positions else 0
+        self.next_offset = self.offsets[-1] if self.offsets else self.base_offset
+        self.last_timestamp = self.timestamps[-1] if self.timestamps else 0
+        with open(self.log_path, 'rb') as f:
+            f.seek(position)
+            while True:
+                header = f.read(_RECORD.size)
+                if len(header) < _RECORD.size:
+                    break
+                offset, timestamp, length = _RECORD.unpack(header)
+                if len(f.read(length)) < length:
+                    break
+                position += _RECORD.size + length
+                self.next_offset = offset + 1
+                self.last_timestamp = timestamp
+        self.size = position
+        self._drop_index_from(position)
+        return file_size
+
+    # Function to rebuild the active segment's state after a restart and drop
+    # a torn tail
+    def recover(self):
+        if self.scan_tail() > self.size:
+            logger.warning('Truncating a torn record at %d in %s', self.size, self.log_path)
+            with open(self.log_path, 'r+b') as f:
+                f.truncate(self.size)
+        self._rewrite_index_if_needed()
+
+    # Function to create the segment's files empty, so the group's next
+    # offset survives a restart even before anything is appended
+    def create(self):
+        for path in (self.log_path, self.index_path):
+            open(path, 'ab').close()
+
+    # Function to get the timestamp of the first record, reading only the
+    # first index entry when the index isn't loaded
+    def first_timestamp(self):
+        if self.timestamps:
+            return self.timestamps[0]
+        try:
+            with open(self.index_path, 'rb') as f:
+                data = f.read(_INDEX_ENTRY.size)
+        except FileNotFoundError:
+            return None
+        return _INDEX_ENTRY.unpack(data)[1] if len(data) == _INDEX_ENTRY.size else None
+
+    def _rewrite_index_if_needed(self):
+        expected = len(self.offsets) * _INDEX_ENTRY.size
+        if os.path.exists(self.index_path) and os.path.getsize(self.index_path) == expected:
+            return
+        with open(self.index_path, 'wb') as f:
+            for entry in zip(self.offsets, self.timestamps, self.positions):
+                f.write(_INDEX_ENTRY.pack(*entry))
+
+    def position_for_offset(self, offset):
+        i = bisect_right(self.offsets, offset) - 1
+        return self.positions[i] if i >= 0 else 0
+
+    def position_for_timestamp(self, timestamp):
+        i = bisect_left(self.timestamps, timestamp) - 1
+        return self.positions[i] if i >= 0 else 0
+
+    # Function to yield (offset, timestamp, body) from a byte position up to
+    # end of a mapped segment; bodies are slices of the mapping, not copies
+    def scan(self, view, position, end):
+        while position < end:
+            offset, timestamp, length = _RECORD.unpack_from(view, position)
+            start = position + _RECORD.size
+            yield offset, timestamp, view[start:start + length]
+            position = start + length
+
+
+# LRU of read-only segment mappings, capped at max_open so a busy node
+# doesn't run out of file descriptors. A mapping evicted while a reader still
+# holds a slice of it is released once the last slice is gone.
+class MappingCache:
+    def __init__(self, max_open=MAX_OPEN_MAPPINGS):
+        self.max_open = max_open
+        self._mappings = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    # Function to get a view of a segment covering at least size bytes,
+    # remapping the active segment once it has grown past the old mapping
+    def view(self, path, size):
+        with self._lock:
+            mapping = self._mappings.get(path)
+            if mapping is not None and len(mapping) >= size:
+                self._mappings.move_to_end(path)
+                self._hits += 1
+                return memoryview(mapping)
+            self._misses += 1
+            if mapping is not None:
+                self._release(self._mappings.pop(path))
+            with open(path, 'rb') as f:
+                mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._mappings[path] = mapping
+            while len(self._mappings) > self.max_open:
+                self._release(self._mappings.popitem(last=False)[1])
+            return memoryview(mapping)
+
+    def _release(self, mapping):
+        try:
+            mapping.close()
+        except BufferError:
+            pass
+
+    # Function to drop the mappings of every file under a directory
+    def discard(self, directory):
+        prefix = os.path.join(directory, '')
+        with self._lock:
+            for path in [path for path in self._mappings if path.startswith(prefix)]:
+                self._release(self._mappings.pop(path))
+
+    def discard_file(self, path):
+        with self._lock:
+            mapping = self._mappings.pop(path, None)
+            if mapping is not None:
+                self._release(mapping)
+
+    def stats(self):
+        with self._lock:
+            return {'open': len(self._mappings), 'hits': self._hits, 'misses': self._misses}
+
+    def close(self):
+        with self._lock:
+            for mapping in self._mappings.values():
+                self._release(mapping)
+            self._mappings.clear()
+
+
+# Function to describe a group's segments from its directory listing without
+# opening the group: sizes and ages of closed segments come from stat, and
+# only the last segment is scanned, from its last index entry, for its exact
+# end offset and timestamp
+def _segments_on_disk(directory):
+    segments = []
+    for base in _segment_bases(directory):
+        segment = _Segment(directory, base)
+        stat = os.stat(segment.log_path)
+        segment.size = stat.st_size
+        segment.last_timestamp = stat.st_mtime_ns // 1_000_000
+        if segments:
+            segments[-1].next_offset = base
+        segments.append(segment)
+    if segments:
+        segments[-1].scan_tail()
+    return segments
+
+
+# Function to pick the oldest segments a policy says to drop. A segment goes
+# when everything in it is older than max_age, or when the messages or bytes
+# left without it are still at or above the limit. The last (active) segment
+# only goes by age, once every message in it has expired.
+def _expired_segments(segments, policy, now_ms):
+    cutoff = now_ms - int(policy.max_age * 1000) if policy.max_age is not None else None
+    messages = segments[-1].next_offset - segments[0].base_offset
+    size = sum(segment.size for segment in segments)
+    expired = []
+    for segment in segments:
+        count = segment.next_offset - segment.base_offset
+        if count == 0:
+            break
+        too_old = cutoff is not None and segment.last_timestamp < cutoff
+        if segment is segments[-1]:
+            if not too_old:
+                break
+        elif not (too_old
+                  or (policy.max_messages is not None and messages - count >= policy.max_messages)
+                  or (policy.max_bytes is not None and size - segment.size >= policy.max_bytes)):
+            break
+        expired.append(segment)
+        messages -= count
+        size -= segment.size
+    return expired
+
+
+def _usage(segments):
+    first, last = segments[0], segments[-1]
+    return {
+        'segments': len(segments),
+        'bytes': sum(segment.size for segment in segments),
+        'messages': last.next_offset - first.base_offset,
+        'first_offset': first.base_offset,
+        'next_offset': last.next_offset,
+        'oldest_timestamp': first.first_timestamp(),
+    }
+
+
+# The segments of one group. Appends go to the last segment, whose files are
+# opened on the first append and can be closed again at any time between
+# appends; readers work from a copy of the segment list and stop at the size
+# seen under the lock, so they never see a half-written record.
+class _GroupLog:
+    def __init__(self, directory, segment_bytes, index_interval):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.index_interval = index_interval
+        self.lock = threading.Lock()
+        self.segments = []
+        self._log_file = None
+        self._index_file = None
+        self._last_indexed = 0
+        # Set under the lock by MessageLog.delete; appends that were already
+        # waiting for the lock check it and write nothing
+        self.deleted = False
+        os.makedirs(directory, exist_ok=True)
+        for base in _segment_bases(directory):
+            # Recovery scans at most one index interval per segment and gives
+            # each its exact last offset and timestamp, which retention needs
+            segment = _Segment(directory, base)
+            segment.recover()
+            self.segments.append(segment)
+        if not self.segments:
+            self.segments.append(_Segment(directory, 0))
+            self.segments[0].create()
+
+    @property
+    def next_offset(self):
+        return self.segments[-1].next_offset
+
+    @property
+    def first_offset(self):
+        return self.segments[0].base_offset
+
+    def _open_active(self):
+        active = self.segments[-1]
+        self._log_file = open(active.log_path, 'ab')
+        self._index_file = open(active.index_path, 'ab')
+        self._last_indexed = active.positions[-1] if active.positions else -self.index_interval
+
+    def _close_active(self):
+        if self._log_file is not None:
+            self._log_file.close()
+            self._index_file.close()
+            self._log_file = self._index_file = None
+
+    # Called with the lock held: close the active segment and start a new one
+    def roll(self):
+        previous = self.segments[-1]
+        self._close_active()
+        active = _Segment(self.directory, previous.next_offset)
+        active.last_timestamp = previous.last_timestamp
+        active.create()
+        self.segments.append(active)
+
+    # Called with the lock held
+    def append(self, body, timestamp):
+        if self.segments[-1].size >= self.segment_bytes:
+            self.roll()
+        if self._log_file is None:
+            self._open_active()
+        active = self.segments[-1]
+        # Stored timestamps never go backwards, so the index stays sorted by time
+        timestamp = max(timestamp, active.last_timestamp)
+        offset = active.next_offset
+        position = active.size
+        self._log_file.write(_RECORD.pack(offset, timestamp, len(body)))
+        self._log_file.write(body)
+        self._log_file.flush()
+        if position - self._last_indexed >= self.index_interval:
+            self._index_file.write(_INDEX_ENTRY.pack(offset, timestamp, position))
+            self._index_file.flush()
+            active.add_index_entry(offset, timestamp, position)
+            self._last_indexed = position
+        active.size = position + _RECORD.size + len(body)
+        active.next_offset = offset + 1
+        active.last_timestamp = timestamp
+        return offset
+
+    def snapshot(self):
+        with self.lock:
+            return [(segment, segment.size) for segment in self.segments]
+
+    # Called with the lock held: drop the oldest segments the policy expires
+    # from the list and return them; their files are left to the caller
+    def expire(self, policy, now_ms, dry_run=False):
+        expired = _expired_segments(self.segments, policy, now_ms)
+        if expired and not dry_run:
+            if expired[-1] is self.segments[-1]:
+                self.roll()
+            self.segments = self.segments[len(expired):]
+        return expired
+
+    def usage(self):
+        with self.lock:
+            return _usage(self.segments)
+
+    # Closes the active segment's files; the next append reopens them
+    def close(self):
+        with self.lock:
+            self._close_active()
+
+    def mark_deleted(self):
+        with self.lock:
+            self._close_active()
+            self.deleted = True
+
+
+# Durable chat history on local disk: one directory per group holding
+# append-only segment files that roll over at segment_bytes. Each segment has
+# a sparse index of (offset, timestamp, position) every index_interval bytes,
+# so "last N" and "since a time" lookups bisect the index and scan at most
+# one interval instead of reading the whole log. Segments are read through
+# memory mappings and reads return (offset, body) pairs like the stream
+# history does, with each body a memoryview into the mapping; callers decode
+# only what they send.
+class MessageLog:
+    def __init__(self, directory, segment_bytes=SEGMENT_BYTES, index_interval=INDEX_INTERVAL,
+                 max_open_mappings=MAX_OPEN_MAPPINGS, max_open_writers=MAX_OPEN_WRITERS):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.index_interval = index_interval
+        self.max_open_writers = max_open_writers
+        self.mappings = MappingCache(max_open_mappings)
+        self._groups = {}
+        # Groups with their active segment open, least recently appended first
+        self._writers = OrderedDict()
+        # Groups deleted here; appends racing the deletion must not recreate them
+        self._deleted = set()
+        self._lock = threading.Lock()
+        self._appended = 0
+        os.makedirs(directory, exist_ok=True)
+        for name in os.listdir(directory):
+            if name.startswith(_DELETED_PREFIX):
+                # Left over from a crash part-way through delete()
+                shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+
+    def _path(self, group_name):
+        return os.path.join(self.directory, group_dirname(group_name))
+
+    def _group(self, group_name, create=True):
+        with self._lock:
+            group = self._groups.get(group_name)
+            if group is None:
+                path = self._path(group_name)
+                if group_name in self._deleted or (not create and not os.path.isdir(path)):
+                    return None
+                group = self._groups[group_name] = _GroupLog(path, self.segment_bytes, self.index_interval)
+            return group
+
+    # Function to append an encoded message and return its offset in the
+    # group, or None if the group has been deleted
+    def append(self, group_name, body, timestamp=None):
+        if timestamp is None:
+            timestamp = time.time_ns() // 1_000_000
+        group = self._group(group_name)
+        if group is None:
+            return None
+        with group.lock:
+            if group.deleted:
+                return None
+            offset = group.append(body, timestamp)
+        idle = []
+        with self._lock:
+            self._appended += 1
+            self._writers[group_name] = group
+            self._writers.move_to_end(group_name)
+            while len(self._writers) > self.max_open_writers:
+                idle.append(self._writers.popitem(last=False)[1])
+        for group in idle:
+            group.close()
+        return offset
+
+    # Function to map a segment for reading; None if retention removed it
+    # after the reader took its copy of the segment list
+    def _view(self, segment, end):
+        if end == 0:
+            return None
+        try:
+            return self.mappings.view(segment.log_path, end)
+        except FileNotFoundError:
+            return None
+
+    # Function to read up to limit messages starting at an offset
+    def read(self, group_name, offset, limit=None):
+        group = self._group(group_name, create=False)
+        if group is None:
+            return []
+        segments = group.snapshot()
+        bases = [segment.base_offset for segment, _ in segments]
+        first = max(bisect_right(bases, offset) - 1, 0)
+        entries = []
+        for segment, end in segments[first:]:
+            view = self._view(segment, end)
+            if view is None:
+                continue
+            for entry_offset, _, body in segment.scan(view, segment.position_for_offset(offset), end):
+                if entry_offset < offset:
+                    continue
+                entries.append((entry_offset, body))
+                if limit is not None and len(entries) >= limit:
+                    return entries
+        return entries
+
+    # Function to read the last count messages of a group
+    def last(self, group_name, count):
+        group = self._group(group_name, create=False)
+        if group is None or count <= 0:
+            return []
+        with group.lock:
+            start = max(group.first_offset, group.next_offset - count)
+        return self.read(group_name, start, count)
+
+    # Function to read a page of scrollback: up to limit messages before an
+    # offset, or the newest ones when before is None
+    def page(self, group_name, before=None, limit=50):
+        group = self._group(group_name, create=False)
+        if group is None or limit <= 0:
+            return []
+        with group.lock:
+            first = group.first_offset
+            if before is None or before > group.next_offset:
+                before = group.next_offset
+        start = max(first, before - limit)
+        if start >= before:
+            return []
+        return self.read(group_name, start, before - start)
+
+    # Function to read up to limit messages stored at or after a timestamp in ms
+    def since(self, group_name, timestamp, limit=None):
+        group = self._group(group_name, create=False)
+        if group is None:
+            return []
+        segments = group.snapshot()
+        firsts = [segment.timestamps[0] if segment.timestamps else 0 for segment, _ in segments]
+        first = max(bisect_left(firsts, timestamp) - 1, 0)
+        entries = []
+        for segment, end in segments[first:]:
+            view = self._view(segment, end)
+            if view is None:
+                continue
+            position = segment.position_for_timestamp(timestamp)
+            for entry_offset, entry_timestamp, body in segment.scan(view, position, end):
+                if entry_timestamp < timestamp:
+                    continue
+                entries.append((entry_offset, body))
+                if limit is not None and len(entries) >= limit:
+                    return entries
+        return entries
+
+    # Function to let a group name be appended to again after delete(), for a
+    # group created anew under the same name
+    def create(self, group_name):
+        with self._lock:
+            self._deleted.discard(group_name)
+
+    # The directory is moved aside under the lock, so no append can open the
+    # group again half-way through, and removed after it is released
+    def delete(self, group_name):
+        path = self._path(group_name)
+        trash = os.path.join(self.directory, _DELETED_PREFIX + uuid.uuid4().hex)
+        with self._lock:
+            self._deleted.add(group_name)
+            group = self._groups.pop(group_name, None)
+            self._writers.pop(group_name, None)
+            if group is not None:
+                group.mark_deleted()
+            try:
+                os.rename(path, trash)
+            except FileNotFoundError:
+                trash = None
+        self.mappings.discard(path)
+        if trash is not None:
+            shutil.rmtree(trash, ignore_errors=True)
+
+    def _remove_segment(self, segment):
+        self.mappings.discard_file(segment.log_path)
+        for path in (segment.log_path, segment.index_path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    # Called with self._lock held, so the group can't be opened meanwhile:
+    # apply retention to a group this process hasn't opened, from its files
+    def _expire_on_disk(self, group_name, policy, now_ms, dry_run):
+        try:
+            segments = _segments_on_disk(self._path(group_name))
+        except FileNotFoundError:
+            # Deleted since the directory was listed
+            return []
+        if not segments:
+            return []
+        expired = _expired_segments(segments, policy, now_ms)
+        if expired and not dry_run:
+            if expired[-1] is segments[-1]:
+                # Keep an empty segment so offsets carry on from where they were
+                _Segment(self._path(group_name), segments[-1].next_offset).create()
+            for segment in expired:
+                self._remove_segment(segment)
+        return expired
+
+    # Function to apply retention to every group on disk. policy_for maps a
+    # group name to its RetentionPolicy. Whole segments are removed. For an
+    # open group the segment list is cut under the group's lock, which appends
+    # only wait on for that, and the files are deleted after it is released;
+    # other groups are handled from their files without being opened. With
+    # dry_run nothing is removed and the report says what would be.
+    def enforce_retention(self, policy_for, dry_run=False, now=None):
+        now_ms = int((time.time() if now is None else now) * 1000)
+        report = {}
+        for group_name in self.groups():
+            policy = policy_for(group_name)
+            with self._lock:
+                group = self._groups.get(group_name)
+                if group is None:
+                    expired = self._expire_on_disk(group_name, policy, now_ms, dry_run)
+            if group is not None:
+                with group.lock:
+                    expired = group.expire(policy, now_ms, dry_run)
+                if not dry_run:
+                    for segment in expired:
+                        self._remove_segment(segment)
+            if expired:
+                report[group_name] = {
+                    'segments': len(expired),
+                    'messages': sum(segment.next_offset - segment.base_offset for segment in expired),
+                    'bytes': sum(segment.size for segment in expired),
+                }
+        return report
+
+    # Function to report each group's disk usage; groups this process hasn't
+    # opened are measured from their files
+    def disk_usage(self):
+        usage = {}
+        for group_name in self.groups():
+            with self._lock:
+                group = self._groups.get(group_name)
+            if group is not None:
+                usage[group_name] = group.usage()
+                continue
+            try:
+                segments = _segments_on_disk(self._path(group_name))
+            except FileNotFoundError:
+                continue
+            if segments:
+                usage[group_name] = _usage(segments)
+        return usage
+
+    def groups(self):
+        return [unquote(name) for name in os.listdir(self.directory)
+                if not name.startswith(_DELETED_PREFIX) and os.path.isdir(os.path.join(self.directory, name))]
+
+    def stats(self):
+        with self._lock:
+            stats = {'open_groups': len(self._groups), 'open_writers': len(self._writers),
+                     'appended': self._appended}
+        stats['mappings'] = self.mappings.stats()
+        return stats
+
+    def close(self):
+        with self._lock:
+            groups = list(self._groups.values())
+            self._groups.clear()
+            self._writers.clear()
+        for group in groups:
+            group.close()
+        self.mappings.close()
+
+
+# Limits on how much history one group keeps; None means no limit
+class RetentionPolicy:
+    def __init__(self, max_age=None, max_messages=None, max_bytes=None):
+        self.max_age = max_age
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+
+
+# Background thread that applies retention to a MessageLog every interval
+# seconds, using a group's entry in group_policies or default_policy
+class RetentionCompactor:
+    def __init__(self, message_log, default_policy, group_policies=None, interval=COMPACT_INTERVAL):
+        self.message_log = message_log
+        self.default_policy = default_policy
+        self.group_policies = group_policies or {}
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._runs = 0
+        self._removed = {'segments': 0, 'messages': 0, 'bytes': 0}
+        self._last_report = {}
+
+    def policy_for(self, group_name):
+        return self.group_policies.get(group_name, self.default_policy)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='history-compactor', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception:
+                logger.exception('History compaction failed')
+
+    # Function to run one retention pass now; with dry_run it only reports
+    def run_once(self, dry_run=False):
+        report = self.message_log.enforce_retention(self.policy_for, dry_run=dry_run)
+        if not dry_run:
+            with self._lock:
+                self._runs += 1
+                self._last_report = report
+                for removed in report.values():
+                    for key in self._removed:
+                        self._removed[key] += removed[key]
+        return report
+
+    def stats(self):
+        with self._lock:
+            return {'runs': self._runs, 'removed': dict(self._removed), 'last_run': self._last_report}
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
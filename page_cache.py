@@ -0,0 +1,75 @@
+import functools
+import hashlib
+import threading
+
+from flask import current_app, make_response, request, session
+
+
+class _Page:
+    def __init__(self, body, mimetype):
+        self.body = body
+        self.mimetype = mimetype
+        self.etag = hashlib.sha256(body).hexdigest()[:32]
+
+
+# Cache of fully rendered pages that look the same to every visitor. Pages
+# are keyed by endpoint, view arguments and version(), a callable naming
+# whatever else goes into the render, such as asset fingerprints. A cached
+# page is sent with a strong ETag and Cache-Control: no-cache, so browsers
+# and health checks revalidate and get a 304 without the view running.
+# Requests with flashed messages waiting in the session are rendered by the
+# view as usual, so the message is shown once and never cached or 304'd.
+class PageCache:
+    def __init__(self, version=lambda: None):
+        self.version = version
+        self._pages = {}
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'not_modified': 0, 'bypassed': 0}
+
+    def _count(self, key):
+        with self._lock:
+            self._stats[key] += 1
+
+    # Decorator for the GET side of a view; other methods pass through
+    def cached(self, view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view(*args, **kwargs)
+            if session.get('_flashes'):
+                self._count('bypassed')
+                response = make_response(view(*args, **kwargs))
+                response.cache_control.no_store = True
+                return response
+
+            key = (request.endpoint, tuple(sorted(kwargs.items())), self.version())
+            page = self._pages.get(key)
+            if page is None:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                page = _Page(response.get_data(), response.mimetype)
+                with self._lock:
+                    self._pages[key] = page
+                self._count('misses')
+            else:
+                self._count('hits')
+
+            response = current_app.response_class(page.body, mimetype=page.mimetype)
+            response.set_etag(page.etag)
+            response.cache_control.no_cache = True
+            # The same URL shows a flashed message to a visitor whose session carries one
+            response.vary.add('Cookie')
+            response = response.make_conditional(request)
+            if response.status_code == 304:
+                self._count('not_modified')
+            return response
+        return wrapper
+
+    def clear(self):
+        with self._lock:
+            self._pages.clear()
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, pages=len(self._pages))
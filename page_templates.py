@@ -0,0 +1,206 @@
+# HTML templates for the pages served by welcome.py, registered by name
+# with template_registry.register_templates
+welcome_template = """
+<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>Welcome to Chat App</title>
+    <link rel="stylesheet" href="{{ asset_url('css/base.css') }}">
+    <link rel="stylesheet" href="{{ asset_url('css/welcome.css') }}">
+</head>
+<body>
+    <div class="container">
+        <div class="logo">
+            <img src="{{ asset_url('logo.png') }}" alt="Logo">
+        </div>
+        <div class="greeting">Hello, Let's Chat</div>
+        <div class="description">What's on your mind?<br>Chat Anywhere, Anytime</div>
+        <button class="welcome-button" onclick="location.href='/signin'">WELCOME</button>
+    </div>
+    <div class="curved-background"></div>
+</body>
+</html>
+"""
+
+signin_template = """
+<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>Sign In</title>
+    <link rel="stylesheet" href="{{ asset_url('css/base.css') }}">
+    <link rel="stylesheet" href="{{ asset_url('css/auth.css') }}">
+</head>
+<body>
+    <div class="signin-container">
+        <h2>Sign In</h2>
+        {% with messages = get_flashed_messages() %}
+          {% if messages %}
+            <div class="flash-message">{{ messages[0] }}</div>
+          {% endif %}
+        {% endwith %}
+        <form method="post" action="/signin">
+            <div class="form-group">
+                <label for="username">Username</label>
+                <input type="text" id="username" name="username" placeholder="Enter your username" required>
+            </div>
+            <div class="form-group">
+                <label for="password">Password</label>
+                <input type="password" id="password" name="password" placeholder="Enter your password" required>
+            </div>
+            <button type="submit" class="signin-button">Sign In</button>
+        </form>
+        <a href="/signup" class="signup-link">Not currently signed up? Sign up first</a>
+    </div>
+    <div class="curved-background"></div>
+</body>
+</html>
+"""
+
+signup_template = """
+<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>Sign Up</title>
+    <link rel="stylesheet" href="{{ asset_url('css/base.css') }}">
+    <link rel="stylesheet" href="{{ asset_url('css/auth.css') }}">
+</head>
+<body>
+    <div class="signup-container">
+        <h2>Sign Up</h2>
+        {% with messages = get_flashed_messages() %}
+          {% if messages %}
+            <div class="flash-message">{{ messages[0] }}</div>
+          {% endif %}
+        {% endwith %}
+        <form method="post" action="/signup">
+            <div class="form-group">
+                <label for="username">Username</label>
+                <input type="text" id="username" name="username" placeholder="Enter your username" required>
+            </div>
+            <div class="form-group">
+                <label for="password">Password</label>
+                <input type="password" id="password" name="password" placeholder="Enter your password" required>
+            </div>
+            <div class="form-group">
+                <label for="retype_password">Retype Password</label>
+                <input type="password" id="retype_password" name="retype_password" placeholder="Retype your password" required>
+            </div>
+            <button type="submit" class="signup-button">Sign Up</button>
+        </form>
+        <a href="/signin" class="signup-link">Already signed up? Go to Sign In</a>
+    </div>
+    <div class="curved-background"></div>
+</body>
+</html>
+"""
+
+groups_template = """
+<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>Available Groups</title>
+    <link rel="stylesheet" href="{{ asset_url('css/base.css') }}">
+    <link rel="stylesheet" href="{{ asset_url('css/groups.css') }}">
+    <script src="{{ asset_url('js/groups.js') }}"></script>
+</head>
+<body>
+    <div class="group-container">
+        <div class="profile-section">
+            <div class="profile-avatar">
+                {% if profile_image %}
+                    <img src="{{ profile_image }}" alt="Profile Avatar" onclick="document.getElementById('profile-image-upload').click();">
+                {% else %}
+                    <div class="no-avatar" onclick="document.getElementById('profile-image-upload').click();">No Image</div>
+                {% endif %}
+            </div>
+            <form id="profile-form" action="/upload_profile_image" method="post" enctype="multipart/form-data" style="display: none;">
+                <input type="file" id="profile-image-upload" name="profile_image" onchange="document.getElementById('profile-form').submit();">
+            </form>
+            <button class="view-profile-button" onclick="location.href='/profile'">View Profile</button>
+        </div>
+        <h2>Available Groups to Join!</h2>
+        <ul class="group-list">
+            {% for group in groups %}
+            <li>
+                <span onclick="selectGroup('{{ group.name }}')">{{ group.name }}</span>
+                <button class="delete-button" onclick="deleteGroup('{{ group.name }}')">Delete</button>
+            </li>
+            {% endfor %}
+        </ul>
+        <form method="post" action="/available_groups">
+            <input type="text" name="group_name" placeholder="Enter new group name" required>
+            <button type="submit" class="create-group-button">Create Group</button>
+        </form>
+    </div>
+    <div class="curved-background"></div>
+</body>
+</html>
+"""
+
+profile_template = """
+<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>User Profile</title>
+    <link rel="stylesheet" href="{{ asset_url('css/base.css') }}">
+    <link rel="stylesheet" href="{{ asset_url('css/profile.css') }}">
+</head>
+<body>
+    <div class="profile-container">
+        <div class="profile-avatar">
+            {% if profile_image %}
+                <img src="{{ profile_image }}" alt="Profile Avatar">
+            {% else %}
+                <div class="no-avatar">No Image</div>
+            {% endif %}
+        </div>
+        <div class="profile-info">Username: {{ username }}</div>
+        <button class="back-button" onclick="location.href='/available_groups'">Back to Groups</button>
+        <button class="delete-profile-button" onclick="location.href='/delete_profile'">Delete Profile</button>
+    </div>
+</body>
+</html>
+"""
+
+chat_template = """
+<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>{{ group_name }} Chat Room</title>
+    <link rel="stylesheet" href="{{ asset_url('css/base.css') }}">
+    <link rel="stylesheet" href="{{ asset_url('css/chat.css') }}">
+    <script src="https://cdnjs.cloudflare.com/ajax/libs/socket.io/4.0.0/socket.io.js"></script>
+    <script src="{{ asset_url('js/chat.js') }}"></script>
+</head>
+<body data-group-name="{{ group_name }}" data-username="{{ username }}" data-oldest="{{ oldest if oldest is not none else '' }}">
+    <div class="chat-container">
+        <div id="messages" class="messages">{% for message in messages %}<p><span class="username">{{ message.username }}: </span>{{ message.message }}</p>{% endfor %}</div>
+        <div class="chat-input">
+            <input type="text" id="message" placeholder="Type a message..." />
+            <button id="send">Send</button>
+        </div>
+    </div>
+</body>
+</html>
+"""
+
+TEMPLATES = {
+    'welcome.html': welcome_template,
+    'signin.html': signin_template,
+    'signup.html': signup_template,
+    'groups.html': groups_template,
+    'profile.html': profile_template,
+    'chat.html': chat_template,
+}
@@ -0,0 +1,201 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+from spool import read_record, write_record
+
+logger = logging.getLogger(__name__)
+
+OVERFLOW_BLOCK = 'block'
+OVERFLOW_DROP_OLDEST = 'drop_oldest'
+OVERFLOW_SPILL = 'spill'
+OVERFLOW_POLICIES = (OVERFLOW_BLOCK, OVERFLOW_DROP_OLDEST, OVERFLOW_SPILL)
+
+
+# Append-only overflow file for the spill policy, in the spool record format.
+# Records left over from a previous run are published again before new ones.
+class SpillFile:
+    def __init__(self, path):
+        self.path = path
+        self.pending = 0
+        self._read_offset = 0
+        if os.path.exists(path):
+            self._recover()
+
+    # Function to count the records a previous run left behind and cut off a
+    # record torn by a crash, so new appends start on a record boundary
+    def _recover(self):
+        with open(self.path, 'r+b') as f:
+            end = 0
+            while read_record(f) is not None:
+                self.pending += 1
+                end = f.tell()
+            if f.tell() != end:
+                f.truncate(end)
+        if self.pending:
+            logger.info('Replaying %d spilled messages from %s', self.pending, self.path)
+        else:
+            os.remove(self.path)
+
+    def append(self, record):
+        with open(self.path, 'ab') as f:
+            write_record(f, record)
+        self.pending += 1
+
+    def read(self, limit):
+        records = []
+        with open(self.path, 'rb') as f:
+            f.seek(self._read_offset)
+            while len(records) < limit:
+                record = read_record(f)
+                if record is None:
+                    break
+                records.append(record)
+            self._read_offset = f.tell()
+        self.pending -= len(records)
+        if self.pending == 0:
+            # Everything has been read back, start the file over
+            os.remove(self.path)
+            self._read_offset = 0
+        return records
+
+
+# Bounded in-memory publish queue drained by a background worker in batches.
+# Socket.IO handlers call submit() and return immediately; publish_batch is
+# only ever called from the worker thread.
+class PublishPipeline:
+    def __init__(self, publish_batch, max_queue=10000, batch_size=100, flush_interval=0.05,
+                 overflow=OVERFLOW_BLOCK, block_timeout=1.0, spill_path=None):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f'Unknown overflow policy: {overflow}')
+        if overflow == OVERFLOW_SPILL and not spill_path:
+            raise ValueError('The spill overflow policy needs a spill_path')
+        self.publish_batch = publish_batch
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow = overflow
+        self.block_timeout = block_timeout
+        self.spill = SpillFile(spill_path) if overflow == OVERFLOW_SPILL else None
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._running = False
+        self._thread = None
+        self._metrics = {
+            'enqueued': 0,
+            'published': 0,
+            'dropped': 0,
+            'spilled': 0,
+            'failed': 0,
+            'flushes': 0,
+            'last_flush_size': 0,
+            'max_flush_size': 0,
+        }
+
+    def start(self):
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+        self._thread = threading.Thread(target=self._run, name='publish-pipeline', daemon=True)
+        self._thread.start()
+
+    # Queue one message for publishing. Returns False if it was dropped.
+    def submit(self, exchange, routing_key, body):
+        record = (exchange, routing_key, body)
+        with self._cond:
+            if self.spill is not None and self.spill.pending:
+                # Keep FIFO order: once spilling, new messages queue behind the spill
+                self.spill.append(record)
+                self._metrics['spilled'] += 1
+                return True
+            if len(self._queue) >= self.max_queue:
+                if self.overflow == OVERFLOW_BLOCK:
+                    deadline = time.monotonic() + self.block_timeout
+                    while len(self._queue) >= self.max_queue:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self._metrics['dropped'] += 1
+                            return False
+                        self._cond.wait(remaining)
+                elif self.overflow == OVERFLOW_DROP_OLDEST:
+                    self._queue.popleft()
+                    self._metrics['dropped'] += 1
+                else:
+                    self.spill.append(record)
+                    self._metrics['spilled'] += 1
+                    return True
+            self._queue.append(record)
+            self._metrics['enqueued'] += 1
+            if len(self._queue) >= self.batch_size:
+                self._cond.notify_all()
+        return True
+
+    def _next_batch(self):
+        with self._cond:
+            deadline = time.monotonic() + self.flush_interval
+            while self._running and len(self._queue) < self.batch_size:
+                if not self._queue and self.spill is not None and self.spill.pending:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            if not self._queue and self.spill is not None and self.spill.pending:
+                self._queue.extend(self.spill.read(self.batch_size))
+            batch = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+            # Wake up submitters waiting under the block policy
+            self._cond.notify_all()
+            return batch
+
+    def _flush(self, batch):
+        try:
+            self.publish_batch(batch)
+        except Exception:
+            logger.exception('Failed to publish a batch of %d messages', len(batch))
+            with self._cond:
+                self._metrics['failed'] += len(batch)
+            return
+        with self._cond:
+            self._metrics['published'] += len(batch)
+            self._metrics['flushes'] += 1
+            self._metrics['last_flush_size'] = len(batch)
+            self._metrics['max_flush_size'] = max(self._metrics['max_flush_size'], len(batch))
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch:
+                self._flush(batch)
+            elif not self._running:
+                return
+
+    # Block until everything queued so far has been handed to the broker
+    def flush(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._cond:
+                if not self._queue and not (self.spill is not None and self.spill.pending):
+                    return True
+                self._cond.notify_all()
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(self.flush_interval / 2)
+
+    def stop(self, timeout=5.0):
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._metrics)
+            stats['queue_depth'] = len(self._queue)
+            stats['spill_depth'] = self.spill.pending if self.spill is not None else 0
+            stats['avg_flush_size'] = stats['published'] / stats['flushes'] if stats['flushes'] else 0
+        return stats
@@ -0,0 +1,123 @@
+import base64
+import json
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from urllib.parse import quote
+from urllib.request import Request, urlopen
+
+logger = logging.getLogger(__name__)
+
+# Number of exchange calls kept in flight during reconciliation
+RECONCILE_CONCURRENCY = 8
+# Seconds to wait for the broker before giving up on outstanding calls
+RECONCILE_TIMEOUT = 30
+MANAGEMENT_PORT = 15672
+
+
+# In-memory set of exchanges known to exist on the broker, so hot paths can
+# skip redeclaring them. Cleared when the broker connection is re-established
+# and refilled by reconcile().
+class ExchangeCache:
+    def __init__(self):
+        self._known = set()
+        self._lock = threading.Lock()
+
+    def __contains__(self, exchange):
+        with self._lock:
+            return exchange in self._known
+
+    def add(self, exchange):
+        with self._lock:
+            self._known.add(exchange)
+
+    def discard(self, exchange):
+        with self._lock:
+            self._known.discard(exchange)
+
+    def replace(self, exchanges):
+        with self._lock:
+            self._known = set(exchanges)
+
+    def clear(self):
+        self.replace(())
+
+    def __len__(self):
+        with self._lock:
+            return len(self._known)
+
+
+# Function to list the exchanges in a vhost through the RabbitMQ management
+# API. AMQP itself can't enumerate exchanges, so this returns None when the
+# management plugin is unreachable and reconciliation skips orphan cleanup.
+def list_exchanges(host, port=MANAGEMENT_PORT, user='guest', password='guest', vhost='/', timeout=5):
+    url = f'http://{host}:{port}/api/exchanges/{quote(vhost, safe="")}?columns=name,type'
+    credentials = base64.b64encode(f'{user}:{password}'.encode()).decode()
+    request = Request(url, headers={'Authorization': f'Basic {credentials}'})
+    try:
+        with urlopen(request, timeout=timeout) as response:
+            return {exchange['name']: exchange['type'] for exchange in json.load(response)}
+    except (OSError, ValueError) as e:
+        logger.warning('Could not list RabbitMQ exchanges: %s', e)
+        return None
+
+
+# Function to tell whether an exchange on the broker could be a group exchange
+def _is_group_exchange(name, exchange_type, topology):
+    return (exchange_type == 'fanout' and name and not name.startswith('amq.')
+            and name != topology.shared_exchange)
+
+
+# Function to run an admin call and return a Future, whether the admin object
+# blocks (ChannelPool) or already returns Futures (AsyncBroker)
+def _submit(executor, fn, *args):
+    result = executor.submit(fn, *args)
+    chained = Future()
+
+    def unwrap(future):
+        try:
+            value = future.result()
+        except Exception as e:
+            chained.set_exception(e)
+            return
+        if isinstance(value, Future):
+            value.add_done_callback(unwrap)
+        else:
+            chained.set_result(value)
+    result.add_done_callback(unwrap)
+    return chained
+
+
+# Function to make the broker match the group list: declare the exchanges the
+# groups need and, in fanout mode with delete_orphans, delete group-style
+# exchanges with no group other than those named in keep. Calls are issued
+# concurrently instead of one round-trip after another, and the cache ends up
+# holding exactly the exchanges known to exist.
+def reconcile(admin, topology, group_names, cache, existing=None, delete_orphans=False,
+              concurrency=RECONCILE_CONCURRENCY, timeout=RECONCILE_TIMEOUT, keep=()):
+    wanted = {topology.route(name)[0]: topology.exchange_type for name in group_names}
+    if topology.mode == 'topic':
+        wanted = {topology.shared_exchange: 'topic'}
+    to_declare = [name for name in wanted if existing is None or name not in existing]
+    orphans = []
+    if delete_orphans and existing is not None and topology.mode == 'fanout':
+        orphans = [name for name, exchange_type in existing.items()
+                   if name not in wanted and name not in keep and _is_group_exchange(name, exchange_type, topology)]
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        declares = {name: _submit(executor, admin.declare_exchange, name, wanted[name]) for name in to_declare}
+        deletes = {name: _submit(executor, admin.delete_exchange, name) for name in orphans}
+        wait(list(declares.values()) + list(deletes.values()), timeout=timeout)
+
+    failed = [name for name, future in declares.items() if not future.done() or future.exception() is not None]
+    for name in failed:
+        logger.error('Could not declare exchange %s', name)
+    cache.replace(set(wanted) - set(failed))
+    summary = {
+        'declared': len(to_declare) - len(failed),
+        'deleted': sum(1 for future in deletes.values() if future.done() and future.exception() is None),
+        'failed': len(failed),
+        'known': len(cache),
+    }
+    logger.info('Exchange reconciliation: %s', summary)
+    return summary
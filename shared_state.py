@@ -0,0 +1,121 @@
+import json
+import logging
+import threading
+from collections import deque
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+# Fanout exchange carrying user and group changes between worker processes
+STATE_EXCHANGE = 'chat.state'
+# Changes kept for a later announcement while the broker can't take them;
+# the oldest are dropped past this
+MAX_UNANNOUNCED = 10000
+
+
+# Wraps a storage backend so several worker processes keep the same users
+# and groups in memory. Every change is stored as usual and then announced on
+# STATE_EXCHANGE; the other processes receive it through their consumer and
+# apply it to their in-memory view, so no request has to reread the files.
+# A process's own announcements are filtered out by the consumer's app_id
+# check. Changes use the journal's record format.
+# An announcement the broker doesn't confirm is kept and sent again by the
+# next announcement or retry(); a process that was disconnected from the
+# broker calls refresh() to read back what it may have missed.
+class SharedStorage:
+    def __init__(self, storage, publish, exchange=STATE_EXCHANGE, max_unannounced=MAX_UNANNOUNCED):
+        self.storage = storage
+        self.exchange = exchange
+        self.max_unannounced = max_unannounced
+        self._publish = publish
+        self._unannounced = deque()
+        self._lock = threading.Lock()
+        self._metrics = {'announced': 0, 'applied': 0, 'failed': 0, 'dropped': 0}
+
+    def _announce(self, record):
+        with self._lock:
+            self._unannounced.append(record)
+            if len(self._unannounced) > self.max_unannounced:
+                dropped = self._unannounced.popleft()
+                self._metrics['dropped'] += 1
+                logger.error('Dropping the announcement of a %s change; too many are waiting', dropped['op'])
+        self.retry()
+
+    def _keep(self, record, error):
+        logger.warning('Could not announce a %s change, will retry: %s', record['op'], error)
+        with self._lock:
+            self._metrics['failed'] += 1
+            self._unannounced.appendleft(record)
+
+    # Function to publish the waiting announcements, oldest first
+    def retry(self):
+        while True:
+            with self._lock:
+                if not self._unannounced:
+                    return
+                record = self._unannounced.popleft()
+            try:
+                result = self._publish(self.exchange, '', json.dumps(record).encode())
+            except Exception as e:
+                self._keep(record, e)
+                return
+            if isinstance(result, Future):
+                result.add_done_callback(lambda future, record=record: self._on_confirmed(future, record))
+            else:
+                with self._lock:
+                    self._metrics['announced'] += 1
+
+    def _on_confirmed(self, future, record):
+        if future.exception() is not None:
+            self._keep(record, future.exception())
+            return
+        with self._lock:
+            self._metrics['announced'] += 1
+
+    # Function to take in a change announced by another process and return it
+    def apply(self, body):
+        record = json.loads(body)
+        self.storage.apply(record)
+        with self._lock:
+            self._metrics['applied'] += 1
+        return record
+
+    # Function to read back changes whose announcements never arrived
+    def refresh(self):
+        self.storage.refresh()
+
+    def get_user(self, username):
+        return self.storage.get_user(username)
+
+    def add_user(self, username, password_hash):
+        self.storage.add_user(username, password_hash)
+        self._announce({'op': 'add_user', 'username': username, 'password_hash': password_hash})
+
+    def delete_user(self, username):
+        if not self.storage.delete_user(username):
+            return False
+        self._announce({'op': 'delete_user', 'username': username})
+        return True
+
+    def list_groups(self):
+        return self.storage.list_groups()
+
+    def group_exists(self, name):
+        return self.storage.group_exists(name)
+
+    def add_group(self, name):
+        self.storage.add_group(name)
+        self._announce({'op': 'add_group', 'name': name})
+
+    def delete_group(self, name):
+        if not self.storage.delete_group(name):
+            return False
+        self._announce({'op': 'delete_group', 'name': name})
+        return True
+
+    def stats(self):
+        with self._lock:
+            return dict(self._metrics, unannounced=len(self._unannounced))
+
+    def close(self):
+        self.storage.close()
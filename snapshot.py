@@ -0,0 +1,71 @@
+import mmap
+import os
+import struct
+import zlib
+
+import msgspec
+
+from journal import atomic_file
+
+# Binary snapshot of users and groups, loaded at startup in place of the JSON
+# files when it is at least as new as both of them. Layout:
+#   magic (8 bytes) | version (uint32) | payload length (uint64) | crc32 (uint32) | payload
+# where the payload is a MessagePack-encoded Snapshot.
+SNAPSHOT_MAGIC = b'CHATSNAP'
+SNAPSHOT_VERSION = 1
+
+_HEADER = struct.Struct('>8sIQI')
+
+
+class SnapshotError(ValueError):
+    pass
+
+
+class Snapshot(msgspec.Struct, array_like=True):
+    users: dict[str, str]
+    groups: list[str]
+
+
+_encoder = msgspec.msgpack.Encoder()
+_decoder = msgspec.msgpack.Decoder(Snapshot)
+
+
+# Function to write users and groups to a snapshot file atomically
+def write_snapshot(path, users, groups):
+    payload = _encoder.encode(Snapshot(users=users, groups=[group['name'] for group in groups]))
+    with atomic_file(path, 'wb') as f:
+        f.write(_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(payload), zlib.crc32(payload)))
+        f.write(payload)
+
+
+# Function to read a snapshot file back as (users, groups). The file is
+# memory-mapped and decoded in place rather than read into a bytes copy.
+def read_snapshot(path):
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size < _HEADER.size:
+            raise SnapshotError(f'Truncated snapshot: {path}')
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            magic, version, length, checksum = _HEADER.unpack_from(data)
+            if magic != SNAPSHOT_MAGIC:
+                raise SnapshotError(f'Not a snapshot file: {path}')
+            if version != SNAPSHOT_VERSION:
+                raise SnapshotError(f'Unsupported snapshot version {version}: {path}')
+            with memoryview(data) as view:
+                payload = view[_HEADER.size:]
+                try:
+                    if len(payload) != length or zlib.crc32(payload) != checksum:
+                        raise SnapshotError(f'Corrupt snapshot: {path}')
+                    snapshot = _decoder.decode(payload)
+                except msgspec.DecodeError as e:
+                    raise SnapshotError(f'Corrupt snapshot: {path}: {e}') from e
+                finally:
+                    payload.release()
+    return snapshot.users, [{'name': name} for name in snapshot.groups]
+
+
+# Function to tell whether a snapshot is at least as new as the files it replaces
+def is_current(path, *sources):
+    if not os.path.exists(path):
+        return False
+    mtime = os.path.getmtime(path)
+    return all(not os.path.exists(source) or os.path.getmtime(source) <= mtime for source in sources)
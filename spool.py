@@ -0,0 +1,350 @@
+import json
+import logging
+import os
+import struct
+import threading
+import time
+
+from confirms import ExchangeNotFound, PublishRetriesExhausted
+
+logger = logging.getLogger(__name__)
+
+# Upper bound on disk used by the spool; the oldest segments are dropped past it
+SPOOL_MAX_BYTES = 256 * 1024 * 1024
+# Size at which the spool starts a new segment file
+SPOOL_SEGMENT_BYTES = 8 * 1024 * 1024
+# Consecutive failures before the circuit opens
+BREAKER_FAILURE_THRESHOLD = 3
+# Seconds the circuit stays open before a trial publish is allowed
+BREAKER_RESET_TIMEOUT = 5.0
+
+_LENGTH = struct.Struct('>I')
+_SEGMENT_PREFIX = 'spool-'
+_SEGMENT_SUFFIX = '.log'
+_CHECKPOINT = 'checkpoint.json'
+
+# Publish failures that retrying can never fix: the group's exchange was deleted,
+# or the publisher already gave up after its own retries
+PERMANENT_ERRORS = (ExchangeNotFound, PublishRetriesExhausted)
+
+
+def _as_bytes(value):
+    return value if isinstance(value, bytes) else value.encode('utf-8')
+
+
+# Function to write an (exchange, routing_key, body) record as three
+# length-prefixed fields
+def write_record(f, record):
+    for field in record:
+        data = _as_bytes(field)
+        f.write(_LENGTH.pack(len(data)))
+        f.write(data)
+
+
+# Function to read one record, or None at end of file or on a torn write
+def read_record(f):
+    fields = []
+    for _ in range(3):
+        header = f.read(_LENGTH.size)
+        if len(header) < _LENGTH.size:
+            return None
+        size = _LENGTH.unpack(header)[0]
+        data = f.read(size)
+        if len(data) < size:
+            return None
+        fields.append(data)
+    return fields[0].decode('utf-8'), fields[1].decode('utf-8'), fields[2]
+
+
+# Stops publish attempts after repeated failures so callers don't pay a
+# connect timeout per message while the broker is down.
+class CircuitBreaker:
+    def __init__(self, failure_threshold=BREAKER_FAILURE_THRESHOLD, reset_timeout=BREAKER_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return 'closed'
+            if time.monotonic() - self._opened_at >= self.reset_timeout:
+                return 'half_open'
+            return 'open'
+
+    def allow(self):
+        return self.state != 'open'
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._failures >= self.failure_threshold or self._opened_at is not None:
+                # A failed trial in the half-open state re-opens the circuit
+                self._opened_at = time.monotonic()
+
+
+# Append-only, segmented on-disk queue of publish records. Records are read
+# back in order and only forgotten once commit() confirms they were published;
+# the read position survives restarts through a small checkpoint file.
+class Spool:
+    def __init__(self, directory, max_bytes=SPOOL_MAX_BYTES, segment_bytes=SPOOL_SEGMENT_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.segment_bytes = segment_bytes
+        self._lock = threading.Lock()
+        self._counts = {}
+        self._sizes = {}
+        self._metrics = {'spooled': 0, 'replayed': 0, 'dropped': 0}
+        os.makedirs(directory, exist_ok=True)
+        self._checkpoint = self._load_checkpoint()
+        for segment in self._existing_segments():
+            if segment < self._checkpoint[0]:
+                # Already replayed before the last shutdown
+                os.remove(self._path(segment))
+                continue
+            self._counts[segment], self._sizes[segment] = self._scan(segment)
+        # Always append to a fresh segment so a torn write from a crash is
+        # never followed by new records
+        self._active = max(self._counts, default=0)
+        self._start_segment()
+
+    def _path(self, segment):
+        return os.path.join(self.directory, f'{_SEGMENT_PREFIX}{segment:012d}{_SEGMENT_SUFFIX}')
+
+    def _start_segment(self):
+        self._active += 1
+        self._counts[self._active], self._sizes[self._active] = 0, 0
+        open(self._path(self._active), 'ab').close()
+
+    def _existing_segments(self):
+        segments = []
+        for name in os.listdir(self.directory):
+            if name.startswith(_SEGMENT_PREFIX) and name.endswith(_SEGMENT_SUFFIX):
+                segments.append(int(name[len(_SEGMENT_PREFIX):-len(_SEGMENT_SUFFIX)]))
+        return sorted(segments)
+
+    def _load_checkpoint(self):
+        path = os.path.join(self.directory, _CHECKPOINT)
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                data = json.load(f)
+            return data['segment'], data['offset']
+        return 0, 0
+
+    def _save_checkpoint(self):
+        path = os.path.join(self.directory, _CHECKPOINT)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'segment': self._checkpoint[0], 'offset': self._checkpoint[1]}, f)
+        os.replace(tmp_path, path)
+
+    # Count the unread records in a segment left over from a previous run
+    def _scan(self, segment):
+        offset = self._checkpoint[1] if segment == self._checkpoint[0] else 0
+        count = 0
+        with open(self._path(segment), 'rb') as f:
+            f.seek(offset)
+            while read_record(f) is not None:
+                count += 1
+            size = f.seek(0, os.SEEK_END)
+        return count, size
+
+    @property
+    def pending(self):
+        with self._lock:
+            return sum(self._counts.values())
+
+    def append(self, records):
+        with self._lock:
+            path = self._path(self._active)
+            with open(path, 'ab') as f:
+                for record in records:
+                    write_record(f, record)
+                f.flush()
+                os.fsync(f.fileno())
+                self._sizes[self._active] = f.tell()
+            self._counts[self._active] += len(records)
+            self._metrics['spooled'] += len(records)
+            if self._sizes[self._active] >= self.segment_bytes:
+                self._start_segment()
+            self._enforce_limit()
+
+    def _enforce_limit(self):
+        while sum(self._sizes.values()) > self.max_bytes and len(self._counts) > 1:
+            oldest = min(self._counts)
+            logger.warning('Spool is full, dropping %d messages', self._counts[oldest])
+            self._metrics['dropped'] += self._counts.pop(oldest)
+            del self._sizes[oldest]
+            os.remove(self._path(oldest))
+
+    # Read up to `limit` records from the read position without consuming them.
+    # Returns (records, position) where position is passed back to commit().
+    def read(self, limit):
+        records = []
+        with self._lock:
+            segment, offset = self._checkpoint
+            if segment not in self._counts:
+                segment, offset = min(self._counts), 0
+            consumed = {}
+            while len(records) < limit and segment in self._counts:
+                with open(self._path(segment), 'rb') as f:
+                    f.seek(offset)
+                    while len(records) < limit:
+                        record = read_record(f)
+                        if record is None:
+                            break
+                        records.append(record)
+                        consumed[segment] = consumed.get(segment, 0) + 1
+                    offset = f.tell()
+                if len(records) < limit and segment < self._active:
+                    segment, offset = segment + 1, 0
+                else:
+                    break
+        return records, (segment, offset, consumed)
+
+    def commit(self, position):
+        segment, offset, consumed = position
+        with self._lock:
+            for seg, count in consumed.items():
+                if seg in self._counts:
+                    self._counts[seg] -= count
+                    self._metrics['replayed'] += count
+            # Fully read segments before the new position can go
+            for seg in sorted(self._counts):
+                if seg < segment and self._counts[seg] <= 0:
+                    del self._counts[seg]
+                    del self._sizes[seg]
+                    os.remove(self._path(seg))
+            self._checkpoint = (segment, offset)
+            self._save_checkpoint()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._metrics)
+            stats['pending'] = sum(self._counts.values())
+            stats['bytes'] = sum(self._sizes.values())
+            stats['segments'] = len(self._counts)
+        return stats
+
+
+# Publishes batches through `publisher` while the broker is healthy and falls
+# back to the spool when the circuit is open or a publish fails. A background
+# replayer drains the spool in order once the broker is reachable again; while
+# anything is spooled, new messages queue behind it to preserve ordering.
+class SpoolingPublisher:
+    def __init__(self, publisher, spool, breaker=None, replay_batch=100, replay_interval=1.0,
+                 confirm_timeout=10.0):
+        self.publisher = publisher
+        self.spool = spool
+        self.breaker = breaker or CircuitBreaker()
+        self.replay_batch = replay_batch
+        self.replay_interval = replay_interval
+        self.confirm_timeout = confirm_timeout
+        self._running = False
+        self._thread = None
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+        self._discarded = 0
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._replay_loop, name='spool-replayer', daemon=True)
+        self._thread.start()
+
+    def publish_batch(self, batch):
+        if self.spool.pending or not self.breaker.allow() or not self.publisher.is_connected():
+            if self.breaker.allow() and not self.publisher.is_connected():
+                self.breaker.record_failure()
+            self.spool.append(batch)
+            self._wakeup.set()
+            return
+        for i, record in enumerate(batch):
+            try:
+                future = self.publisher.publish(*record)
+            except Exception:
+                # The window stayed full or the connection dropped mid-batch
+                self.breaker.record_failure()
+                self.spool.append(batch[i:])
+                self._wakeup.set()
+                return
+            future.add_done_callback(lambda f, record=record: self._on_confirmed(f, record))
+
+    def _on_confirmed(self, future, record):
+        error = future.exception()
+        if error is None:
+            self.breaker.record_success()
+            return
+        if isinstance(error, PERMANENT_ERRORS):
+            self._discard(record, error)
+            return
+        self.breaker.record_failure()
+        self.spool.append([record])
+        self._wakeup.set()
+
+    # Function to drop records that can never be published instead of retrying
+    # them forever, which would hold back everything spooled behind them
+    def _discard(self, record, error):
+        logger.warning('Discarding an undeliverable message for %s: %s', record[0], error)
+        with self._lock:
+            self._discarded += 1
+
+    def _replay_loop(self):
+        while self._running:
+            self._wakeup.wait(self.replay_interval)
+            self._wakeup.clear()
+            try:
+                while self._running and self.spool.pending and self.breaker.allow() and self.publisher.is_connected():
+                    if not self._replay_once():
+                        break
+            except Exception:
+                logger.exception('Spool replay failed')
+
+    def _replay_once(self):
+        records, position = self.spool.read(self.replay_batch)
+        if not records:
+            # Only torn or already-dropped records remain; move past them
+            self.spool.commit(position)
+            return False
+        try:
+            futures = [self.publisher.publish(*record) for record in records]
+        except Exception:
+            self.breaker.record_failure()
+            return False
+        deadline = time.monotonic() + self.confirm_timeout
+        undeliverable = []
+        for record, future in zip(records, futures):
+            try:
+                future.result(max(0, deadline - time.monotonic()))
+            except PERMANENT_ERRORS as error:
+                undeliverable.append((record, error))
+            except Exception:
+                # Leave the batch in the spool; confirmed ones may be sent twice
+                self.breaker.record_failure()
+                return False
+        self.spool.commit(position)
+        for record, error in undeliverable:
+            self._discard(record, error)
+        self.breaker.record_success()
+        return True
+
+    def stop(self, timeout=5.0):
+        self._running = False
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def stats(self):
+        with self._lock:
+            discarded = self._discarded
+        return dict(self.spool.stats(), circuit=self.breaker.state, discarded=discarded)
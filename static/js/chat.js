@@ -0,0 +1,54 @@
+document.addEventListener('DOMContentLoaded', (event) => {
+    var socket = io.connect('http://' + document.domain + ':' + location.port);
+    // Set by the page on <body>
+    var groupName = document.body.dataset.groupName;
+    var username = document.body.dataset.username;
+    var oldest = document.body.dataset.oldest === '' ? null : Number(document.body.dataset.oldest);
+    var loadingOlder = false;
+
+    socket.emit('join', {'room': groupName, 'username': username});
+
+    socket.on('message', function(data) {
+        var messages = document.getElementById('messages');
+        messages.appendChild(renderMessage(data));
+        messages.scrollTop = messages.scrollHeight;
+    });
+
+    function renderMessage(data) {
+        var message = document.createElement('p');
+        var user = document.createElement('span');
+        user.className = 'username';
+        user.textContent = data.username + ': ';
+        message.appendChild(user);
+        message.appendChild(document.createTextNode(data.message));
+        return message;
+    }
+
+    // Fetch the previous page of the room's log when scrolled to the top
+    var messagesBox = document.getElementById('messages');
+    messagesBox.scrollTop = messagesBox.scrollHeight;
+    messagesBox.addEventListener('scroll', function() {
+        if (messagesBox.scrollTop > 0 || oldest === null || oldest === 0 || loadingOlder) {
+            return;
+        }
+        loadingOlder = true;
+        fetch('/chat/' + encodeURIComponent(groupName) + '/history?before=' + oldest)
+            .then(function(response) { return response.json(); })
+            .then(function(page) {
+                var height = messagesBox.scrollHeight;
+                var first = messagesBox.firstChild;
+                page.messages.forEach(function(data) {
+                    messagesBox.insertBefore(renderMessage(data), first);
+                });
+                oldest = page.oldest;
+                messagesBox.scrollTop = messagesBox.scrollHeight - height;
+                loadingOlder = false;
+            });
+    });
+
+    document.getElementById('send').onclick = function() {
+        var text = document.getElementById('message').value;
+        socket.emit('text', {'message': text, 'room': groupName, 'username': username});
+        document.getElementById('message').value = '';
+    };
+});
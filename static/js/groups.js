@@ -0,0 +1,37 @@
+function selectGroup(groupName) {
+    fetch('/select_group', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json'
+        },
+        body: JSON.stringify({ group_name: groupName })
+    })
+    .then(response => response.json())
+    .then(data => {
+        if (data.status === 'success') {
+            window.location.href = '/chat/' + groupName;
+        } else {
+            alert('Error selecting group');
+        }
+    })
+    .catch(error => console.error('Error:', error));
+}
+
+function deleteGroup(groupName) {
+    fetch('/delete_group', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json'
+        },
+        body: JSON.stringify({ group_name: groupName })
+    })
+    .then(response => response.json())
+    .then(data => {
+        if (data.status === 'success') {
+            location.reload();
+        } else {
+            alert('Error deleting group');
+        }
+    })
+    .catch(error => console.error('Error:', error));
+}
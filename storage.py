@@ -0,0 +1,569 @@
+import hashlib
+import json
+import logging
+import os
+import queue
+import sqlite3
+import sys
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from journal import JournalStorage, apply_record, file_lock, write_atomic
+from snapshot import SnapshotError, is_current, read_snapshot, write_snapshot
+
+logger = logging.getLogger(__name__)
+
+# Storage backends for users and groups. Every backend exposes the same
+# operations the routes in welcome.py need:
+#   get_user(username) -> password hash or None
+#   add_user(username, password_hash)
+#   delete_user(username) -> True if the user existed
+#   list_groups() -> [{'name': ...}, ...] in creation order
+#   group_exists(name)
+#   add_group(name)
+#   delete_group(name) -> True if the group existed
+#   apply(record) -> take in a change another process already stored
+#   refresh() -> read back changes other processes stored, for when their
+#                announcements may have been missed
+
+
+# The original format: one JSON document per kind. With flush_interval set,
+# changes are queued and a background thread writes each changed document
+# once per interval, so a burst of signups or new groups costs one write
+# instead of one per request; without it every change is written at once.
+# Writes go to a temp file that is renamed into place, so a crash never
+# leaves a half-written document. Several processes can share the files: a
+# write holds a lock on its document, and if another process rewrote the
+# document since this one last read it, it is read back and the queued
+# changes are applied on top, so no process overwrites another's changes.
+# With snapshot_file set, close() also writes a binary snapshot, and startup
+# loads it instead of parsing the JSON files as long as neither file has
+# changed since.
+class JsonStorage:
+    def __init__(self, credentials_file, groups_file, flush_interval=None, snapshot_file=None):
+        self.credentials_file = credentials_file
+        self.groups_file = groups_file
+        self.flush_interval = flush_interval
+        self.snapshot_file = snapshot_file
+        self._lock = threading.Lock()
+        # Held for a whole copy-and-write, so the writer thread and flush()
+        # never interleave and an older copy can't land over a newer one
+        self._write_lock = threading.Lock()
+        # What each document looked like on disk when this process last read or wrote it
+        self._stamps = {}
+        self.users, self.groups = self._load_state()
+        # Change records not written yet, per document
+        self._pending = {credentials_file: [], groups_file: []}
+        self._flushed = threading.Condition(self._lock)
+        self._writes = 0
+        self._running = True
+        self._writer = None
+        if flush_interval:
+            self._writer = threading.Thread(target=self._write_loop, name='storage-writer', daemon=True)
+            self._writer.start()
+
+    def _load_state(self):
+        # Stamped before reading, so a write that lands in between is noticed later
+        for path in (self.credentials_file, self.groups_file):
+            self._stamps[path] = self._stamp(path)
+        if self.snapshot_file and is_current(self.snapshot_file, self.credentials_file, self.groups_file):
+            try:
+                return read_snapshot(self.snapshot_file)
+            except (OSError, SnapshotError) as e:
+                logger.warning('Ignoring snapshot, loading JSON instead: %s', e)
+        return self._load(self.credentials_file, {}), self._load(self.groups_file, [])
+
+    def _load(self, path, default):
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                return json.load(f)
+        return default
+
+    def _stamp(self, path):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+    def _apply_to(self, path, data, record):
+        if path == self.credentials_file:
+            apply_record(data, [], record)
+        else:
+            apply_record({}, data, record)
+
+    # Called with the lock held: apply a change in memory and queue it for its document
+    def _change(self, path, record):
+        apply_record(self.users, self.groups, record)
+        self._pending[path].append(record)
+
+    # Write-through unless the writer thread does it later
+    def _save(self):
+        if self._writer is None:
+            self._write_dirty()
+
+    def _write_loop(self):
+        while True:
+            with self._lock:
+                self._flushed.wait_for(lambda: not self._running, timeout=self.flush_interval)
+                running = self._running
+            self._write_dirty()
+            if not running:
+                return
+
+    # Function to write out every document with queued changes
+    def _write_dirty(self):
+        with self._write_lock:
+            for path in (self.credentials_file, self.groups_file):
+                with self._lock:
+                    if not self._pending[path]:
+                        continue
+                self._write(path)
+            with self._lock:
+                self._flushed.notify_all()
+
+    # Called with the write lock held. The data is copied under the lock so
+    # the write never sees a list or dict mid-change.
+    def _write(self, path):
+        is_users = path == self.credentials_file
+        with file_lock(path):
+            with self._lock:
+                records = self._pending[path]
+                self._pending[path] = []
+                data = dict(self.users) if is_users else [dict(group) for group in self.groups]
+            try:
+                if self._stamp(path) != self._stamps[path]:
+                    # Another process wrote it since: start from its version
+                    data = self._reload(path, records)
+                write_atomic(path, data)
+            except BaseException:
+                with self._lock:
+                    self._pending[path][:0] = records
+                raise
+            self._stamps[path] = self._stamp(path)
+        with self._lock:
+            self._writes += 1
+
+    # Called with the file lock held: read a document another process rewrote,
+    # apply records on top and make that, plus the changes still queued, the
+    # in-memory view. Returns the document with records applied.
+    def _reload(self, path, records=()):
+        is_users = path == self.credentials_file
+        data = self._load(path, {} if is_users else [])
+        for record in records:
+            self._apply_to(path, data, record)
+        with self._lock:
+            current = dict(data) if is_users else [dict(group) for group in data]
+            for record in self._pending[path]:
+                self._apply_to(path, current, record)
+            if is_users:
+                self.users = current
+            else:
+                self.groups = current
+        return data
+
+    # Function to read back any document another process rewrote since this
+    # one last read or wrote it
+    def refresh(self):
+        with self._write_lock:
+            for path in (self.credentials_file, self.groups_file):
+                if self._stamp(path) == self._stamps[path]:
+                    continue
+                with file_lock(path):
+                    stamp = self._stamp(path)
+                    self._reload(path)
+                    self._stamps[path] = stamp
+
+    # Function to write any pending changes now and wait until they are on disk
+    def flush(self):
+        self._write_dirty()
+
+    def stats(self):
+        with self._lock:
+            return {'dirty': sum(1 for records in self._pending.values() if records), 'writes': self._writes}
+
+    def get_user(self, username):
+        return self.users.get(username)
+
+    def add_user(self, username, password_hash):
+        with self._lock:
+            self._change(self.credentials_file, {'op': 'add_user', 'username': username,
+                                                 'password_hash': password_hash})
+        self._save()
+
+    def delete_user(self, username):
+        with self._lock:
+            if username not in self.users:
+                return False
+            self._change(self.credentials_file, {'op': 'delete_user', 'username': username})
+        self._save()
+        return True
+
+    def list_groups(self):
+        with self._lock:
+            return list(self.groups)
+
+    def group_exists(self, name):
+        with self._lock:
+            return any(group['name'] == name for group in self.groups)
+
+    def add_group(self, name):
+        with self._lock:
+            self._change(self.groups_file, {'op': 'add_group', 'name': name})
+        self._save()
+
+    def delete_group(self, name):
+        with self._lock:
+            if not any(group['name'] == name for group in self.groups):
+                return False
+            self._change(self.groups_file, {'op': 'delete_group', 'name': name})
+        self._save()
+        return True
+
+    # The process that made the change has written it, and this process reads
+    # it back before its own next write, so only the in-memory view is updated
+    def apply(self, record):
+        with self._lock:
+            apply_record(self.users, self.groups, record)
+
+    # Flushes pending changes so nothing is lost on shutdown, then writes the
+    # snapshot the next start loads
+    def close(self):
+        if self._writer is not None:
+            with self._lock:
+                if not self._running:
+                    return
+                self._running = False
+                self._flushed.notify_all()
+            self._writer.join()
+        if self.snapshot_file:
+            self._write_snapshot()
+
+    # Skipped if another process changed the files since this one last read
+    # or wrote them, since this process's view might be missing its changes
+    def _write_snapshot(self):
+        with file_lock(self.credentials_file), file_lock(self.groups_file):
+            if any(self._stamp(path) != self._stamps[path] for path in (self.credentials_file, self.groups_file)):
+                logger.info('Not writing a snapshot: another process changed the JSON files')
+                return
+            with self._lock:
+                write_snapshot(self.snapshot_file, self.users, self.groups)
+
+
+# Number of shard files credentials are split into when a shard directory is created
+CREDENTIAL_SHARDS = 64
+# Shards kept loaded at once
+CREDENTIAL_SHARD_CACHE = 16
+_SHARD_META = 'shards.json'
+
+
+# Function to pick a username's shard; a stable hash, unlike hash(), so the
+# same user lands in the same file in every process and after restarts
+def shard_for(username, shard_count):
+    digest = hashlib.blake2b(username.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') % shard_count
+
+
+# Credentials split into shard_count JSON files by a hash of the username.
+# A shard is read the first time one of its users is looked up and kept in
+# an LRU of cache_size shards; a change rewrites only the owning shard.
+# Groups are few and stay in one JSON document, as in JsonStorage.
+class ShardedStorage:
+    def __init__(self, directory, groups_file, shard_count=CREDENTIAL_SHARDS, cache_size=CREDENTIAL_SHARD_CACHE):
+        self.directory = directory
+        self.groups_file = groups_file
+        self.cache_size = cache_size
+        os.makedirs(directory, exist_ok=True)
+        meta_path = os.path.join(directory, _SHARD_META)
+        self.created = not os.path.exists(meta_path)
+        if self.created:
+            write_atomic(meta_path, {'shards': shard_count})
+        with open(meta_path, 'r') as f:
+            # The count a directory was created with wins, or users would be looked up in the wrong files
+            self.shard_count = json.load(f)['shards']
+        self._shards = OrderedDict()
+        self._shard_locks = [threading.Lock() for _ in range(self.shard_count)]
+        self._lock = threading.Lock()
+        self._loads = 0
+        self.groups = []
+        if os.path.exists(groups_file):
+            with open(groups_file, 'r') as f:
+                self.groups = json.load(f)
+
+    def _shard_path(self, shard):
+        return os.path.join(self.directory, f'users-{shard:04d}.json')
+
+    # Function to get a shard's users, loading it and evicting the least
+    # recently used shard if needed. Called with the shard's lock held.
+    def _shard(self, shard):
+        with self._lock:
+            users = self._shards.get(shard)
+            if users is not None:
+                self._shards.move_to_end(shard)
+                return users
+        path = self._shard_path(shard)
+        users = {}
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                users = json.load(f)
+        with self._lock:
+            self._loads += 1
+            self._shards[shard] = users
+            # Shards are written through, so an evicted shard has nothing unsaved
+            while len(self._shards) > self.cache_size:
+                self._shards.popitem(last=False)
+        return users
+
+    def get_user(self, username):
+        shard = shard_for(username, self.shard_count)
+        with self._shard_locks[shard]:
+            return self._shard(shard).get(username)
+
+    def add_user(self, username, password_hash):
+        shard = shard_for(username, self.shard_count)
+        with self._shard_locks[shard]:
+            users = self._shard(shard)
+            users[username] = password_hash
+            write_atomic(self._shard_path(shard), users)
+
+    def delete_user(self, username):
+        shard = shard_for(username, self.shard_count)
+        with self._shard_locks[shard]:
+            users = self._shard(shard)
+            if username not in users:
+                return False
+            del users[username]
+            write_atomic(self._shard_path(shard), users)
+            return True
+
+    def list_groups(self):
+        with self._lock:
+            return list(self.groups)
+
+    def group_exists(self, name):
+        with self._lock:
+            return any(group['name'] == name for group in self.groups)
+
+    def add_group(self, name):
+        with self._lock:
+            self.groups.append({'name': name})
+            write_atomic(self.groups_file, self.groups)
+
+    def delete_group(self, name):
+        with self._lock:
+            if not any(group['name'] == name for group in self.groups):
+                return False
+            self.groups[:] = [group for group in self.groups if group['name'] != name]
+            write_atomic(self.groups_file, self.groups)
+            return True
+
+    # A change to a shard that isn't loaded is picked up when it is next read
+    def apply(self, record):
+        if 'username' in record:
+            shard = shard_for(record['username'], self.shard_count)
+            with self._shard_locks[shard], self._lock:
+                users = self._shards.get(shard)
+                if users is not None:
+                    apply_record(users, [], record)
+        else:
+            with self._lock:
+                apply_record({}, self.groups, record)
+
+    # The shards belong to one process, so no other process changes them
+    def refresh(self):
+        pass
+
+    # Bulk load used by import_json: each shard is written once
+    def import_data(self, users, groups):
+        by_shard = {}
+        for username, password_hash in users.items():
+            by_shard.setdefault(shard_for(username, self.shard_count), {})[username] = password_hash
+        for shard, shard_users in by_shard.items():
+            with self._shard_locks[shard]:
+                merged = self._shard(shard)
+                merged.update(shard_users)
+                write_atomic(self._shard_path(shard), merged)
+        with self._lock:
+            for group in groups:
+                if not any(existing['name'] == group['name'] for existing in self.groups):
+                    self.groups.append({'name': group['name']})
+            write_atomic(self.groups_file, self.groups)
+
+    def stats(self):
+        with self._lock:
+            return {'shards': self.shard_count, 'loaded': len(self._shards), 'loads': self._loads}
+
+    def close(self):
+        pass
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    username TEXT PRIMARY KEY,
+    password_hash TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS groups (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL UNIQUE
+);
+"""
+
+_GET_USER = 'SELECT password_hash FROM users WHERE username = ?'
+_UPSERT_USER = ('INSERT INTO users (username, password_hash) VALUES (?, ?) '
+                'ON CONFLICT (username) DO UPDATE SET password_hash = excluded.password_hash')
+_DELETE_USER = 'DELETE FROM users WHERE username = ?'
+_LIST_GROUPS = 'SELECT name FROM groups ORDER BY id'
+_GROUP_EXISTS = 'SELECT 1 FROM groups WHERE name = ?'
+_INSERT_GROUP = 'INSERT OR IGNORE INTO groups (name) VALUES (?)'
+_DELETE_GROUP = 'DELETE FROM groups WHERE name = ?'
+
+
+# Connections SqliteStorage keeps open; requests beyond this wait for one
+SQLITE_POOL_SIZE = 4
+# Seconds a request waits for a free SQLite connection
+SQLITE_ACQUIRE_TIMEOUT = 10.0
+
+
+# SQLite storage in WAL mode. Requests borrow a connection from a small fixed
+# pool, opened lazily, so the number of open connections doesn't grow with
+# the server's threads. The SQL above is kept constant so sqlite3's
+# per-connection statement cache reuses the prepared statements. Lookups go
+# through the primary key on users.username and the unique index on
+# groups.name, and each change touches one row in one transaction.
+class SqliteStorage:
+    def __init__(self, path, pool_size=SQLITE_POOL_SIZE, acquire_timeout=SQLITE_ACQUIRE_TIMEOUT):
+        self.path = path
+        self.acquire_timeout = acquire_timeout
+        self._closed = False
+        self._pool = queue.LifoQueue()
+        for _ in range(pool_size):
+            self._pool.put(None)
+        self.created = not os.path.exists(path)
+        with self._connection() as connection:
+            connection.executescript(_SCHEMA)
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, check_same_thread=False, cached_statements=32)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        connection.execute('PRAGMA busy_timeout=5000')
+        return connection
+
+    # Borrow a connection; leaving the block commits, or rolls back on an error
+    @contextmanager
+    def _connection(self):
+        try:
+            connection = self._pool.get(timeout=self.acquire_timeout)
+        except queue.Empty:
+            raise TimeoutError('No SQLite connection became available')
+        try:
+            if connection is None:
+                connection = self._connect()
+            with connection:
+                yield connection
+        finally:
+            if self._closed and connection is not None:
+                connection.close()
+            else:
+                self._pool.put(connection)
+
+    def get_user(self, username):
+        with self._connection() as connection:
+            row = connection.execute(_GET_USER, (username,)).fetchone()
+        return row[0] if row else None
+
+    def add_user(self, username, password_hash):
+        with self._connection() as connection:
+            connection.execute(_UPSERT_USER, (username, password_hash))
+
+    def delete_user(self, username):
+        with self._connection() as connection:
+            return connection.execute(_DELETE_USER, (username,)).rowcount > 0
+
+    def list_groups(self):
+        with self._connection() as connection:
+            return [{'name': name} for (name,) in connection.execute(_LIST_GROUPS)]
+
+    def group_exists(self, name):
+        with self._connection() as connection:
+            return connection.execute(_GROUP_EXISTS, (name,)).fetchone() is not None
+
+    def add_group(self, name):
+        with self._connection() as connection:
+            connection.execute(_INSERT_GROUP, (name,))
+
+    def delete_group(self, name):
+        with self._connection() as connection:
+            return connection.execute(_DELETE_GROUP, (name,)).rowcount > 0
+
+    # Every process reads the same database, so there is nothing to update
+    def apply(self, record):
+        pass
+
+    def refresh(self):
+        pass
+
+    # Bulk load used by import_json: one transaction for everything
+    def import_data(self, users, groups):
+        with self._connection() as connection:
+            connection.executemany(_UPSERT_USER, users.items())
+            connection.executemany(_INSERT_GROUP, ((group['name'],) for group in groups))
+
+    # Close the idle connections; ones still borrowed are closed as they come back
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                connection = self._pool.get_nowait()
+            except queue.Empty:
+                break
+            if connection is not None:
+                connection.close()
+
+
+# Function to copy users and groups from the JSON files into a storage backend
+def import_json(storage, credentials_file, groups_file):
+    source = JsonStorage(credentials_file, groups_file)
+    if hasattr(storage, 'import_data'):
+        storage.import_data(source.users, source.groups)
+    else:
+        for username, password_hash in source.users.items():
+            storage.add_user(username, password_hash)
+        for group in source.groups:
+            if not storage.group_exists(group['name']):
+                storage.add_group(group['name'])
+    return len(source.users), len(source.groups)
+
+
+# Function to open the storage backend named in the app config. A new SQLite
+# database, journal or shard directory is seeded from the JSON files so
+# switching backends keeps the data.
+def create_storage(backend, credentials_file, groups_file, database_file, journal_folder='journal',
+                   flush_interval=None, shards_folder='credential_shards', shard_count=CREDENTIAL_SHARDS,
+                   shard_cache=CREDENTIAL_SHARD_CACHE, snapshot_file=None):
+    if backend == 'json':
+        return JsonStorage(credentials_file, groups_file, flush_interval=flush_interval, snapshot_file=snapshot_file)
+    if backend in ('sqlite', 'journal', 'sharded'):
+        if backend == 'sqlite':
+            storage = SqliteStorage(database_file)
+        elif backend == 'journal':
+            storage = JournalStorage(journal_folder)
+        else:
+            storage = ShardedStorage(shards_folder, groups_file, shard_count=shard_count, cache_size=shard_cache)
+        if storage.created:
+            import_json(storage, credentials_file, groups_file)
+        return storage
+    raise ValueError(f'Unknown storage backend: {backend}')
+
+
+# Usage: python storage.py import <database_file> [credentials_file] [groups_file]
+if __name__ == '__main__':
+    if len(sys.argv) < 3 or sys.argv[1] != 'import':
+        sys.exit('usage: python storage.py import <database_file> [credentials_file] [groups_file]')
+    credentials_file = sys.argv[3] if len(sys.argv) > 3 else 'user_credentials.json'
+    groups_file = sys.argv[4] if len(sys.argv) > 4 else 'groups.json'
+    target = SqliteStorage(sys.argv[2])
+    users_count, groups_count = import_json(target, credentials_file, groups_file)
+    target.close()
+    print(f'Imported {users_count} users and {groups_count} groups into {sys.argv[2]}')
@@ -0,0 +1,15 @@
+from jinja2 import DictLoader
+
+# Page templates are module-level strings in page_templates.py.
+# render_template_string parses and compiles its source on every call;
+# registering the strings under names lets render_template use the Jinja
+# environment's cache, so each page is compiled once at startup and later
+# requests reuse the Template object.
+
+
+# Function to serve the given {name: source} templates from the app's Jinja
+# loader and compile every one of them now
+def register_templates(app, templates):
+    app.jinja_loader = DictLoader(templates)
+    for name in templates:
+        app.jinja_env.get_template(name)
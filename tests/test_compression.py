@@ -0,0 +1,65 @@
+import gzip
+import zlib
+
+from flask import Flask, request
+
+from compression import CompressionMiddleware
+
+PAGE = ('<p>Hello, chat!</p>' * 100).encode()
+
+
+def _client():
+    app = Flask(__name__)
+
+    @app.route('/page')
+    def page():
+        response = app.response_class(PAGE, mimetype='text/html')
+        response.set_etag('page-v1')
+        return response.make_conditional(request)
+
+    @app.route('/small')
+    def small():
+        return 'ok'
+
+    app.wsgi_app = CompressionMiddleware(app.wsgi_app, min_size=100)
+    return app.test_client()
+
+
+def test_gzip_is_preferred_and_tags_the_etag():
+    response = _client().get('/page', headers={'Accept-Encoding': 'deflate, gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.headers['Vary'] == 'Accept-Encoding'
+    assert response.headers['ETag'] == '"page-v1-gzip"'
+    assert gzip.decompress(response.data) == PAGE
+
+
+def test_deflate_when_gzip_is_not_accepted():
+    response = _client().get('/page', headers={'Accept-Encoding': 'gzip;q=0, deflate'})
+    assert response.headers['Content-Encoding'] == 'deflate'
+    assert response.headers['ETag'] == '"page-v1-deflate"'
+    assert zlib.decompress(response.data) == PAGE
+
+
+def test_identity_and_small_responses_are_sent_as_they_are():
+    client = _client()
+    response = client.get('/page', headers={'Accept-Encoding': 'identity'})
+    assert 'Content-Encoding' not in response.headers
+    assert response.headers['ETag'] == '"page-v1"'
+    assert response.data == PAGE
+
+    response = client.get('/small', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in response.headers
+    assert response.data == b'ok'
+
+
+def test_revalidating_a_gzip_etag_gets_a_304_with_the_suffix():
+    client = _client()
+    response = client.get('/page', headers={'Accept-Encoding': 'gzip', 'If-None-Match': '"page-v1-gzip"'})
+    assert response.status_code == 304
+    assert response.headers['ETag'] == '"page-v1-gzip"'
+    assert response.data == b''
+
+    # A stale tag gets the full compressed page
+    response = client.get('/page', headers={'Accept-Encoding': 'gzip', 'If-None-Match': '"page-v0-gzip"'})
+    assert response.status_code == 200
+    assert gzip.decompress(response.data) == PAGE
@@ -0,0 +1,93 @@
+import json
+import os
+import time
+
+import pytest
+
+from journal import JournalStorage
+
+
+def _journals(directory):
+    return sorted(name for name in os.listdir(directory) if name.startswith('journal-'))
+
+
+def test_journal_replays_changes_after_restart(tmp_path):
+    storage = JournalStorage(str(tmp_path))
+    storage.add_user('alice', 'hash-a')
+    storage.add_user('bob', 'hash-b')
+    storage.delete_user('bob')
+    storage.add_group('general')
+    storage.close()
+
+    storage = JournalStorage(str(tmp_path))
+    assert storage.users == {'alice': 'hash-a'}
+    assert storage.list_groups() == [{'name': 'general'}]
+    storage.close()
+
+
+def test_journal_ignores_torn_final_record(tmp_path):
+    storage = JournalStorage(str(tmp_path))
+    storage.add_user('alice', 'hash-a')
+    storage.close()
+    # A crash part-way through an append leaves half a line behind
+    with open(tmp_path / _journals(tmp_path)[-1], 'a') as f:
+        f.write('{"op": "add_user", "userna')
+
+    storage = JournalStorage(str(tmp_path))
+    assert storage.users == {'alice': 'hash-a'}
+    # Records acknowledged after the torn one must survive the next restart
+    storage.add_user('bob', 'hash-b')
+    storage.close()
+
+    storage = JournalStorage(str(tmp_path))
+    assert storage.users == {'alice': 'hash-a', 'bob': 'hash-b'}
+    storage.close()
+
+
+def test_journal_compaction_keeps_state(tmp_path):
+    storage = JournalStorage(str(tmp_path), compact_bytes=512)
+    for i in range(100):
+        storage.add_user(f'user{i}', f'hash{i}')
+    # Compaction runs in the background; wait for the old journals to go
+    deadline = time.monotonic() + 5
+    while len(_journals(tmp_path)) > 1 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    storage.close()
+    assert os.path.exists(tmp_path / 'snapshot.json')
+
+    storage = JournalStorage(str(tmp_path))
+    assert storage.users == {f'user{i}': f'hash{i}' for i in range(100)}
+    storage.close()
+
+
+def test_journal_recovers_from_crash_mid_compaction(tmp_path):
+    storage = JournalStorage(str(tmp_path))
+    storage.add_user('alice', 'hash-a')
+    storage.add_group('general')
+    storage.close()
+    # The snapshot for generation 2 was written, but the crash came before
+    # generation 1's journal was removed
+    with open(tmp_path / 'snapshot.json', 'w') as f:
+        json.dump({'users': {'alice': 'hash-a'}, 'groups': [{'name': 'general'}], 'generation': 2}, f)
+    with open(tmp_path / 'journal-000000000002.log', 'w') as f:
+        f.write(json.dumps({'op': 'add_group', 'name': 'random'}) + '\n')
+
+    storage = JournalStorage(str(tmp_path))
+    assert storage.users == {'alice': 'hash-a'}
+    assert storage.list_groups() == [{'name': 'general'}, {'name': 'random'}]
+    assert _journals(tmp_path) == ['journal-000000000002.log']
+    storage.close()
+
+
+def test_journal_close_is_idempotent(tmp_path):
+    storage = JournalStorage(str(tmp_path))
+    storage.close()
+    storage.close()
+
+
+def test_journal_directory_is_locked_to_one_owner(tmp_path):
+    storage = JournalStorage(str(tmp_path))
+    with pytest.raises(RuntimeError):
+        JournalStorage(str(tmp_path))
+    storage.close()
+    JournalStorage(str(tmp_path)).close()
@@ -0,0 +1,111 @@
+import os
+
+from message_log import MessageLog, RetentionPolicy, group_dirname
+
+
+def _bodies(entries):
+    return [bytes(body) for _, body in entries]
+
+
+def _log_files(directory, group_name):
+    path = os.path.join(directory, group_dirname(group_name))
+    return sorted(name for name in os.listdir(path) if name.endswith('.log'))
+
+
+def test_message_log_reads_by_offset_page_and_time(tmp_path):
+    log = MessageLog(str(tmp_path), segment_bytes=256, index_interval=64)
+    for i in range(50):
+        assert log.append('general', f'message {i}'.encode(), timestamp=1000 + i) == i
+    assert len(_log_files(tmp_path, 'general')) > 1
+    assert _bodies(log.read('general', 10, limit=3)) == [b'message 10', b'message 11', b'message 12']
+    assert _bodies(log.last('general', 2)) == [b'message 48', b'message 49']
+    assert [offset for offset, _ in log.page('general', before=20, limit=5)] == [15, 16, 17, 18, 19]
+    assert [offset for offset, _ in log.since('general', 1045)] == [45, 46, 47, 48, 49]
+    log.close()
+
+
+def test_message_log_truncates_torn_tail_on_restart(tmp_path):
+    log = MessageLog(str(tmp_path))
+    for i in range(3):
+        log.append('general', f'message {i}'.encode())
+    log.close()
+    # A crash part-way through an append leaves a partial record header
+    with open(os.path.join(tmp_path, group_dirname('general'), _log_files(tmp_path, 'general')[-1]), 'ab') as f:
+        f.write(b'\x00\x00\x00')
+
+    log = MessageLog(str(tmp_path))
+    assert _bodies(log.last('general', 10)) == [b'message 0', b'message 1', b'message 2']
+    assert log.append('general', b'message 3') == 3
+    assert _bodies(log.read('general', 2)) == [b'message 2', b'message 3']
+    log.close()
+
+
+def test_message_log_caps_open_writers(tmp_path):
+    log = MessageLog(str(tmp_path), max_open_writers=2)
+    for i in range(5):
+        log.append(f'group{i}', b'hello')
+    assert log.stats()['open_writers'] == 2
+    # A group whose files were closed reopens them on its next append
+    assert log.append('group0', b'again') == 1
+    assert _bodies(log.read('group0', 0)) == [b'hello', b'again']
+    log.close()
+
+
+def test_retention_works_from_files_without_opening_groups(tmp_path):
+    log = MessageLog(str(tmp_path), segment_bytes=256)
+    for i in range(50):
+        log.append('general', f'message {i}'.encode())
+    log.close()
+
+    log = MessageLog(str(tmp_path), segment_bytes=256)
+    usage = log.disk_usage()['general']
+    assert usage['messages'] == 50 and usage['next_offset'] == 50
+    report = log.enforce_retention(lambda name: RetentionPolicy(max_messages=10))
+    assert report['general']['segments'] > 0
+    assert log.stats()['open_groups'] == 0
+    remaining = log.disk_usage()['general']
+    assert 10 <= remaining['messages'] < 50
+    assert remaining['next_offset'] == 50
+    assert _bodies(log.last('general', 1)) == [b'message 49']
+
+    # Now the group is open, retention cuts its segment list instead
+    for i in range(50, 100):
+        log.append('general', f'message {i}'.encode())
+    log.enforce_retention(lambda name: RetentionPolicy(max_messages=10))
+    assert 10 <= log.disk_usage()['general']['messages'] < 50
+    assert _bodies(log.last('general', 1)) == [b'message 99']
+    log.close()
+
+
+def test_expiring_every_segment_keeps_the_next_offset(tmp_path):
+    log = MessageLog(str(tmp_path))
+    for i in range(3):
+        log.append('general', f'message {i}'.encode(), timestamp=1000)
+    log.close()
+
+    log = MessageLog(str(tmp_path))
+    dry_run = log.enforce_retention(lambda name: RetentionPolicy(max_age=60), dry_run=True)
+    assert dry_run['general']['messages'] == 3
+    assert log.disk_usage()['general']['messages'] == 3
+    log.enforce_retention(lambda name: RetentionPolicy(max_age=60))
+    assert log.last('general', 10) == []
+    assert log.append('general', b'message 3') == 3
+    log.close()
+
+
+def test_append_racing_a_delete_writes_nothing(tmp_path):
+    log = MessageLog(str(tmp_path))
+    log.append('general', b'hello')
+    # An append that looked the group up just before it was deleted
+    group = log._group('general')
+    log.delete('general')
+    assert group.deleted
+    assert log.append('general', b'late') is None
+    assert log.groups() == []
+    assert not os.path.exists(os.path.join(tmp_path, group_dirname('general')))
+
+    # A group created again under the same name starts a fresh log
+    log.create('general')
+    assert log.append('general', b'again') == 0
+    assert _bodies(log.read('general', 0)) == [b'again']
+    log.close()
@@ -0,0 +1,57 @@
+from flask import Flask, flash, get_flashed_messages, redirect
+
+from page_cache import PageCache
+
+
+def _app():
+    app = Flask(__name__)
+    app.secret_key = 'test'
+    app.page_cache = PageCache(version=lambda: 'v1')
+    app.renders = 0
+
+    @app.route('/')
+    @app.page_cache.cached
+    def welcome():
+        app.renders += 1
+        return 'Welcome' + ''.join(f' [{message}]' for message in get_flashed_messages())
+
+    @app.route('/signout')
+    def signout():
+        flash('Signed out')
+        return redirect('/')
+
+    return app
+
+
+def test_page_is_rendered_once_and_revalidated_with_304():
+    app = _app()
+    client = app.test_client()
+    first = client.get('/')
+    assert first.data == b'Welcome'
+    assert first.headers['Cache-Control'] == 'no-cache'
+    etag = first.headers['ETag']
+
+    assert client.get('/').data == b'Welcome'
+    response = client.get('/', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert app.renders == 1
+    assert app.page_cache.stats() == {'hits': 2, 'misses': 1, 'not_modified': 1, 'bypassed': 0, 'pages': 1}
+
+
+def test_flashed_page_is_never_cached_or_304d():
+    app = _app()
+    client = app.test_client()
+    etag = client.get('/').headers['ETag']
+
+    client.get('/signout')
+    # Even a client holding the cached page's tag gets the flashed message
+    response = client.get('/', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.data == b'Welcome [Signed out]'
+    assert 'no-store' in response.headers['Cache-Control']
+    assert 'ETag' not in response.headers
+
+    # The message is shown once, and the cached page never picked it up
+    assert client.get('/').data == b'Welcome'
+    assert app.page_cache.stats()['bypassed'] == 1
+    assert app.page_cache.stats()['pages'] == 1
@@ -0,0 +1,140 @@
+from concurrent.futures import Future
+
+from confirms import ExchangeNotFound, PublishWindowFull
+from spool import CircuitBreaker, Spool, SpoolingPublisher
+
+
+def _records(count, start=0):
+    return [('chat', '', f'message {i}'.encode()) for i in range(start, start + count)]
+
+
+def _segment_paths(directory):
+    return sorted(path for path in directory.iterdir() if path.name.startswith('spool-'))
+
+
+def test_spool_reads_back_in_order(tmp_path):
+    spool = Spool(str(tmp_path))
+    spool.append(_records(3))
+    spool.append(_records(2, start=3))
+    records, position = spool.read(10)
+    assert records == _records(5)
+    spool.commit(position)
+    assert spool.pending == 0
+
+
+def test_spool_ignores_torn_tail_after_crash(tmp_path):
+    spool = Spool(str(tmp_path))
+    spool.append(_records(3))
+    # A crash part-way through a record leaves a truncated length prefix and body
+    with open(_segment_paths(tmp_path)[-1], 'ab') as f:
+        f.write(b'\x00\x00\x00\x04ch')
+
+    spool = Spool(str(tmp_path))
+    assert spool.pending == 3
+    spool.append(_records(1, start=3))
+    records, position = spool.read(10)
+    assert records == _records(4)
+    spool.commit(position)
+    assert spool.pending == 0
+
+
+def test_spool_resumes_from_checkpoint_after_restart(tmp_path):
+    spool = Spool(str(tmp_path))
+    spool.append(_records(5))
+    records, position = spool.read(2)
+    assert records == _records(2)
+    spool.commit(position)
+
+    spool = Spool(str(tmp_path))
+    assert spool.pending == 3
+    records, position = spool.read(10)
+    assert records == _records(3, start=2)
+
+
+def test_spool_drops_oldest_segments_past_limit(tmp_path):
+    spool = Spool(str(tmp_path), max_bytes=200, segment_bytes=50)
+    for i in range(20):
+        spool.append(_records(1, start=i))
+    stats = spool.stats()
+    assert stats['dropped'] > 0
+    assert stats['bytes'] <= 200 + 50
+    records, _ = spool.read(100)
+    assert records == _records(len(records), start=20 - len(records))
+
+
+class _FlakyPublisher:
+    def __init__(self, accept):
+        self.accept = accept
+        self.published = []
+
+    def is_connected(self):
+        return True
+
+    def publish(self, exchange, routing_key, body):
+        if len(self.published) >= self.accept:
+            raise PublishWindowFull('full')
+        self.published.append((exchange, routing_key, body))
+        future = Future()
+        future.set_result(True)
+        return future
+
+
+def test_publish_batch_spools_the_rest_when_the_window_stays_full(tmp_path):
+    publisher = _FlakyPublisher(accept=2)
+    spooling = SpoolingPublisher(publisher, Spool(str(tmp_path)), CircuitBreaker())
+    batch = _records(5)
+    spooling.publish_batch(batch)
+    assert publisher.published == batch[:2]
+    records, _ = spooling.spool.read(10)
+    assert records == batch[2:]
+
+
+# Publishes through futures like ConfirmPublisher; exchanges in `missing` fail
+# the way a deleted group's exchange does
+class _BrokerPublisher:
+    def __init__(self, missing=()):
+        self.missing = set(missing)
+        self.connected = True
+        self.delivered = []
+
+    def is_connected(self):
+        return self.connected
+
+    def publish(self, exchange, routing_key, body):
+        future = Future()
+        if exchange in self.missing:
+            future.set_exception(ExchangeNotFound(exchange))
+        else:
+            self.delivered.append((exchange, routing_key, body))
+            future.set_result(True)
+        return future
+
+
+def test_replay_discards_messages_for_a_deleted_group(tmp_path):
+    publisher = _BrokerPublisher(missing={'deleted'})
+    spooling = SpoolingPublisher(publisher, Spool(str(tmp_path)), CircuitBreaker(failure_threshold=1))
+    # Spooled while disconnected; the group is deleted before the flush
+    publisher.connected = False
+    spooled = _records(2) + [('deleted', '', b'lost')] + _records(2, start=2)
+    spooling.publish_batch(spooled)
+    publisher.connected = True
+    spooling.breaker.record_success()
+
+    assert spooling._replay_once()
+    assert spooling.spool.pending == 0
+    assert publisher.delivered == _records(4)
+    assert spooling.stats()['discarded'] == 1
+
+    # Later batches go straight to the broker again
+    spooling.publish_batch(_records(1, start=4))
+    assert publisher.delivered[-1] == _records(1, start=4)[0]
+    assert spooling.breaker.state == 'closed'
+
+
+def test_live_publish_to_a_deleted_group_is_not_spooled(tmp_path):
+    publisher = _BrokerPublisher(missing={'deleted'})
+    spooling = SpoolingPublisher(publisher, Spool(str(tmp_path)), CircuitBreaker(failure_threshold=1))
+    spooling.publish_batch([('deleted', '', b'lost')] + _records(1))
+    assert spooling.spool.pending == 0
+    assert spooling.stats()['discarded'] == 1
+    assert spooling.breaker.state == 'closed'
@@ -0,0 +1,228 @@
+import json
+import os
+import threading
+
+from shared_state import SharedStorage
+from storage import JsonStorage, ShardedStorage, SqliteStorage, shard_for
+
+
+def _read(path):
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def _json_storage(tmp_path, **kwargs):
+    return JsonStorage(str(tmp_path / 'users.json'), str(tmp_path / 'groups.json'), **kwargs)
+
+
+def test_json_storage_writes_through_without_interval(tmp_path):
+    storage = _json_storage(tmp_path)
+    storage.add_user('alice', 'hash-a')
+    storage.add_group('general')
+    assert _read(tmp_path / 'users.json') == {'alice': 'hash-a'}
+    assert _read(tmp_path / 'groups.json') == [{'name': 'general'}]
+
+
+def test_json_storage_defers_writes_until_flush(tmp_path):
+    storage = _json_storage(tmp_path, flush_interval=60)
+    storage.add_user('alice', 'hash-a')
+    storage.add_user('bob', 'hash-b')
+    assert not os.path.exists(tmp_path / 'users.json')
+    assert storage.stats()['dirty'] == 1
+
+    storage.flush()
+    assert _read(tmp_path / 'users.json') == {'alice': 'hash-a', 'bob': 'hash-b'}
+    assert storage.stats() == {'dirty': 0, 'writes': 1}
+    storage.close()
+
+
+def test_json_storage_flush_races_the_writer(tmp_path):
+    storage = _json_storage(tmp_path, flush_interval=0.001)
+    errors = []
+
+    def add_users(worker):
+        try:
+            for i in range(200):
+                storage.add_user(f'user{worker}-{i}', 'hash')
+                if i % 20 == 0:
+                    storage.flush()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=add_users, args=(worker,)) for worker in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    storage.flush()
+    assert not errors
+    # Whatever order the writes landed in, the file ends up with every user
+    assert _read(tmp_path / 'users.json') == storage.users
+    assert len(storage.users) == 800
+    storage.close()
+
+
+def test_json_storage_close_writes_pending_changes(tmp_path):
+    storage = _json_storage(tmp_path, flush_interval=60)
+    storage.add_group('general')
+    storage.close()
+    storage.close()
+    assert _read(tmp_path / 'groups.json') == [{'name': 'general'}]
+
+
+def test_json_storage_loads_snapshot_until_json_changes(tmp_path):
+    snapshot = str(tmp_path / 'state.snapshot')
+    storage = _json_storage(tmp_path, snapshot_file=snapshot)
+    storage.add_user('alice', 'hash-a')
+    storage.add_group('general')
+    storage.close()
+
+    storage = _json_storage(tmp_path, snapshot_file=snapshot)
+    assert storage.users == {'alice': 'hash-a'}
+    assert storage.list_groups() == [{'name': 'general'}]
+
+    # An edit to the JSON after the snapshot was written wins
+    with open(tmp_path / 'users.json', 'w') as f:
+        json.dump({'bob': 'hash-b'}, f)
+    os.utime(tmp_path / 'users.json', (os.path.getmtime(snapshot) + 1,) * 2)
+    storage = _json_storage(tmp_path, snapshot_file=snapshot)
+    assert storage.users == {'bob': 'hash-b'}
+
+
+def test_sqlite_storage_shares_a_bounded_pool(tmp_path):
+    storage = SqliteStorage(str(tmp_path / 'chat.db'), pool_size=2)
+
+    def add_users(worker):
+        for i in range(50):
+            storage.add_user(f'user{worker}-{i}', 'hash')
+        storage.add_group(f'group{worker}')
+
+    threads = [threading.Thread(target=add_users, args=(worker,)) for worker in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert storage.get_user('user3-49') == 'hash'
+    assert len(storage.list_groups()) == 8
+    assert storage.delete_group('group0')
+    assert not storage.group_exists('group0')
+    storage.close()
+
+
+def test_json_storage_keeps_changes_from_another_process(tmp_path):
+    first = _json_storage(tmp_path, flush_interval=60)
+    second = _json_storage(tmp_path, flush_interval=60)
+    first.add_user('alice', 'hash-a')
+    second.add_user('bob', 'hash-b')
+    second.add_group('general')
+    first.flush()
+    second.flush()
+    assert _read(tmp_path / 'users.json') == {'alice': 'hash-a', 'bob': 'hash-b'}
+
+    # The first process reads the file back before writing over it
+    first.delete_user('alice')
+    first.flush()
+    assert _read(tmp_path / 'users.json') == {'bob': 'hash-b'}
+    assert first.users == {'bob': 'hash-b'}
+    first.close()
+    second.close()
+
+
+def test_json_storage_refresh_reads_back_missed_changes(tmp_path):
+    first = _json_storage(tmp_path, flush_interval=60)
+    second = _json_storage(tmp_path, flush_interval=60)
+    # The announcement of bob never reached the first process
+    second.add_user('bob', 'hash-b')
+    second.flush()
+    first.add_user('alice', 'hash-a')
+    assert first.get_user('bob') is None
+
+    first.refresh()
+    assert first.users == {'alice': 'hash-a', 'bob': 'hash-b'}
+    first.flush()
+    assert _read(tmp_path / 'users.json') == {'alice': 'hash-a', 'bob': 'hash-b'}
+    first.close()
+    second.close()
+
+
+def test_shared_storage_keeps_announcements_until_published(tmp_path):
+    published = []
+    failing = [True]
+
+    def publish(exchange, routing_key, body):
+        if failing[0]:
+            raise ConnectionError('broker unavailable')
+        published.append(json.loads(body))
+
+    storage = SharedStorage(_json_storage(tmp_path), publish)
+    storage.add_group('general')
+    storage.add_user('alice', 'hash-a')
+    assert published == []
+    assert storage.stats()['unannounced'] == 2
+
+    failing[0] = False
+    storage.retry()
+    assert [record['op'] for record in published] == ['add_group', 'add_user']
+    assert storage.stats()['unannounced'] == 0
+
+
+def _sharded_storage(tmp_path, **kwargs):
+    return ShardedStorage(str(tmp_path / 'shards'), str(tmp_path / 'groups.json'), **kwargs)
+
+
+# Function to find usernames that land in distinct shards, one per shard
+def _users_in_distinct_shards(shard_count, count):
+    users = {}
+    i = 0
+    while len(users) < count:
+        users.setdefault(shard_for(f'user{i}', shard_count), f'user{i}')
+        i += 1
+    return list(users.values())
+
+
+def test_sharded_storage_evicts_least_recently_used_shard(tmp_path):
+    storage = _sharded_storage(tmp_path, shard_count=8, cache_size=2)
+    first, second, third = _users_in_distinct_shards(8, 3)
+    for username in (first, second, third):
+        storage.add_user(username, f'hash-{username}')
+    assert storage.stats() == {'shards': 8, 'loaded': 2, 'loads': 3}
+
+    # The first shard was evicted and is read back from its file
+    assert storage.get_user(first) == f'hash-{first}'
+    assert storage.stats()['loads'] == 4
+    # The third shard is still loaded
+    assert storage.get_user(third) == f'hash-{third}'
+    assert storage.stats()['loads'] == 4
+
+
+def test_sharded_storage_keeps_the_shard_count_it_was_created_with(tmp_path):
+    storage = _sharded_storage(tmp_path, shard_count=8)
+    storage.add_user('alice', 'hash-a')
+    assert storage.created
+
+    storage = _sharded_storage(tmp_path, shard_count=64)
+    assert not storage.created
+    assert storage.shard_count == 8
+    assert storage.get_user('alice') == 'hash-a'
+
+
+def test_sharded_storage_apply_skips_unloaded_shards(tmp_path):
+    storage = _sharded_storage(tmp_path, shard_count=8, cache_size=1)
+    alice, bob = _users_in_distinct_shards(8, 2)
+    storage.add_user(alice, 'hash-a')
+    storage.add_user(bob, 'hash-b')
+    assert storage.stats()['loaded'] == 1
+
+    # Another process changed alice's shard file and announced it; the shard
+    # isn't loaded here, so the change is read from the file on the next lookup
+    other = _sharded_storage(tmp_path, shard_count=8)
+    other.add_user(alice, 'hash-a2')
+    storage.apply({'op': 'add_user', 'username': alice, 'password_hash': 'hash-a2'})
+    assert storage.stats()['loaded'] == 1
+    assert storage.get_user(alice) == 'hash-a2'
+
+    # A loaded shard takes the change in memory
+    storage.apply({'op': 'delete_user', 'username': alice})
+    assert storage.get_user(alice) is None
+    storage.apply({'op': 'add_group', 'name': 'general'})
+    assert storage.list_groups() == [{'name': 'general'}]
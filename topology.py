@@ -0,0 +1,124 @@
+import json
+import sys
+from concurrent.futures import Future
+from urllib.parse import quote, unquote
+
+# One fanout exchange per group, named after the group
+MODE_FANOUT = 'fanout'
+# One shared topic exchange for every group, with the group in the routing key
+MODE_TOPIC = 'topic'
+
+SHARED_EXCHANGE = 'chat.groups'
+ROUTING_PREFIX = 'group.'
+
+
+# Function to turn a group name into a single topic routing-key word. Dots,
+# '*' and '#' are percent-encoded so a group name can never act as a wildcard.
+def routing_key_for(group_name):
+    return ROUTING_PREFIX + quote(group_name, safe='').replace('.', '%2E')
+
+
+# Function to recover the group name from a routing key
+def group_from_routing_key(routing_key):
+    return unquote(routing_key[len(ROUTING_PREFIX):])
+
+
+# Decides which exchange and routing key carry a group's messages.
+# In fanout mode the routing key is still set, so legacy per-group exchanges
+# can be bridged into the shared exchange while nodes migrate.
+class Topology:
+    def __init__(self, mode=MODE_FANOUT, shared_exchange=SHARED_EXCHANGE):
+        if mode not in (MODE_FANOUT, MODE_TOPIC):
+            raise ValueError(f'Unknown exchange mode: {mode}')
+        self.mode = mode
+        self.shared_exchange = shared_exchange
+        self.exchange_type = 'topic' if mode == MODE_TOPIC else 'fanout'
+
+    def route(self, group_name):
+        if self.mode == MODE_TOPIC:
+            return self.shared_exchange, routing_key_for(group_name)
+        return group_name, routing_key_for(group_name)
+
+    def group_for(self, exchange, routing_key):
+        if self.mode == MODE_TOPIC:
+            return group_from_routing_key(routing_key)
+        return exchange
+
+    # The shared exchange is declared before the first publish in topic mode;
+    # per-group exchanges are declared with the group
+    def declare_shared(self, pool, cache=None):
+        if self.mode != MODE_TOPIC:
+            return None
+        return self._declare(pool, self.shared_exchange, 'topic', cache)
+
+    # With a reconcile.ExchangeCache, exchanges already known to exist are
+    # skipped. Returns whatever the pool returned; with the async broker that
+    # is a Future, and the exchange is only cached once the broker confirms it.
+    def declare_group(self, pool, group_name, cache=None):
+        if self.mode != MODE_FANOUT:
+            return None
+        return self._declare(pool, group_name, 'fanout', cache)
+
+    # Function to declare whichever exchange route() publishes the group's
+    # messages to
+    def declare_route(self, pool, group_name, cache=None):
+        if self.mode == MODE_TOPIC:
+            return self.declare_shared(pool, cache)
+        return self.declare_group(pool, group_name, cache)
+
+    def _declare(self, pool, exchange, exchange_type, cache):
+        if cache is not None and exchange in cache:
+            return None
+        result = pool.declare_exchange(exchange, exchange_type=exchange_type)
+        if cache is not None:
+            if isinstance(result, Future):
+                def on_declared(future):
+                    if future.exception() is None:
+                        cache.add(exchange)
+                result.add_done_callback(on_declared)
+            else:
+                cache.add(exchange)
+        return result
+
+    def delete_group(self, pool, group_name, cache=None):
+        if self.mode != MODE_FANOUT:
+            return None
+        if cache is not None:
+            cache.discard(group_name)
+        return pool.delete_exchange(group_name)
+
+
+# Function to link existing per-group fanout exchanges with the shared topic
+# exchange in both directions. While nodes are switched from fanout to topic
+# mode one at a time, a message published on either side reaches consumers
+# on both; RabbitMQ delivers it to each queue only once.
+def bridge_legacy_exchanges(pool, group_names, shared_exchange=SHARED_EXCHANGE):
+    pool.declare_exchange(shared_exchange, exchange_type='topic')
+    for group_name in group_names:
+        pool.declare_exchange(group_name, exchange_type='fanout')
+        pool.bind_exchange(shared_exchange, group_name, '')
+        pool.bind_exchange(group_name, shared_exchange, routing_key_for(group_name))
+
+
+# Function to drop the per-group exchanges once every node runs in topic mode
+def remove_legacy_exchanges(pool, group_names):
+    for group_name in group_names:
+        pool.delete_exchange(group_name)
+
+
+# Usage: python topology.py bridge|finish [host] [groups_file]
+if __name__ == '__main__':
+    from broker import get_pool
+
+    step = sys.argv[1] if len(sys.argv) > 1 else ''
+    host = sys.argv[2] if len(sys.argv) > 2 else 'localhost'
+    groups_file = sys.argv[3] if len(sys.argv) > 3 else 'groups.json'
+    with open(groups_file, 'r') as f:
+        names = [group['name'] for group in json.load(f)]
+    if step == 'bridge':
+        bridge_legacy_exchanges(get_pool(host), names)
+    elif step == 'finish':
+        remove_legacy_exchanges(get_pool(host), names)
+    else:
+        sys.exit('usage: python topology.py bridge|finish [host] [groups_file]')
+    print(f'{step}: {len(names)} groups')
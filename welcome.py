@@ -1,898 +1,330 @@
-from flask import Flask, render_template_string, request, redirect, url_for, flash, jsonify, make_response
-import base64
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, make_response, abort
+import atexit
 import hashlib
-import json
 import os
-import pika
+import threading
+from concurrent.futures import Future
 from flask_socketio import SocketIO, emit, join_room, leave_room
+from broker import create_broker
+from spool import CircuitBreaker, Spool, SpoolingPublisher
+from consumer import NODE_ID, LocalRooms
+from topology import Topology
+from reconcile import ExchangeCache, reconcile
+import wire
+from pipeline import PublishPipeline
+from storage import create_storage
+from journal import claim_instance
+from template_registry import register_templates
+from page_templates import TEMPLATES
+from assets import AssetRegistry
+from compression import CompressionMiddleware
+from page_cache import PageCache
+from message_log import MessageLog, RetentionCompactor, RetentionPolicy
+from shared_state import STATE_EXCHANGE, SharedStorage
 
 app = Flask(__name__)
 app.secret_key = 'your_secret_key'
-socketio = SocketIO(app)
 
 CREDENTIALS_FILE = 'user_credentials.json'
 GROUPS_FILE = 'groups.json'
+# 'json' keeps the two files above; 'sqlite' uses DATABASE_FILE, 'journal' an
+# append-only journal in JOURNAL_FOLDER and 'sharded' credentials split across
+# CREDENTIAL_SHARDS files in CREDENTIAL_SHARDS_FOLDER, all seeded from them on first start
+STORAGE_BACKEND = 'json'
+DATABASE_FILE = 'chat.db'
+JOURNAL_FOLDER = 'journal'
+CREDENTIAL_SHARDS_FOLDER = 'credential_shards'
+CREDENTIAL_SHARDS = 64
+# Credential shards kept in memory at once by the sharded backend
+CREDENTIAL_SHARD_CACHE = 16
+# Seconds the json backend batches changes before rewriting a file; None writes on every change
+STORAGE_FLUSH_INTERVAL = 0.5
+# Binary snapshot the json backend writes on shutdown and loads on start; None to always parse the JSON
+STORAGE_SNAPSHOT_FILE = 'state.snapshot'
 PROFILE_IMAGES_FOLDER = 'static/profile_images'
+# Stylesheets and scripts the page templates link to, relative to STATIC_BUNDLES_FOLDER
+STATIC_BUNDLES_FOLDER = 'static'
+STATIC_BUNDLES = ['css/base.css', 'css/welcome.css', 'css/auth.css', 'css/groups.css', 'css/profile.css',
+                  'css/chat.css', 'js/groups.js', 'js/chat.js']
 RABBITMQ_HOST = 'localhost'
+# 'rabbitmq' talks to RABBITMQ_HOST over pooled blocking channels, 'rabbitmq-async' over one
+# non-blocking connection; 'memory' runs an in-process stand-in for benchmarks and local runs
+BROKER_BACKEND = os.environ.get('CHAT_BROKER_BACKEND', 'rabbitmq')
+BROKER_LATENCY = float(os.environ.get('CHAT_BROKER_LATENCY', '0'))
+# 'fanout' declares one exchange per group; 'topic' routes every group through one shared exchange
+EXCHANGE_MODE = 'fanout'
+PUBLISH_QUEUE_SIZE = 10000
+PUBLISH_BATCH_SIZE = 100
+PUBLISH_FLUSH_INTERVAL = 0.05
+PUBLISH_OVERFLOW = 'block'
+PUBLISH_SPILL_FILE = 'publish_spill.bin'
+PUBLISH_CONFIRM_WINDOW = 1000
+PUBLISH_MAX_RETRIES = 3
+PUBLISH_SPOOL_FOLDER = 'publish_spool'
+PUBLISH_SPOOL_MAX_BYTES = 256 * 1024 * 1024
+# Keep per-group history in RabbitMQ streams and replay it to joining clients.
+# With the message log enabled the chat page already shows recent history, so
+# the stream only replays from a stream offset a client passes as 'since'.
+HISTORY_ENABLED = False
+HISTORY_REPLAY_LIMIT = 50
+# Announce user and group changes over RabbitMQ so every worker process sees
+# them without rereading the files. Set when running more than one process on
+# the json backend, which also locks its files so the processes' writes merge.
+# The sqlite backend needs nothing more. The journal and sharded backends
+# belong to a single process. Publish spools and message logs are always kept
+# per process (see instance_path).
+SHARED_STATE = False
+# Delete fanout exchanges that have no group when reconciling. Group exchanges
+# are named after the group, so this would also delete other applications'
+# fanout exchanges on a shared vhost; only enable it on a dedicated one.
+RECONCILE_DELETE_ORPHANS = False
+# Longest a chat message waits for its group's exchange to be declared
+EXCHANGE_DECLARE_TIMEOUT = 5.0
+# Keep every chat message, sent from this node or relayed from others, in a
+# per-group log on local disk
+MESSAGE_LOG_ENABLED = True
+MESSAGE_LOG_FOLDER = 'message_log'
+MESSAGE_LOG_SEGMENT_BYTES = 16 * 1024 * 1024
+# Segment files the log keeps memory-mapped at once
+MESSAGE_LOG_MAX_MAPPINGS = 64
+# Groups the log keeps open for appending at once (two file descriptors each)
+MESSAGE_LOG_MAX_WRITERS = 128
+# Messages per page of scrollback served with a chat room
+CHAT_PAGE_SIZE = 50
+# How much logged history each group keeps, overridable per group by name;
+# whole segments past a limit are removed every MESSAGE_LOG_COMPACT_INTERVAL seconds
+MESSAGE_LOG_RETENTION = RetentionPolicy(max_age=7 * 24 * 3600, max_bytes=1024 * 1024 * 1024)
+MESSAGE_LOG_GROUP_RETENTION = {}
+MESSAGE_LOG_COMPACT_INTERVAL = 300
+# Page and API responses at least this many bytes are gzip/deflate compressed at this zlib level
+RESPONSE_COMPRESS_MIN_SIZE = 500
+RESPONSE_COMPRESS_LEVEL = 6
+
+# Installed before Socket.IO wraps the app, so only page and asset responses go through it
+app.wsgi_app = CompressionMiddleware(app.wsgi_app, min_size=RESPONSE_COMPRESS_MIN_SIZE,
+                                     level=RESPONSE_COMPRESS_LEVEL)
+socketio = SocketIO(app)
 
-# Function to load user credentials from a file
-def load_credentials():
-    if os.path.exists(CREDENTIALS_FILE):
-        with open(CREDENTIALS_FILE, 'r') as f:
-            return json.load(f)
-    return {}
-
-# Function to save user credentials to a file
-def save_credentials(credentials):
-    with open(CREDENTIALS_FILE, 'w') as f:
-        json.dump(credentials, f)
-
-# Function to load groups from a file
-def load_groups():
-    if os.path.exists(GROUPS_FILE):
-        with open(GROUPS_FILE, 'r') as f:
-            return json.load(f)
-    return []
-
-# Function to save groups to a file
-def save_groups(groups):
-    with open(GROUPS_FILE, 'w') as f:
-        json.dump(groups, f)
-
-user_credentials = load_credentials()
-groups = load_groups()
+# Worker processes share the users and groups, but each needs its own publish
+# spool, spill file and message log, as those are written by one process at a
+# time. A process takes the lowest instance number no running process holds,
+# so a restarted worker picks up the files an earlier one left behind.
+INSTANCE, instance_lock = claim_instance('.', prefix='worker')
+
+# Function to give a runtime file or folder its instance's own name, e.g.
+# message_log.1; instance 0 keeps the configured name
+def instance_path(path):
+    if INSTANCE == 0:
+        return path
+    root, extension = os.path.splitext(path)
+    return f'{root}.{INSTANCE}{extension}'
+
+if SHARED_STATE and STORAGE_BACKEND not in ('json', 'sqlite'):
+    raise ValueError(f'SHARED_STATE needs the json or sqlite storage backend, not {STORAGE_BACKEND}')
+storage = create_storage(STORAGE_BACKEND, CREDENTIALS_FILE, GROUPS_FILE, DATABASE_FILE, JOURNAL_FOLDER,
+                         flush_interval=STORAGE_FLUSH_INTERVAL, shards_folder=CREDENTIAL_SHARDS_FOLDER,
+                         shard_count=CREDENTIAL_SHARDS, shard_cache=CREDENTIAL_SHARD_CACHE,
+                         snapshot_file=STORAGE_SNAPSHOT_FILE)
+atexit.register(storage.close)
+
+message_log = MessageLog(instance_path(MESSAGE_LOG_FOLDER), segment_bytes=MESSAGE_LOG_SEGMENT_BYTES,
+                         max_open_mappings=MESSAGE_LOG_MAX_MAPPINGS,
+                         max_open_writers=MESSAGE_LOG_MAX_WRITERS) if MESSAGE_LOG_ENABLED else None
+history_compactor = None
+if message_log is not None:
+    atexit.register(message_log.close)
+    history_compactor = RetentionCompactor(message_log, MESSAGE_LOG_RETENTION, MESSAGE_LOG_GROUP_RETENTION,
+                                           interval=MESSAGE_LOG_COMPACT_INTERVAL)
+    history_compactor.start()
+    atexit.register(history_compactor.stop)
+
+broker = create_broker(BROKER_BACKEND, RABBITMQ_HOST, latency=BROKER_LATENCY)
+topology = Topology(EXCHANGE_MODE)
+history = broker.history(topology) if HISTORY_ENABLED else None
+exchange_cache = ExchangeCache()
+
+# Created before any exchange calls; with the async backend it also carries them
+confirm_publisher = broker.publisher(window=PUBLISH_CONFIRM_WINDOW, max_retries=PUBLISH_MAX_RETRIES,
+                                     app_id=NODE_ID, content_type=wire.CONTENT_TYPE)
+
+# Changes go straight to the publisher rather than the batching pipeline so
+# other processes see them as soon as possible
+if SHARED_STATE:
+    storage = SharedStorage(storage, confirm_publisher.publish)
+    # Announcements that failed while the broker was away are sent on reconnect
+    confirm_publisher.add_connect_callback(lambda: threading.Thread(target=storage.retry, name='state-announce', daemon=True).start())
+
+# Function to make sure every existing group has a history stream; runs
+# after reconciliation so the group exchanges exist to bind to
+def declare_group_histories():
+    if history is None:
+        return
+    for group in storage.list_groups():
+        declare_group_history(group['name'])
+
+# Function to declare one group's history stream, logging any failure
+def declare_group_history(group_name):
+    try:
+        history.declare(group_name)
+    except Exception:
+        app.logger.exception('Could not declare the history stream for %s', group_name)
+
+# Function to bring the broker's exchanges in line with the group list
+def reconcile_exchanges():
+    try:
+        # Exchanges are listed before groups: a group created in between then
+        # looks like a missing exchange to declare, never like an orphan
+        existing = broker.list_exchanges()
+        reconcile(broker.admin(), topology, [group['name'] for group in storage.list_groups()], exchange_cache,
+                  existing=existing, delete_orphans=RECONCILE_DELETE_ORPHANS,
+                  keep=[STATE_EXCHANGE] if SHARED_STATE else ())
+    except Exception:
+        app.logger.exception('Exchange reconciliation failed')
+    declare_group_histories()
+
+# Function to reconcile exchanges in the background on every (re)connect,
+# since a broker restart or reset may have lost them
+def on_broker_connected():
+    exchange_cache.clear()
+    threading.Thread(target=reconcile_exchanges, name='exchange-reconcile', daemon=True).start()
+
+confirm_publisher.add_connect_callback(on_broker_connected)
+confirm_publisher.start()
+atexit.register(confirm_publisher.stop)
 
 # Function to create a RabbitMQ exchange for a group
 def create_rabbitmq_exchange(group_name):
-    connection = pika.BlockingConnection(pika.ConnectionParameters(RABBITMQ_HOST))
-    channel = connection.channel()
-    channel.exchange_declare(exchange=group_name, exchange_type='fanout')
-    connection.close()
+    declared = topology.declare_group(broker.admin(), group_name, exchange_cache)
+    if history is None:
+        return
+    if not isinstance(declared, Future):
+        history.declare(group_name)
+        return
+
+    # The async backend confirms the exchange later; the stream can only be
+    # bound to it once it exists
+    def declare_history(future):
+        if future.exception() is None:
+            socketio.start_background_task(declare_group_history, group_name)
+    declared.add_done_callback(declare_history)
 
 # Function to delete a RabbitMQ exchange for a group
 def delete_rabbitmq_exchange(group_name):
-    connection = pika.BlockingConnection(pika.ConnectionParameters(RABBITMQ_HOST))
-    channel = connection.channel()
-    channel.exchange_delete(exchange=group_name)
-    connection.close()
+    topology.delete_group(broker.admin(), group_name, exchange_cache)
+    if history is not None:
+        history.delete(group_name)
+
+# Function to make sure the exchange a group's messages are routed to exists
+# before publishing to it: the group's own exchange in fanout mode, the shared
+# one in topic mode, which reconciliation may not have declared yet.
+# Publishing to a missing exchange makes the broker close the publisher's
+# channel and fail the message. While disconnected, messages go to the spool and reconciliation declares the
+# exchanges on reconnect.
+def ensure_exchange(group_name):
+    if topology.route(group_name)[0] in exchange_cache or not confirm_publisher.is_connected():
+        return True
+    try:
+        declared = topology.declare_route(broker.admin(), group_name, exchange_cache)
+        if isinstance(declared, Future):
+            declared.result(timeout=EXCHANGE_DECLARE_TIMEOUT)
+    except Exception:
+        app.logger.warning('Dropping a message for %s: its exchange could not be declared', group_name)
+        return False
+    return True
+
+# Messages that can't reach RabbitMQ are kept on disk and replayed in order
+spooling_publisher = SpoolingPublisher(
+    confirm_publisher,
+    Spool(instance_path(PUBLISH_SPOOL_FOLDER), max_bytes=PUBLISH_SPOOL_MAX_BYTES),
+    CircuitBreaker(),
+)
+spooling_publisher.start()
+atexit.register(spooling_publisher.stop)
+
+# Function to publish a batch of chat messages from the pipeline worker.
+# Confirms arrive asynchronously, so this only waits when the window is full.
+def publish_messages(batch):
+    spooling_publisher.publish_batch(batch)
+
+publish_pipeline = PublishPipeline(
+    publish_messages,
+    max_queue=PUBLISH_QUEUE_SIZE,
+    batch_size=PUBLISH_BATCH_SIZE,
+    flush_interval=PUBLISH_FLUSH_INTERVAL,
+    overflow=PUBLISH_OVERFLOW,
+    spill_path=instance_path(PUBLISH_SPILL_FILE),
+)
+publish_pipeline.start()
+
+# Function to re-emit a chat message published by another node to local
+# members, or take in a user or group change made by another process
+def relay_message(exchange, routing_key, body):
+    if exchange == STATE_EXCHANGE:
+        record = storage.apply(body)
+        if message_log is not None and record['op'] == 'delete_group':
+            message_log.delete(record['name'])
+        elif message_log is not None and record['op'] == 'add_group':
+            message_log.create(record['name'])
+        return
+    try:
+        message = wire.decode(body)
+    except wire.WireFormatError:
+        app.logger.warning('Ignoring an undecodable message from %s', exchange)
+        return
+    # Each node logs what its consumer receives as well as what it sends, so
+    # every node's scrollback holds the whole conversation
+    if message_log is not None:
+        message_log.append(message.room, body, message.timestamp)
+    socketio.emit('message', {'username': message.sender, 'message': message.body}, room=message.room)
+
+local_rooms = LocalRooms()
+consumer_bridge = broker.consumer(relay_message, node_id=NODE_ID, exchange_cache=exchange_cache)
+consumer_bridge.start()
+if SHARED_STATE:
+    consumer_bridge.bind(STATE_EXCHANGE, '', 'fanout')
+    # Changes announced while the consumer was disconnected never arrive, so
+    # read back whatever the other processes wrote in the meantime
+    consumer_bridge.add_connect_callback(lambda: threading.Thread(target=storage.refresh, name='state-refresh', daemon=True).start())
+atexit.register(consumer_bridge.stop)
+atexit.register(publish_pipeline.stop)
 
 if not os.path.exists(PROFILE_IMAGES_FOLDER):
     os.makedirs(PROFILE_IMAGES_FOLDER)
 
-# HTML Templates
-welcome_template = """
-<!DOCTYPE html>
-<html lang="en">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>Welcome to Chat App</title>
-    <style>
-        body {
-            margin: 0;
-            font-family: 'Helvetica', sans-serif;
-            background-color: #f5f5f5;
-            display: flex;
-            flex-direction: column;
-            align-items: center;
-            justify-content: center;
-            height: 100vh;
-            overflow: hidden;
-        }
-
-        .container {
-            text-align: center;
-            z-index: 1;
-            position: relative;
-        }
-
-        .logo img {
-            width: 200px;
-            height: 200px;
-            margin-bottom: 30px;
-        }
-
-        .greeting {
-            font-size: 24px;
-            font-weight: bold;
-            color: #4b2354;
-            margin-bottom: 10px;
-        }
-
-        .description {
-            font-size: 14px;
-            color: #4b2354;
-            margin-bottom: 20px;
-        }
-
-        .welcome-button {
-            padding: 10px 30px;
-            font-size: 16px;
-            font-weight: bold;
-            color: #4b2354;
-            background-color: white;
-            border: none;
-            border-radius: 5px;
-            cursor: pointer;
-            box-shadow: 0 2px 4px rgba(0, 0, 0, 0.1);
-            transition: background-color 0.3s;
-        }
-
-        .welcome-button:hover {
-            background-color: #e0e0e0;
-        }
-
-        .curved-background {
-            position: absolute;
-            bottom: 0;
-            width: 100%;
-            height: 250px;
-            background-color: #c0f8ee;
-            border-radius: 50% 50% 0 0;
-            z-index: 0;
-        }
-    </style>
-</head>
-<body>
-    <div class="container">
-        <div class="logo">
-            <img src="data:image/png;base64,{{ logo_image }}" alt="Logo">
-        </div>
-        <div class="greeting">Hello, Let's Chat</div>
-        <div class="description">What's on your mind?<br>Chat Anywhere, Anytime</div>
-        <button class="welcome-button" onclick="location.href='/signin'">WELCOME</button>
-    </div>
-    <div class="curved-background"></div>
-</body>
-</html>
-"""
-
-signin_template = """
-<!DOCTYPE html>
-<html lang="en">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>Sign In</title>
-    <style>
-        body {
-            margin: 0;
-            font-family: 'Helvetica', sans-serif;
-            background: linear-gradient(to bottom right, #e0f7fa, #e0f7fa);
-            height: 100vh;
-            display: flex;
-            align-items: center;
-            justify-content: center;
-        }
-
-        .signin-container {
-            background-color: white;
-            border-radius: 15px;
-            box-shadow: 0 4px 8px rgba(0, 0, 0, 0.1);
-            padding: 40px;
-            text-align: center;
-            width: 300px;
-        }
-
-        .signin-container h2 {
-            color: #4b2354;
-            margin-bottom: 20px;
-            font-size: 24px;
-        }
-
-        .form-group {
-            margin-bottom: 20px;
-            position: relative;
-        }
-
-        .form-group input {
-            width: 100%;
-            padding: 10px;
-            border: 2px solid #4b2354;
-            border-radius: 5px;
-            outline: none;
-            font-size: 14px;
-            box-sizing: border-box;
-            transition: border-color 0.3s;
-        }
-
-        .form-group input:focus {
-            border-color: #00695c;
-        }
-
-        .form-group label {
-            position: absolute;
-            top: -20px;
-            left: 10px;
-            font-size: 12px;
-            color: #4b2354;
-            background-color: white;
-            padding: 0 5px;
-        }
-
-        .signin-button {
-            width: 100%;
-            padding: 10px;
-            background-color: #00695c;
-            color: white;
-            font-size: 16px;
-            font-weight: bold;
-            border: none;
-            border-radius: 5px;
-            cursor: pointer;
-            transition: background-color 0.3s;
-            margin-top: 10px;
-        }
-
-        .signin-button:hover {
-            background-color: #004d40;
-        }
-
-        .signup-link {
-            margin-top: 20px;
-            font-size: 14px;
-            color: #4b2354;
-            text-decoration: none;
-            display: block;
-        }
-
-        .signup-link:hover {
-            text-decoration: underline;
-        }
-
-        .curved-background {
-            position: absolute;
-            bottom: 0;
-            width: 100%;
-            height: 150px;
-            background-color: #c0f8ee;
-            border-radius: 50% 50% 0 0;
-            z-index: -1;
-        }
-
-        .flash-message {
-            color: red;
-            font-size: 14px;
-            margin-bottom: 10px;
-        }
-    </style>
-</head>
-<body>
-    <div class="signin-container">
-        <h2>Sign In</h2>
-        {% with messages = get_flashed_messages() %}
-          {% if messages %}
-            <div class="flash-message">{{ messages[0] }}</div>
-          {% endif %}
-        {% endwith %}
-        <form method="post" action="/signin">
-            <div class="form-group">
-                <label for="username">Username</label>
-                <input type="text" id="username" name="username" placeholder="Enter your username" required>
-            </div>
-            <div class="form-group">
-                <label for="password">Password</label>
-                <input type="password" id="password" name="password" placeholder="Enter your password" required>
-            </div>
-            <button type="submit" class="signin-button">Sign In</button>
-        </form>
-        <a href="/signup" class="signup-link">Not currently signed up? Sign up first</a>
-    </div>
-    <div class="curved-background"></div>
-</body>
-</html>
-"""
-
-signup_template = """
-<!DOCTYPE html>
-<html lang="en">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>Sign Up</title>
-    <style>
-        body {
-            margin: 0;
-            font-family: 'Helvetica', sans-serif;
-            background: linear-gradient(to bottom right, #e0f7fa, #e0f7fa);
-            height: 100vh;
-            display: flex;
-            align-items: center;
-            justify-content: center;
-        }
-
-        .signup-container {
-            background-color: white;
-            border-radius: 15px;
-            box-shadow: 0 4px 8px rgba(0, 0, 0, 0.1);
-            padding: 40px;
-            text-align: center;
-            width: 300px;
-        }
-
-        .signup-container h2 {
-            color: #4b2354;
-            margin-bottom: 20px;
-            font-size: 24px;
-        }
-
-        .form-group {
-            margin-bottom: 20px;
-            position: relative;
-        }
-
-        .form-group input {
-            width: 100%;
-            padding: 10px;
-            border: 2px solid #4b2354;
-            border-radius: 5px;
-            outline: none;
-            font-size: 14px;
-            box-sizing: border-box;
-            transition: border-color 0.3s;
-        }
-
-        .form-group input:focus {
-            border-color: #00695c;
-        }
-
-        .form-group label {
-            position: absolute;
-            top: -20px;
-            left: 10px;
-            font-size: 12px;
-            color: #4b2354;
-            background-color: white;
-            padding: 0 5px;
-        }
-
-        .signup-button {
-            width: 100%;
-            padding: 10px;
-            background-color: #00695c;
-            color: white;
-            font-size: 16px;
-            font-weight: bold;
-            border: none;
-            border-radius: 5px;
-            cursor: pointer;
-            transition: background-color 0.3s;
-            margin-top: 10px;
-        }
-
-        .signup-button:hover {
-            background-color: #004d40;
-        }
-
-        .signup-link {
-            margin-top: 20px;
-            font-size: 14px;
-            color: #4b2354;
-            text-decoration: none;
-            display: block;
-        }
-
-        .signup-link:hover {
-            text-decoration: underline;
-        }
-
-        .curved-background {
-            position: absolute;
-            bottom: 0;
-            width: 100%;
-            height: 150px;
-            background-color: #c0f8ee;
-            border-radius: 50% 50% 0 0;
-            z-index: -1;
-        }
-
-        .flash-message {
-            color: red;
-            font-size: 14px;
-            margin-bottom: 10px;
-        }
-    </style>
-</head>
-<body>
-    <div class="signup-container">
-        <h2>Sign Up</h2>
-        {% with messages = get_flashed_messages() %}
-          {% if messages %}
-            <div class="flash-message">{{ messages[0] }}</div>
-          {% endif %}
-        {% endwith %}
-        <form method="post" action="/signup">
-            <div class="form-group">
-                <label for="username">Username</label>
-                <input type="text" id="username" name="username" placeholder="Enter your username" required>
-            </div>
-            <div class="form-group">
-                <label for="password">Password</label>
-                <input type="password" id="password" name="password" placeholder="Enter your password" required>
-            </div>
-            <div class="form-group">
-                <label for="retype_password">Retype Password</label>
-                <input type="password" id="retype_password" name="retype_password" placeholder="Retype your password" required>
-            </div>
-            <button type="submit" class="signup-button">Sign Up</button>
-        </form>
-        <a href="/signin" class="signup-link">Already signed up? Go to Sign In</a>
-    </div>
-    <div class="curved-background"></div>
-</body>
-</html>
-"""
-
-groups_template = """
-<!DOCTYPE html>
-<html lang="en">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>Available Groups</title>
-    <style>
-        body {
-            margin: 0;
-            font-family: 'Helvetica', sans-serif;
-            background: linear-gradient(to bottom right, #e0f7fa, #e0f7fa);
-            height: 100vh;
-            display: flex;
-            flex-direction: column;
-            align-items: center;
-            justify-content: start;
-            padding-top: 50px;
-        }
-
-        .group-container {
-            width: 90%;
-            max-width: 400px;
-            background-color: white;
-            border-radius: 15px;
-            box-shadow: 0 4px 8px rgba(0, 0, 0, 0.1);
-            padding: 20px;
-            text-align: center;
-        }
-
-        .group-container h2 {
-            color: #4b2354;
-            margin-bottom: 20px;
-            font-size: 24px;
-        }
-
-        .group-list {
-            list-style: none;
-            padding: 0;
-        }
-
-        .group-list li {
-            display: flex;
-            align-items: center;
-            justify-content: space-between;
-            margin-bottom: 15px;
-            padding: 10px;
-            border-radius: 5px;
-            background-color: #f5f5f5;
-            box-shadow: 0 2px 4px rgba(0, 0, 0, 0.1);
-            transition: background-color 0.3s;
-            cursor: pointer;
-        }
-
-        .group-list li:hover {
-            background-color: #e0e0e0;
-        }
-
-        .create-group-button {
-            width: 100%;
-            padding: 10px;
-            background-color: #00695c;
-            color: white;
-            font-size: 16px;
-            font-weight: bold;
-            border: none;
-            border-radius: 5px;
-            cursor: pointer;
-            transition: background-color 0.3s;
-            margin-top: 10px;
-        }
-
-        .create-group-button:hover {
-            background-color: #004d40;
-        }
-
-        .curved-background {
-            position: absolute;
-            bottom: 0;
-            width: 100%;
-            height: 150px;
-            background-color: #c0f8ee;
-            border-radius: 50% 50% 0 0;
-            z-index: -1;
-        }
-
-        .select-button {
-            width: 100%;
-            padding: 10px;
-            background-color: #00695c;
-            color: white;
-            font-size: 16px;
-            font-weight: bold;
-            border: none;
-            border-radius: 5px;
-            cursor: pointer;
-            transition: background-color 0.3s;
-            margin-top: 10px;
-        }
-
-        .select-button:hover {
-            background-color: #004d40;
-        }
-
-        .delete-button {
-            background-color: #ff1744;
-            color: white;
-            padding: 5px 10px;
-            border: none;
-            border-radius: 5px;
-            cursor: pointer;
-            transition: background-color 0.3s;
-        }
-
-        .delete-button:hover {
-            background-color: #d50000;
-        }
-
-        .profile-section {
-            display: flex;
-            justify-content: space-between;
-            align-items: center;
-            width: 100%;
-            margin-bottom: 20px;
-        }
-
-        .profile-avatar img {
-            width: 50px;
-            height: 50px;
-            border-radius: 50%;
-            cursor: pointer;
-        }
-
-        .no-avatar {
-            width: 50px;
-            height: 50px;
-            border-radius: 50%;
-            background-color: #ccc;
-            display: flex;
-            align-items: center;
-            justify-content: center;
-            color: white;
-            font-weight: bold;
-            cursor: pointer;
-        }
-
-        .view-profile-button {
-            background-color: #4b2354;
-            color: white;
-            padding: 5px 10px;
-            border: none;
-            border-radius: 5px;
-            cursor: pointer;
-            transition: background-color 0.3s;
-        }
-
-        .view-profile-button:hover {
-            background-color: #2e0833;
-        }
-    </style>
-    <script>
-        function selectGroup(groupName) {
-            fetch('/select_group', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json'
-                },
-                body: JSON.stringify({ group_name: groupName })
-            })
-            .then(response => response.json())
-            .then(data => {
-                if (data.status === 'success') {
-                    window.location.href = '/chat/' + groupName;
-                } else {
-                    alert('Error selecting group');
-                }
-            })
-            .catch(error => console.error('Error:', error));
-        }
-
-        function deleteGroup(groupName) {
-            fetch('/delete_group', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json'
-                },
-                body: JSON.stringify({ group_name: groupName })
-            })
-            .then(response => response.json())
-            .then(data => {
-                if (data.status === 'success') {
-                    location.reload();
-                } else {
-                    alert('Error deleting group');
-                }
-            })
-            .catch(error => console.error('Error:', error));
-        }
-    </script>
-</head>
-<body>
-    <div class="group-container">
-        <div class="profile-section">
-            <div class="profile-avatar">
-                {% if profile_image %}
-                    <img src="{{ profile_image }}" alt="Profile Avatar" onclick="document.getElementById('profile-image-upload').click();">
-                {% else %}
-                    <div class="no-avatar" onclick="document.getElementById('profile-image-upload').click();">No Image</div>
-                {% endif %}
-            </div>
-            <form id="profile-form" action="/upload_profile_image" method="post" enctype="multipart/form-data" style="display: none;">
-                <input type="file" id="profile-image-upload" name="profile_image" onchange="document.getElementById('profile-form').submit();">
-            </form>
-            <button class="view-profile-button" onclick="location.href='/profile'">View Profile</button>
-        </div>
-        <h2>Available Groups to Join!</h2>
-        <ul class="group-list">
-            {% for group in groups %}
-            <li>
-                <span onclick="selectGroup('{{ group.name }}')">{{ group.name }}</span>
-                <button class="delete-button" onclick="deleteGroup('{{ group.name }}')">Delete</button>
-            </li>
-            {% endfor %}
-        </ul>
-        <form method="post" action="/available_groups">
-            <input type="text" name="group_name" placeholder="Enter new group name" required>
-            <button type="submit" class="create-group-button">Create Group</button>
-        </form>
-    </div>
-    <div class="curved-background"></div>
-</body>
-</html>
-"""
-
-profile_template = """
-<!DOCTYPE html>
-<html lang="en">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>User Profile</title>
-    <style>
-        body {
-            margin: 0;
-            font-family: 'Helvetica', sans-serif;
-            background: linear-gradient(to bottom right, #e0f7fa, #e0f7fa);
-            height: 100vh;
-            display: flex;
-            align-items: center;
-            justify-content: center;
-        }
-
-        .profile-container {
-            background-color: white;
-            border-radius: 15px;
-            box-shadow: 0 4px 8px rgba(0, 0, 0, 0.1);
-            padding: 40px;
-            text-align: center;
-            width: 300px;
-        }
-
-        .profile-avatar img {
-            width: 100px;
-            height: 100px;
-            border-radius: 50%;
-            margin-bottom: 20px;
-        }
-
-        .no-avatar {
-            width: 100px;
-            height: 100px;
-            border-radius: 50%;
-            background-color: #ccc;
-            display: flex;
-            align-items: center;
-            justify-content: center;
-            color: white;
-            font-weight: bold;
-            margin-bottom: 20px;
-        }
-
-        .profile-info {
-            font-size: 18px;
-            color: #4b2354;
-            margin-bottom: 20px;
-        }
-
-        .back-button {
-            width: 100%;
-            padding: 10px;
-            background-color: #00695c;
-            color: white;
-            font-size: 16px;
-            font-weight: bold;
-            border: none;
-            border-radius: 5px;
-            cursor: pointer;
-            transition: background-color 0.3s;
-            margin-top: 10px;
-        }
-
-        .back-button:hover {
-            background-color: #004d40;
-        }
-
-        .delete-profile-button {
-            width: 100%;
-            padding: 10px;
-            background-color: #ff1744;
-            color: white;
-            font-size: 16px;
-            font-weight: bold;
-            border: none;
-            border-radius: 5px;
-            cursor: pointer;
-            transition: background-color 0.3s;
-            margin-top: 10px;
-        }
-
-        .delete-profile-button:hover {
-            background-color: #d50000;
-        }
-    </style>
-</head>
-<body>
-    <div class="profile-container">
-        <div class="profile-avatar">
-            {% if profile_image %}
-                <img src="{{ profile_image }}" alt="Profile Avatar">
-            {% else %}
-                <div class="no-avatar">No Image</div>
-            {% endif %}
-        </div>
-        <div class="profile-info">Username: {{ username }}</div>
-        <button class="back-button" onclick="location.href='/available_groups'">Back to Groups</button>
-        <button class="delete-profile-button" onclick="location.href='/delete_profile'">Delete Profile</button>
-    </div>
-</body>
-</html>
-"""
-
-chat_template = """
-<!DOCTYPE html>
-<html lang="en">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>{{ group_name }} Chat Room</title>
-    <style>
-        body {
-            margin: 0;
-            font-family: 'Helvetica', sans-serif;
-            display: flex;
-            flex-direction: column;
-            height: 100vh;
-            background-color: #e0f7fa;
-        }
-
-        .chat-container {
-            display: flex;
-            flex-direction: column;
-            flex-grow: 1;
-            margin: 0 20px;
-            border-radius: 10px;
-            overflow: hidden;
-        }
-
-        .messages {
-            flex-grow: 1;
-            padding: 20px;
-            overflow-y: scroll;
-            border: 1px solid #ccc;
-            border-radius: 10px 10px 0 0;
-            background-color: #fff;
-        }
-
-        .messages p {
-            margin: 10px 0;
-            padding: 10px;
-            border-radius: 5px;
-            background-color: #f1f1f1;
-            word-wrap: break-word;
-        }
-
-        .username {
-            font-weight: bold;
-            margin-bottom: 5px;
-        }
-
-        .chat-input {
-            display: flex;
-            border-radius: 0 0 10px 10px;
-            border: 1px solid #ccc;
-        }
-
-        .chat-input input {
-            flex-grow: 1;
-            padding: 10px;
-            border: none;
-            border-radius: 0 0 0 10px;
-            outline: none;
-        }
-
-        .chat-input button {
-            padding: 10px 20px;
-            background-color: #00695c;
-            color: white;
-            border: none;
-            border-radius: 0 0 10px 0;
-            cursor: pointer;
-        }
-    </style>
-    <script src="https://cdnjs.cloudflare.com/ajax/libs/socket.io/4.0.0/socket.io.js"></script>
-    <script>
-        document.addEventListener('DOMContentLoaded', (event) => {
-            var socket = io.connect('http://' + document.domain + ':' + location.port);
-            var groupName = "{{ group_name }}";
-            var username = "{{ username }}";
-
-            socket.emit('join', {'room': groupName, 'username': username});
-
-            socket.on('message', function(data) {
-                var messages = document.getElementById('messages');
-                var message = document.createElement('p');
-                var user = document.createElement('span');
-                user.className = 'username';
-                user.textContent = data.username + ': ';
-                message.appendChild(user);
-                message.appendChild(document.createTextNode(data.message));
-                messages.appendChild(message);
-                messages.scrollTop = messages.scrollHeight;
-            });
-
-            document.getElementById('send').onclick = function() {
-                var text = document.getElementById('message').value;
-                socket.emit('text', {'message': text, 'room': groupName, 'username': username});
-                document.getElementById('message').value = '';
-            };
-        });
-    </script>
-</head>
-<body>
-    <div class="chat-container">
-        <div id="messages" class="messages"></div>
-        <div class="chat-input">
-            <input type="text" id="message" placeholder="Type a message..." />
-            <button id="send">Send</button>
-        </div>
-    </div>
-</body>
-</html>
-"""
-
-def get_base64_image():
-    # Base64 encoding of your image
-    with open("images 1.png", "rb") as image_file:
-        return base64.b64encode(image_file.read()).decode('utf-8')
+# Static files served with a content hash in their URL so browsers cache them
+assets = AssetRegistry()
+assets.register('logo.png', 'images 1.png')
+for bundle in STATIC_BUNDLES:
+    assets.register(bundle, os.path.join(STATIC_BUNDLES_FOLDER, bundle))
+app.jinja_env.globals['asset_url'] = assets.url
+
+# Rendered once per asset version for /, /signin and /signup
+page_cache = PageCache(version=assets.version)
+
+# Compiled once here; routes render them by name
+register_templates(app, TEMPLATES)
+
+@app.route('/assets/<filename>')
+def asset(filename):
+    response = assets.response(app, request, filename)
+    if response is None:
+        abort(404)
+    return response
 
 @app.route('/')
+@page_cache.cached
 def index():
-    return render_template_string(welcome_template, logo_image=get_base64_image())
+    return render_template('welcome.html')
 
 @app.route('/signin', methods=['GET', 'POST'])
+@page_cache.cached
 def signin():
     if request.method == 'POST':
         username = request.form['username']
         password = request.form['password']
         hashed_password = hashlib.sha256(password.encode()).hexdigest()
 
-        if username in user_credentials and user_credentials[username] == hashed_password:
+        if storage.get_user(username) == hashed_password:
             response = redirect(url_for('available_groups'))
             response.set_cookie('username', username)
             return response
@@ -900,9 +332,10 @@ def signin():
             flash('Invalid credentials. Please sign up or check your username/password.', 'error')
             return redirect(url_for('signin'))
 
-    return render_template_string(signin_template)
+    return render_template('signin.html')
 
 @app.route('/signup', methods=['GET', 'POST'])
+@page_cache.cached
 def signup():
     if request.method == 'POST':
         username = request.form['username']
@@ -914,12 +347,11 @@ def signup():
             return redirect(url_for('signup'))
 
         hashed_password = hashlib.sha256(password.encode()).hexdigest()
-        user_credentials[username] = hashed_password
-        save_credentials(user_credentials)
+        storage.add_user(username, hashed_password)
         flash('Signed up successfully! Please sign in.', 'info')
         return redirect(url_for('signin'))
 
-    return render_template_string(signup_template)
+    return render_template('signup.html')
 
 @app.route('/available_groups', methods=['GET', 'POST'])
 def available_groups():
@@ -929,12 +361,13 @@ def available_groups():
 
     if request.method == 'POST':
         group_name = request.form['group_name']
-        groups.append({'name': group_name})
-        save_groups(groups)
+        storage.add_group(group_name)
         create_rabbitmq_exchange(group_name)
+        if message_log is not None:
+            message_log.create(group_name)
         return redirect(url_for('available_groups'))
 
-    return render_template_string(groups_template, groups=groups, profile_image=profile_image)
+    return render_template('groups.html', groups=storage.list_groups(), profile_image=profile_image)
 
 @app.route('/upload_profile_image', methods=['POST'])
 def upload_profile_image():
@@ -951,7 +384,7 @@ def upload_profile_image():
 def select_group():
     data = request.json
     group_name = data.get('group_name', None)
-    if group_name and any(group['name'] == group_name for group in groups):
+    if group_name and storage.group_exists(group_name):
         return jsonify({'status': 'success'})
     return jsonify({'status': 'error'})
 
@@ -959,19 +392,17 @@ def select_group():
 def delete_group():
     data = request.json
     group_name = data.get('group_name', None)
-    if group_name and any(group['name'] == group_name for group in groups):
-        groups[:] = [group for group in groups if group['name'] != group_name]
-        save_groups(groups)
+    if group_name and storage.delete_group(group_name):
         delete_rabbitmq_exchange(group_name)
+        if message_log is not None:
+            message_log.delete(group_name)
         return jsonify({'status': 'success'})
     return jsonify({'status': 'error'})
 
 @app.route('/delete_profile')
 def delete_profile():
     username = request.cookies.get('username', 'Guest')
-    if username in user_credentials:
-        del user_credentials[username]
-        save_credentials(user_credentials)
+    if storage.delete_user(username):
         profile_image_path = os.path.join(PROFILE_IMAGES_FOLDER, f'{username}.png')
         if os.path.exists(profile_image_path):
             os.remove(profile_image_path)
@@ -979,6 +410,23 @@ def delete_profile():
     response.delete_cookie('username')
     return response
 
+@app.route('/metrics/publish')
+def publish_metrics():
+    return jsonify(dict(publish_pipeline.stats(), confirms=confirm_publisher.stats(),
+                        spool=spooling_publisher.stats(), consumer=consumer_bridge.stats()))
+
+# Per-group disk usage of the message log; ?dry_run=1 adds what a retention
+# pass would remove right now without removing it
+@app.route('/metrics/history')
+def history_metrics():
+    if message_log is None:
+        return jsonify({'enabled': False})
+    metrics = {'enabled': True, 'groups': message_log.disk_usage(), 'log': message_log.stats(),
+               'compactor': history_compactor.stats()}
+    if request.args.get('dry_run'):
+        metrics['dry_run'] = history_compactor.run_once(dry_run=True)
+    return jsonify(metrics)
+
 @app.route('/proceed')
 def proceed():
     return "<h1>Welcome to the selected group chat!</h1>"
@@ -988,31 +436,104 @@ def profile():
     username = request.cookies.get('username', 'Guest')
     profile_image_path = os.path.join(PROFILE_IMAGES_FOLDER, f'{username}.png')
     profile_image = url_for('static', filename=f'profile_images/{username}.png') if os.path.exists(profile_image_path) else None
-    return render_template_string(profile_template, username=username, profile_image=profile_image)
+    return render_template('profile.html', username=username, profile_image=profile_image)
+
+# Function to decode one page of a room's logged messages, oldest first.
+# Only the page is decoded; the bodies are read straight from the mapped log.
+def history_page(group_name, before=None):
+    if message_log is None:
+        return [], None
+    entries = message_log.page(group_name, before=before, limit=CHAT_PAGE_SIZE)
+    messages = []
+    for offset, body in entries:
+        try:
+            message = wire.decode(body)
+        except wire.WireFormatError:
+            # One bad record shouldn't take the page down with it
+            app.logger.warning('Skipping an undecodable message at offset %d in %s', offset, group_name)
+            continue
+        messages.append({'username': message.sender, 'message': message.body, 'offset': offset})
+    return messages, entries[0][0] if entries else None
 
 @app.route('/chat/<group_name>')
 def chat(group_name):
     username = request.cookies.get('username', 'Guest')
-    return render_template_string(chat_template, group_name=group_name, username=username)
+    messages, oldest = history_page(group_name)
+    return render_template('chat.html', group_name=group_name, username=username,
+                                  messages=messages, oldest=oldest)
+
+@app.route('/chat/<group_name>/history')
+def chat_history(group_name):
+    before = request.args.get('before', type=int)
+    messages, oldest = history_page(group_name, before)
+    return jsonify({'messages': messages, 'oldest': oldest})
 
 @socketio.on('join')
 def on_join(data):
     username = data['username']
     room = data['room']
+    # Only existing groups get a consumer binding and a message log
+    if not isinstance(room, str) or not storage.group_exists(room):
+        return
     join_room(room)
+    if local_rooms.join(request.sid, room):
+        consumer_bridge.bind(*topology.route(room), topology.exchange_type)
+    since = data.get('since')
+    if history is not None and (message_log is None or since is not None):
+        socketio.start_background_task(replay_history, request.sid, room, since)
     emit('message', {'username': 'System', 'message': f'{username} has joined the room.'}, room=room)
 
+# Function to send a joining client the recent history of a room, or
+# everything from a stream offset the client already has
+def replay_history(sid, room, since=None):
+    try:
+        entries = history.replay(room, limit=HISTORY_REPLAY_LIMIT, since=since)
+    except Exception:
+        app.logger.exception('Could not replay history for %s', room)
+        return
+    for offset, body in entries:
+        try:
+            message = wire.decode(body)
+        except wire.WireFormatError:
+            app.logger.warning('Skipping an undecodable history record at %s in %s', offset, room)
+            continue
+        socketio.emit('message', {'username': message.sender, 'message': message.body, 'offset': offset}, to=sid)
+
+@socketio.on('leave')
+def on_leave(data):
+    room = data['room']
+    leave_room(room)
+    if local_rooms.leave(request.sid, room):
+        consumer_bridge.unbind(*topology.route(room), topology.exchange_type)
+
+@socketio.on('disconnect')
+def on_disconnect():
+    for room in local_rooms.disconnect(request.sid):
+        consumer_bridge.unbind(*topology.route(room), topology.exchange_type)
+
 @socketio.on('text')
 def on_text(data):
     message = data['message']
     room = data['room']
     username = data['username']
+    if not isinstance(room, str) or not storage.group_exists(room) or not ensure_exchange(room):
+        return
     
-    # Send the message to RabbitMQ
-    connection = pika.BlockingConnection(pika.ConnectionParameters(RABBITMQ_HOST))
-    channel = connection.channel()
-    channel.basic_publish(exchange=room, routing_key='', body=f'{username}: {message}')
-    connection.close()
+    # Hand the message to the background publisher so broker latency stays off the chat path
+    try:
+        envelope = wire.new_message(room, username, message)
+    except wire.WireFormatError:
+        # Never publish or log a message that can't be decoded again
+        return
+    body = wire.encode(envelope)
+    exchange, routing_key = topology.route(room)
+    if not publish_pipeline.submit(exchange, routing_key, body):
+        # Dropped under backpressure: tell only the sender instead of echoing
+        # a message nobody else will receive
+        emit('message', {'username': 'System', 'message': 'The server is busy, your message was not sent.'})
+        return
+    if message_log is not None:
+        message_log.append(room, body, envelope.timestamp)
     
     emit('message', {'username': username, 'message': message}, room=room)
 
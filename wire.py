@@ -0,0 +1,68 @@
+import time
+import uuid
+
+import msgspec
+
+# Bump when the envelope layout changes; decode() rejects other versions
+WIRE_VERSION = 1
+CONTENT_TYPE = 'application/x-msgpack'
+
+# Bit flags carried in ChatMessage.flags
+FLAG_SYSTEM = 1
+
+
+class WireFormatError(ValueError):
+    pass
+
+
+# Envelope for a chat message on the broker. array_like keeps field names off
+# the wire, so an encoded message is a short MessagePack array.
+class ChatMessage(msgspec.Struct, array_like=True, frozen=True):
+    version: int
+    id: bytes
+    room: str
+    sender: str
+    timestamp: int
+    body: str
+    flags: int = 0
+
+    @property
+    def is_system(self):
+        return bool(self.flags & FLAG_SYSTEM)
+
+
+_encoder = msgspec.msgpack.Encoder()
+_decoder = msgspec.msgpack.Decoder(ChatMessage)
+
+
+# Function to build a new envelope with a fresh id and a millisecond timestamp.
+# Struct construction doesn't check types, so client-supplied fields are
+# checked here; otherwise a bad payload would only fail when it is decoded.
+def new_message(room, sender, body, flags=0):
+    for field, value in (('room', room), ('sender', sender), ('body', body)):
+        if not isinstance(value, str):
+            raise WireFormatError(f'Chat message {field} must be a string, not {type(value).__name__}')
+    return ChatMessage(
+        version=WIRE_VERSION,
+        id=uuid.uuid4().bytes,
+        room=room,
+        sender=sender,
+        timestamp=time.time_ns() // 1_000_000,
+        body=body,
+        flags=flags,
+    )
+
+
+def encode(message):
+    return _encoder.encode(message)
+
+
+# Function to decode and validate an envelope received from the broker
+def decode(data):
+    try:
+        message = _decoder.decode(data)
+    except msgspec.DecodeError as e:
+        raise WireFormatError(f'Malformed chat message: {e}') from e
+    if message.version != WIRE_VERSION:
+        raise WireFormatError(f'Unsupported chat message version: {message.version}')
+    return message